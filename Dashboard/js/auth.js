@@ -0,0 +1,122 @@
+// Access tokens for the dashboard pages.
+// Every request to /api/ carries the stored token; a 401 asks for a login
+// once and retries. EventSource cannot send headers, so stream URLs carry
+// the token as ?access_token= instead.
+(function() {
+    const TOKEN_KEY = 'accessToken';
+    const USER_KEY = 'userName';
+    const LOGIN_PATH = '/api/users/login';
+    const nativeFetch = window.fetch.bind(window);
+    let pendingLogin = null;
+
+    function token() {
+        return localStorage.getItem(TOKEN_KEY);
+    }
+
+    function apiPath(url) {
+        const parsed = new URL(url, window.location.href);
+        return parsed.pathname.startsWith('/api/') ? parsed.pathname : null;
+    }
+
+    async function askForLogin() {
+        const username = window.prompt('Sign in to Journo - username or email:');
+        if (!username) {
+            return null;
+        }
+        const password = window.prompt('Password:');
+        if (password === null) {
+            return null;
+        }
+        const response = await nativeFetch(LOGIN_PATH, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ username: username, password: password })
+        });
+        if (!response.ok) {
+            window.alert('Sign in failed');
+            return null;
+        }
+        const body = await response.json();
+        localStorage.setItem(TOKEN_KEY, body.access_token);
+        localStorage.setItem(USER_KEY, body.user.username);
+        renderNav();
+        return body.access_token;
+    }
+
+    // Pages fire several requests at once; they share one prompt
+    function login() {
+        if (!pendingLogin) {
+            pendingLogin = askForLogin().finally(function() {
+                pendingLogin = null;
+            });
+        }
+        return pendingLogin;
+    }
+
+    function logout() {
+        localStorage.removeItem(TOKEN_KEY);
+        localStorage.removeItem(USER_KEY);
+        renderNav();
+    }
+
+    function withToken(init, value) {
+        const headers = new Headers((init && init.headers) || {});
+        if (value) {
+            headers.set('Authorization', `Bearer ${value}`);
+        }
+        return Object.assign({}, init, { headers: headers });
+    }
+
+    window.fetch = async function(input, init) {
+        const path = apiPath(typeof input === 'string' ? input : input.url);
+        if (!path || path === LOGIN_PATH) {
+            return nativeFetch(input, init);
+        }
+        let response = await nativeFetch(input, withToken(init, token()));
+        if (response.status === 401) {
+            localStorage.removeItem(TOKEN_KEY);
+            const fresh = await login();
+            if (fresh) {
+                response = await nativeFetch(input, withToken(init, fresh));
+            }
+        }
+        return response;
+    };
+
+    function streamUrl(url) {
+        const value = token();
+        if (!value) {
+            return url;
+        }
+        const separator = url.includes('?') ? '&' : '?';
+        return `${url}${separator}access_token=${encodeURIComponent(value)}`;
+    }
+
+    function renderNav() {
+        const container = document.getElementById('nav-auth');
+        if (!container) {
+            return;
+        }
+        container.innerHTML = '';
+        const link = document.createElement('a');
+        link.href = '#';
+        link.className = 'nav-auth-link';
+        const name = localStorage.getItem(USER_KEY);
+        if (token() && name) {
+            link.textContent = `Sign out (${name})`;
+            link.addEventListener('click', function(event) {
+                event.preventDefault();
+                logout();
+            });
+        } else {
+            link.textContent = 'Sign in';
+            link.addEventListener('click', function(event) {
+                event.preventDefault();
+                login();
+            });
+        }
+        container.appendChild(link);
+    }
+
+    window.Auth = { token: token, login: login, logout: logout, streamUrl: streamUrl, renderNav: renderNav };
+})();
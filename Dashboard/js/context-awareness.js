@@ -20,13 +20,12 @@ function initMap() {
 async function populateUserDropdown() {
     const select = document.getElementById('contextUserSelect');
     try {
-        const response = await fetch(`${API_BASE}/users`);
-        const users = await response.json();
+        const users = await UserDirectory.all(API_BASE);
         select.innerHTML = '';
         users.forEach(user => {
             const option = document.createElement('option');
             option.value = user.id;
-            option.textContent = user.username || `${user.first_name} ${user.last_name}`;
+            option.textContent = user.name;
             select.appendChild(option);
         });
         selectedUserId = users[0]?.id;
@@ -1,5 +1,7 @@
 document.addEventListener('DOMContentLoaded', function() {
     const API_BASE = '/api/dashboard';
+    const STREAM_URL = '/api/stream?topics=dashboard';
+    let metrics = null;
 
     async function fetchDashboardSummary() {
         try {
@@ -8,9 +10,11 @@ document.addEventListener('DOMContentLoaded', function() {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
             const summary = await response.json();
+            metrics = summary;
             updateDashboardMetrics(summary);
         } catch (error) {
             console.error("Could not fetch dashboard summary:", error);
+            metrics = null;
             const errorState = { total_users: 'N/A', total_trip_logs: 'N/A', total_data_points: 'N/A', analysis_hours: 'N/A' };
             updateDashboardMetrics(errorState);
         }
@@ -23,7 +27,35 @@ document.addEventListener('DOMContentLoaded', function() {
         document.getElementById('analysisHours').textContent = `${data.analysis_hours}h`;
     }
 
-    fetchDashboardSummary();
-});
+    function subscribeToUpdates() {
+        if (!window.EventSource) {
+            return;
+        }
+        const source = new EventSource(Auth.streamUrl(STREAM_URL));
+
+        // Counter deltas are applied to the last full summary
+        source.addEventListener('counters', function(event) {
+            if (!metrics) {
+                return;
+            }
+            const delta = JSON.parse(event.data).data;
+            Object.keys(delta).forEach(function(key) {
+                metrics[key] = (metrics[key] || 0) + delta[key];
+            });
+            updateDashboardMetrics(metrics);
+        });
 
+        source.addEventListener('resync', fetchDashboardSummary);
 
+        // EventSource reconnects on its own; re-fetch so missed deltas are not lost
+        let connected = false;
+        source.addEventListener('ready', function() {
+            if (connected) {
+                fetchDashboardSummary();
+            }
+            connected = true;
+        });
+    }
+
+    fetchDashboardSummary().then(subscribeToUpdates);
+});
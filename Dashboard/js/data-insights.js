@@ -187,8 +187,7 @@ async function populateUserDropdown() {
     const select = document.getElementById('insightsUserSelect');
     select.innerHTML = '<option value="">Loading users...</option>';
     try {
-        const res = await fetch(`${API_BASE}/users`);
-        const users = await res.json();
+        const users = await UserDirectory.all(API_BASE);
         select.innerHTML = '';
         if (users.length === 0) {
             select.innerHTML = '<option value="">No users found</option>';
@@ -198,7 +197,7 @@ async function populateUserDropdown() {
         users.forEach(user => {
             const opt = document.createElement('option');
             opt.value = user.id;
-            opt.textContent = user.username || (user.first_name + ' ' + user.last_name) || user.email;
+            opt.textContent = user.name;
             select.appendChild(opt);
         });
 
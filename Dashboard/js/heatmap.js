@@ -39,13 +39,12 @@ function initializeAppLogic() {
 
 async function populateUserDropdown() {
     try {
-        const response = await fetch(`${API_BASE}/users`);
-        const users = await response.json();
+        const users = await UserDirectory.all(API_BASE);
         userSelect.innerHTML = '';
         users.forEach(user => {
             const option = document.createElement('option');
             option.value = user.id;
-            option.textContent = user.username || `${user.first_name} ${user.last_name}`;
+            option.textContent = user.name;
             userSelect.appendChild(option);
         });
         selectedUserId = users[0]?.id;
@@ -62,44 +61,47 @@ async function updateHeatmap() {
 
     loader.classList.add('visible');
 
-    let url = `${API_BASE}/heatmap-data?user_id=${selectedUserId}&type=${selectedHeatmapType}`;
+    // Tiles are rendered and cached by the server; only the extent is fetched here
+    const userId = selectedUserId;
+    const type = selectedHeatmapType;
+    const tiles = new google.maps.ImageMapType({
+        getTileUrl: (coord, zoom) => {
+            const count = 1 << zoom;
+            if (coord.y < 0 || coord.y >= count) return null;
+            const x = ((coord.x % count) + count) % count;
+            return `${API_BASE}/heatmap/tiles/${userId}/${type}/${zoom}/${x}/${coord.y}.png`;
+        },
+        tileSize: new google.maps.Size(256, 256),
+        opacity: 0.8,
+        name: 'heatmap'
+    });
 
     try {
-        const response = await fetch(url);
-        const data = await response.json();
-        renderHeatmap(data);
+        const response = await fetch(`${API_BASE}/heatmap/bounds?user_id=${userId}`);
+        const { bounds } = await response.json();
+        renderHeatmap(tiles, bounds);
     } catch (error) {
-        console.error('Failed to fetch heatmap data:', error);
+        console.error('Failed to fetch heatmap bounds:', error);
     } finally {
         loader.classList.remove('visible');
     }
 }
 
-function renderHeatmap(data) {
+function renderHeatmap(tiles, bounds) {
     if (heatmap) {
-        heatmap.setMap(null);
+        const index = map.overlayMapTypes.getArray().indexOf(heatmap);
+        if (index >= 0) map.overlayMapTypes.removeAt(index);
     }
-
-    if (data && data.length > 0) {
-        const heatmapData = data.map(point => ({
-            location: new google.maps.LatLng(point[0], point[1]),
-            weight: point[2] || 0.5 // Provide a default weight if null
-        }));
-
-        heatmap = new google.maps.visualization.HeatmapLayer({
-            data: heatmapData,
-            map: map
-        });
-
-        // Auto-center the map on the new data
-        const bounds = new google.maps.LatLngBounds();
-        heatmapData.forEach(point => bounds.extend(point.location));
-        map.fitBounds(bounds);
-
-        // Customize heatmap appearance
-        heatmap.set('radius', 20);
-        heatmap.set('opacity', 0.7);
-        heatmap.set('dissipating', true);
+    heatmap = tiles;
+    map.overlayMapTypes.push(heatmap);
+
+    if (bounds) {
+        // Auto-center the map on the user's trips
+        const [minLat, minLng, maxLat, maxLng] = bounds;
+        map.fitBounds(new google.maps.LatLngBounds(
+            { lat: minLat, lng: minLng },
+            { lat: maxLat, lng: maxLng }
+        ));
     } else {
         // If no data, center on a default location
         map.setCenter({ lat: 19.0760, lng: 72.8777 });
@@ -7,13 +7,12 @@ document.addEventListener('DOMContentLoaded', () => {
 
     async function populateUserDropdown() {
         try {
-            const response = await fetch(`${API_BASE}/users`);
-            const users = await response.json();
+            const users = await UserDirectory.all(API_BASE);
             userSelect.innerHTML = ''; // Clear loading text
             users.forEach(user => {
                 const option = document.createElement('option');
                 option.value = user.id;
-                option.textContent = user.username || `${user.first_name} ${user.last_name}`;
+                option.textContent = user.name;
                 userSelect.appendChild(option);
             });
             selectedUserId = users[0]?.id;
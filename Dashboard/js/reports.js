@@ -8,9 +8,8 @@ document.addEventListener('DOMContentLoaded', function() {
 
     async function populateUserDropdown() {
         try {
-            const response = await fetch(`${API_BASE}/users`);
-            const users = await response.json();
-            userSelect.innerHTML = users.map(user => `<option value="${user.id}">${user.username}</option>`).join('');
+            const users = await UserDirectory.all(API_BASE);
+            userSelect.innerHTML = users.map(user => `<option value="${user.id}">${user.name}</option>`).join('');
         } catch (error) {
             console.error('Failed to load users:', error);
         }
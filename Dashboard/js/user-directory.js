@@ -0,0 +1,24 @@
+// Every user for the dashboard pickers.
+// /users/directory returns at most 1000 users per page; follow next_cursor
+// until it runs out so large installs list everyone.
+(function() {
+    const PAGE_SIZE = 1000;
+
+    async function all(apiBase) {
+        const users = [];
+        let cursor = null;
+        do {
+            const url = `${apiBase}/users/directory?limit=${PAGE_SIZE}` + (cursor ? `&cursor=${cursor}` : '');
+            const response = await fetch(url);
+            if (!response.ok) {
+                throw new Error(`User directory request failed: ${response.status}`);
+            }
+            const page = await response.json();
+            users.push(...page.users);
+            cursor = page.next_cursor;
+        } while (cursor);
+        return users;
+    }
+
+    window.UserDirectory = { all: all };
+})();
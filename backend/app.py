@@ -1,125 +1,230 @@
-from flask import Flask, request, jsonify
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
+from flask import Flask, jsonify, send_from_directory
 from flask_cors import CORS
 from dotenv import load_dotenv
 import os
+import threading
 from datetime import datetime
-import json
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Flask app
-app = Flask(__name__)
+from extensions import db, migrate
+from services import auth, db_routing, point_buffer, sharding
 
-# Configuration
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///smart_travel.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+_IMPORT_FINISHED = time.perf_counter()
 
-from extensions import db, migrate
+DASHBOARD_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../Dashboard'))
 
-# Initialize extensions
-db.init_app(app)
-migrate.init_app(app, db)
-CORS(app, origins=[
+CORS_ORIGINS = [
     "http://localhost:8080",  # Mobile App
     "http://localhost:3000",  # Dashboard
     "http://localhost:8000",  # Local static dashboard
     "https://yourdomain.com"  # Production
-])
-
-# Import models after db is initialized
-from models.user import User
-from models.trip import Trip
-from models.trip_point import TripPoint
-from models.ml_prediction import MLPrediction
-
-# Import routes
-from routes.context_routes import context_bp
-from routes.trip_routes import trip_bp
-from routes.user_routes import user_bp
-from routes.manual_trip_routes import manual_trip_bp
-from routes.ml_routes import ml_bp
-from routes.analytics_routes import analytics_bp
-from routes.heatmap_routes import heatmap_bp
-from routes.dashboard_routes import dashboard_bp
-
-# Register blueprints
-app.register_blueprint(context_bp, url_prefix='/api')
-app.register_blueprint(trip_bp, url_prefix='/api')
-app.register_blueprint(user_bp, url_prefix='/api')
-app.register_blueprint(manual_trip_bp, url_prefix='/api')
-app.register_blueprint(ml_bp, url_prefix='/api')
-app.register_blueprint(analytics_bp, url_prefix='/api')
-app.register_blueprint(heatmap_bp, url_prefix='/api')
-app.register_blueprint(dashboard_bp, url_prefix='/api/dashboard')
-
-# Serve Dashboard static files
-from flask import send_from_directory
-import os
-DASHBOARD_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../Dashboard'))
-
-@app.route('/dashboard/<path:filename>')
-def dashboard_static(filename):
-    return send_from_directory(DASHBOARD_DIR, filename)
-
-@app.route('/dashboard/')
-def dashboard_index():
-    return send_from_directory(DASHBOARD_DIR, 'data-insights.html')
-
-# MySQL init (optional, safe to run each start)
-try:
-    from init_mysql import run_mysql_init
-    run_mysql_init()
-except Exception as e:
-    print(f"[startup] MySQL init skipped: {e}")
-
-@app.route('/api/health')
-def health_check():
-    """Health check endpoint"""
-    return jsonify({
-        'status': 'healthy',
-        'timestamp': datetime.utcnow().isoformat(),
-        'version': '1.0.0'
-    })
-
-@app.route('/api/config')
-def get_config():
-    """Get frontend configuration"""
-    return jsonify({
-        'google_maps_api_key': os.getenv('GOOGLE_MAPS_API_KEY'),
-        'trip_detection': {
-            'min_speed': 1.0,
-            'max_idle_time': 300,
-            'min_trip_duration': 60,
-            'accuracy_threshold': 10
-        },
-        'co2_factors': {
-            'walking': 0.0,
-            'cycling': 0.0,
-            'bus': 0.08,
-            'car': 0.12,
-            'train': 0.04
-        },
-        'cost_factors': {
-            'walking': 0.0,
-            'cycling': 0.0,
-            'bus': 2.0,
-            'car': 5.0,
-            'train': 1.0
+]
+
+# Seconds the first request waits for the optional MySQL init before moving on
+MYSQL_INIT_TIMEOUT = float(os.getenv('MYSQL_INIT_TIMEOUT', '3'))
+
+
+def _register_models():
+    """Import models so their tables are known to db.metadata"""
+    from models.user import User
+    from models.trip import Trip
+    from models.trip_point import TripPoint
+    from models.ml_prediction import MLPrediction
+    from models.place import Place
+    from models.user_travel_profile import UserTravelProfile
+    from models.user_live_state import UserLiveState
+    from models.user_name_token import UserNameToken
+    from models.job import Job
+    from models.user_shard import UserShard
+    from models.id_block import IdBlock
+
+
+def _register_blueprints(app):
+    from routes.context_routes import context_bp
+    from routes.trip_routes import trip_bp
+    from routes.user_routes import user_bp
+    from routes.manual_trip_routes import manual_trip_bp
+    from routes.ml_routes import ml_bp
+    from routes.analytics_routes import analytics_bp
+    from routes.heatmap_routes import heatmap_bp
+    from routes.dashboard_routes import dashboard_bp
+    from routes.spatial_routes import spatial_bp
+    from routes.stream_routes import stream_bp, init_websocket
+    from routes.job_routes import job_bp
+    from routes.timeline_routes import timeline_bp
+
+    app.register_blueprint(context_bp, url_prefix='/api')
+    app.register_blueprint(trip_bp, url_prefix='/api')
+    app.register_blueprint(user_bp, url_prefix='/api')
+    app.register_blueprint(manual_trip_bp, url_prefix='/api')
+    app.register_blueprint(ml_bp, url_prefix='/api')
+    app.register_blueprint(analytics_bp, url_prefix='/api')
+    app.register_blueprint(heatmap_bp, url_prefix='/api')
+    app.register_blueprint(dashboard_bp, url_prefix='/api/dashboard')
+    app.register_blueprint(spatial_bp, url_prefix='/api')
+    app.register_blueprint(stream_bp, url_prefix='/api')
+    app.register_blueprint(job_bp, url_prefix='/api')
+    app.register_blueprint(timeline_bp, url_prefix='/api')
+    init_websocket(app)
+
+
+def _run_mysql_init():
+    try:
+        from init_mysql import run_mysql_init
+        run_mysql_init()
+    except Exception as e:
+        print(f"[startup] MySQL init skipped: {e}")
+
+
+def _defer_mysql_init(app):
+    """Run the optional MySQL init once, on the first request, for at most MYSQL_INIT_TIMEOUT"""
+    state = {'done': False}
+    lock = threading.Lock()
+
+    @app.before_request
+    def _mysql_init_once():
+        if state['done']:
+            return
+        with lock:
+            if state['done']:
+                return
+            state['done'] = True
+            # A daemon thread, so an unreachable server cannot hold the request past the timeout
+            worker = threading.Thread(target=_run_mysql_init, name='mysql-init', daemon=True)
+            worker.start()
+            worker.join(MYSQL_INIT_TIMEOUT)
+            if worker.is_alive():
+                print(f"[startup] MySQL init still running after {MYSQL_INIT_TIMEOUT:g}s; continuing without it")
+
+
+def _register_core_routes(app):
+    # Serve Dashboard static files
+    @app.route('/dashboard/<path:filename>')
+    def dashboard_static(filename):
+        return send_from_directory(DASHBOARD_DIR, filename)
+
+    @app.route('/dashboard/')
+    def dashboard_index():
+        return send_from_directory(DASHBOARD_DIR, 'data-insights.html')
+
+    @app.route('/api/health')
+    def health_check():
+        """Health check endpoint"""
+        health = {
+            'status': 'healthy',
+            'timestamp': datetime.utcnow().isoformat(),
+            'version': '1.0.0'
         }
-    })
-
-@app.errorhandler(404)
-def not_found(error):
-    return jsonify({'error': 'Not found'}), 404
-
-@app.errorhandler(500)
-def internal_error(error):
-    return jsonify({'error': 'Internal server error'}), 500
+        if db_routing.router.replicas:
+            health['replicas'] = [replica.to_dict() for replica in db_routing.router.replicas]
+        return jsonify(health)
+
+    @app.route('/api/config')
+    def get_config():
+        """Get frontend configuration"""
+        return jsonify({
+            'google_maps_api_key': os.getenv('GOOGLE_MAPS_API_KEY'),
+            'trip_detection': {
+                'min_speed': 1.0,
+                'max_idle_time': 300,
+                'min_trip_duration': 60,
+                'accuracy_threshold': 10
+            },
+            'co2_factors': {
+                'walking': 0.0,
+                'cycling': 0.0,
+                'bus': 0.08,
+                'car': 0.12,
+                'train': 0.04
+            },
+            'cost_factors': {
+                'walking': 0.0,
+                'cycling': 0.0,
+                'bus': 2.0,
+                'car': 5.0,
+                'train': 1.0
+            }
+        })
+
+    @app.errorhandler(404)
+    def not_found(error):
+        return jsonify({'error': 'Not found'}), 404
+
+    @app.errorhandler(500)
+    def internal_error(error):
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+def create_app(config=None):
+    """Application factory: configuration, extensions, models and every blueprint"""
+    timings = [('imports', _IMPORT_FINISHED - _IMPORT_STARTED)]
+    mark = time.perf_counter()
+
+    def lap(label):
+        nonlocal mark
+        now = time.perf_counter()
+        timings.append((label, now - mark))
+        mark = now
+
+    app = Flask(__name__)
+
+    # Configuration
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key')
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///smart_travel.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Read replicas (comma-separated URLs) become extra binds used for GET requests
+    app.config['SQLALCHEMY_BINDS'] = db_routing.replica_binds(
+        [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    )
+    # Shards (comma-separated URLs) hold the per-user tables of the users mapped to them
+    app.config['SQLALCHEMY_BINDS'].update(sharding.shard_binds(
+        [url.strip() for url in os.getenv('DATABASE_SHARD_URLS', '').split(',') if url.strip()]
+    ))
+    if config:
+        app.config.update(config)
+    lap('config')
+
+    # Initialize extensions; engines connect lazily on first use
+    db.init_app(app)
+    migrate.init_app(app, db)
+    db_routing.init_app(app, db)
+    auth.init_app(app)
+    sharding.init_app(app, db)
+    point_buffer.init_app(app)
+    CORS(app, origins=CORS_ORIGINS)
+    lap('extensions')
+
+    _register_models()
+    lap('models')
+
+    _register_blueprints(app)
+    _register_core_routes(app)
+    _defer_mysql_init(app)
+    lap('routes')
+
+    breakdown = ', '.join(f"{label} {seconds * 1000:.0f}" for label, seconds in timings)
+    print(f"[startup] app ready in {sum(s for _, s in timings) * 1000:.0f} ms ({breakdown} ms)")
+    return app
+
+
+app = create_app()
 
 if __name__ == '__main__':
+    from models import fixed_point
     with app.app_context():
+        fixed_point.check_schema(db.engines.values())
         db.create_all()
+    # The dev server runs job workers as threads (only in the reloader's serving child)
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        from services import jobs
+        jobs.start_worker_threads(app, int(os.getenv('JOBS_WORKERS', '1')))
+        # Replay points logged before a restart without waiting for new ones
+        point_buffer.start()
     port = int(os.getenv('PORT', '5000'))
-    app.run(debug=True, host='0.0.0.0', port=port)
\ No newline at end of file
+    app.run(debug=True, host='0.0.0.0', port=port)
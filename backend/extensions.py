@@ -1,7 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from services.sharding import ShardedSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': ShardedSession})
 migrate = Migrate()
 
 
@@ -0,0 +1,64 @@
+"""Gunicorn settings: the app is imported once in the master and forked into workers.
+
+    gunicorn -c gunicorn.conf.py app:app
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+# Threaded workers so long-lived /api/stream connections do not block other requests
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+
+# Import Flask, SQLAlchemy and every blueprint once in the master; workers fork ready to serve
+preload_app = True
+
+# Background job worker processes started next to the web workers; 0 to run them elsewhere
+job_workers = int(os.getenv('JOBS_WORKERS', '1'))
+
+
+def when_ready(server):
+    from app import app
+    from extensions import db
+    from models import fixed_point
+
+    # Refuse to serve (or start job workers) when NUMERIC_STORAGE disagrees with the schema
+    with app.app_context():
+        fixed_point.check_schema(db.engines.values())
+        for engine in db.engines.values():
+            engine.dispose()
+    if job_workers > 0:
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tools', 'job_worker.py')
+        server.job_supervisor = subprocess.Popen([sys.executable, script, '--processes', str(job_workers)])
+        server.log.info(f"[jobs] started {job_workers} job worker process(es)")
+
+
+def on_exit(server):
+    supervisor = getattr(server, 'job_supervisor', None)
+    if supervisor is not None:
+        supervisor.terminate()
+        supervisor.wait(30)
+
+
+def post_fork(server, worker):
+    """Give each worker its own connection pools instead of sockets inherited from the master"""
+    worker.forked_at = time.perf_counter()
+    from app import app
+    from extensions import db
+    from services import point_buffer
+
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    # Write-behind mode: replay points logged by workers that are gone
+    point_buffer.start()
+
+
+def post_worker_init(worker):
+    boot_ms = (time.perf_counter() - worker.forked_at) * 1000
+    worker.log.info(f"[startup] worker {worker.pid} booted in {boot_ms:.0f} ms")
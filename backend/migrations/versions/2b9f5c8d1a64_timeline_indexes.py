@@ -0,0 +1,33 @@
+"""index trips and manual trips on (user_id, start_time) for the timeline
+
+Revision ID: 2b9f5c8d1a64
+Revises: 7e2d94c1a5f3
+Create Date: 2026-10-19 21:12:40.318275
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b9f5c8d1a64'
+down_revision = '7e2d94c1a5f3'
+branch_labels = None
+depends_on = None
+
+
+def _has_manual_trips():
+    # manual_trip predates migrations on some installs and is created by create_all
+    return 'manual_trip' in sa.inspect(op.get_bind()).get_table_names()
+
+
+def upgrade():
+    op.create_index('ix_trips_user_start', 'trips', ['user_id', 'start_time'])
+    if _has_manual_trips():
+        op.create_index('ix_manual_trip_user_start', 'manual_trip', ['user_id', 'start_time'])
+
+
+def downgrade():
+    if _has_manual_trips():
+        op.drop_index('ix_manual_trip_user_start', table_name='manual_trip')
+    op.drop_index('ix_trips_user_start', table_name='trips')
@@ -0,0 +1,72 @@
+"""spatial cell columns on trips and trip_points
+
+Revision ID: 3f1c2a7d9b10
+Revises: d63868972843
+Create Date: 2026-10-19 09:12:41.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from services.geo import cell_id
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a7d9b10'
+down_revision = 'd63868972843'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 5000
+
+
+def _backfill(conn, table, columns):
+    """Populate Morton cell IDs for existing rows in id order"""
+    last_id = 0
+    while True:
+        rows = conn.execute(sa.text(
+            f"SELECT id, {', '.join(c for pair in columns.values() for c in pair)} FROM {table} "
+            f"WHERE id > :last_id ORDER BY id LIMIT :batch"
+        ), {'last_id': last_id, 'batch': BATCH_SIZE}).fetchall()
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            values = {'id': row[0]}
+            for i, target in enumerate(columns):
+                values[target] = cell_id(row[1 + 2 * i], row[2 + 2 * i])
+            updates.append(values)
+        assignments = ', '.join(f'{target} = :{target}' for target in columns)
+        conn.execute(sa.text(f"UPDATE {table} SET {assignments} WHERE id = :id"), updates)
+        last_id = rows[-1][0]
+
+
+def upgrade():
+    with op.batch_alter_table('trips') as batch_op:
+        batch_op.add_column(sa.Column('start_cell', sa.BigInteger(), nullable=True))
+        batch_op.add_column(sa.Column('end_cell', sa.BigInteger(), nullable=True))
+        batch_op.create_index('ix_trips_start_cell', ['start_cell'])
+        batch_op.create_index('ix_trips_end_cell', ['end_cell'])
+
+    with op.batch_alter_table('trip_points') as batch_op:
+        batch_op.add_column(sa.Column('cell', sa.BigInteger(), nullable=True))
+        batch_op.create_index('ix_trip_points_cell', ['cell'])
+
+    conn = op.get_bind()
+    _backfill(conn, 'trips', {
+        'start_cell': ('start_lat', 'start_lng'),
+        'end_cell': ('end_lat', 'end_lng')
+    })
+    _backfill(conn, 'trip_points', {'cell': ('latitude', 'longitude')})
+
+
+def downgrade():
+    with op.batch_alter_table('trip_points') as batch_op:
+        batch_op.drop_index('ix_trip_points_cell')
+        batch_op.drop_column('cell')
+
+    with op.batch_alter_table('trips') as batch_op:
+        batch_op.drop_index('ix_trips_end_cell')
+        batch_op.drop_index('ix_trips_start_cell')
+        batch_op.drop_column('end_cell')
+        batch_op.drop_column('start_cell')
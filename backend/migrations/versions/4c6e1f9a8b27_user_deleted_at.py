@@ -0,0 +1,25 @@
+"""users.deleted_at marks users whose data is being removed in the background
+
+Revision ID: 4c6e1f9a8b27
+Revises: 9d3b7e51a2c8
+Create Date: 2026-10-19 19:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c6e1f9a8b27'
+down_revision = '9d3b7e51a2c8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('deleted_at')
@@ -0,0 +1,36 @@
+"""user_travel_profiles table
+
+Revision ID: 5b08f2d1e947
+Revises: c7d93e0f4a62
+Create Date: 2026-10-19 15:32:10.276450
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b08f2d1e947'
+down_revision = 'c7d93e0f4a62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user_travel_profiles',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('trip_count', sa.Integer(), nullable=False),
+    sa.Column('hour_of_week', sa.JSON(), nullable=False),
+    sa.Column('destinations', sa.JSON(), nullable=False),
+    sa.Column('modes', sa.JSON(), nullable=False),
+    sa.Column('transitions', sa.JSON(), nullable=False),
+    sa.Column('last_place_id', sa.Integer(), nullable=True),
+    sa.Column('last_trip_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('user_travel_profiles')
@@ -0,0 +1,69 @@
+"""idempotent ingest: trip idempotency keys and unique (trip_id, timestamp) points
+
+Repeated points are deleted first (the oldest row of each pair is kept),
+in batches, so the unique indexes can be built. On large tables run
+``tools/point_partitions.py dedupe`` beforehand to do that online.
+
+Revision ID: 6d1e8a3f5b72
+Revises: 2b9f5c8d1a64
+Create Date: 2026-10-19 22:04:17.512930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6d1e8a3f5b72'
+down_revision = '2b9f5c8d1a64'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10000
+
+
+def _point_tables():
+    """trip_points plus per-period tables; native partitions follow their parent"""
+    names = sa.inspect(op.get_bind()).get_table_names()
+    tables = ['trip_points']
+    if op.get_bind().dialect.name != 'postgresql':
+        tables += sorted(name for name in names if name.startswith('trip_points_p'))
+    return tables
+
+
+def _index_name(table):
+    return 'uq_trip_points_trip_timestamp' if table == 'trip_points' else f'uq_{table}_trip_timestamp'
+
+
+def _dedupe(table):
+    bind = op.get_bind()
+    points = sa.table(table, sa.column('id'), sa.column('trip_id'), sa.column('timestamp'))
+    kept = points.alias('kept')
+    while True:
+        # Ids first: MySQL cannot delete from a table it selects from
+        ids = bind.execute(
+            sa.select(points.c.id).distinct().join(kept, sa.and_(
+                kept.c.trip_id == points.c.trip_id,
+                kept.c.timestamp == points.c.timestamp,
+                kept.c.id < points.c.id
+            )).limit(BATCH_SIZE)
+        ).scalars().all()
+        if not ids:
+            return
+        bind.execute(points.delete().where(points.c.id.in_(ids)))
+
+
+def upgrade():
+    op.add_column('trips', sa.Column('idempotency_key', sa.String(length=100), nullable=True))
+    op.create_index('uq_trips_user_idempotency_key', 'trips', ['user_id', 'idempotency_key'], unique=True)
+    for table in _point_tables():
+        _dedupe(table)
+        op.create_index(_index_name(table), table, ['trip_id', 'timestamp'], unique=True)
+
+
+def downgrade():
+    for table in _point_tables():
+        op.drop_index(_index_name(table), table_name=table)
+    op.drop_index('uq_trips_user_idempotency_key', table_name='trips')
+    with op.batch_alter_table('trips') as batch_op:
+        batch_op.drop_column('idempotency_key')
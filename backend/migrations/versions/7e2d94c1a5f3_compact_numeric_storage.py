@@ -0,0 +1,96 @@
+"""compact numeric storage: scaled-integer coordinates and metrics (opt-in)
+
+Applied with NUMERIC_STORAGE=compact, converts the NUMERIC coordinate and
+metric columns of trips, manual_trip, trip_points and its per-period
+tables to scaled integers (see models/fixed_point.py). Without it this
+revision changes nothing. Downgrading converts compact columns back.
+
+Revision ID: 7e2d94c1a5f3
+Revises: b51f0d7c3e94
+Create Date: 2026-10-19 20:31:52.604118
+
+"""
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e2d94c1a5f3'
+down_revision = 'b51f0d7c3e94'
+branch_labels = None
+depends_on = None
+
+# column: (precision, scale, compact scale, nullable)
+COORDINATES = {
+    'start_lat': (10, 8, 6, True), 'start_lng': (11, 8, 6, True),
+    'end_lat': (10, 8, 6, True), 'end_lng': (11, 8, 6, True)
+}
+METRICS = {
+    'distance_km': (8, 2, 2, True), 'co2_kg': (8, 2, 2, True), 'cost_usd': (8, 2, 2, True)
+}
+COLUMNS = {
+    'trips': {**COORDINATES, **METRICS, 'mode_confidence': (3, 2, 2, True)},
+    'manual_trip': {**COORDINATES, **METRICS},
+    'trip_points': {
+        'latitude': (10, 8, 6, False), 'longitude': (11, 8, 6, False),
+        'altitude': (8, 2, 2, True), 'accuracy': (8, 2, 2, True),
+        'speed': (8, 2, 2, True), 'heading': (5, 2, 2, True)
+    }
+}
+
+
+def _tables():
+    """Tables to convert, including trip_points period tables that exist"""
+    names = set(sa.inspect(op.get_bind()).get_table_names())
+    tables = {table: columns for table, columns in COLUMNS.items() if table in names}
+    if op.get_bind().dialect.name != 'postgresql':
+        # Native partitions follow their parent; per-period tables need their own pass
+        for name in names:
+            if name.startswith('trip_points_p'):
+                tables[name] = COLUMNS['trip_points']
+    return tables
+
+
+def _convert(table, columns, to_compact):
+    """Rewrite columns through a temporary column: add, fill scaled, drop, rename"""
+    # Columns the schema lacks (added to models outside migrations) are skipped
+    compact = {info['name']: isinstance(info['type'], sa.Integer)
+               for info in sa.inspect(op.get_bind()).get_columns(table)}
+    pending = {name: spec for name, spec in columns.items()
+               if name in compact and compact[name] != to_compact}
+    if not pending:
+        return
+    with op.batch_alter_table(table) as batch_op:
+        for name, (precision, scale, _, _) in pending.items():
+            new_type = sa.Integer() if to_compact else sa.Numeric(precision, scale)
+            batch_op.add_column(sa.Column(f'{name}_new', new_type, nullable=True))
+
+    assignments = []
+    for name, (_, _, compact_scale, _) in pending.items():
+        factor = 10 ** compact_scale
+        expression = f'ROUND({name} * {factor})' if to_compact else f'{name} / {float(factor)}'
+        assignments.append(f'{name}_new = {expression}')
+    op.execute(f"UPDATE {table} SET {', '.join(assignments)}")
+
+    with op.batch_alter_table(table) as batch_op:
+        for name in pending:
+            batch_op.drop_column(name)
+    with op.batch_alter_table(table) as batch_op:
+        for name, (precision, scale, _, nullable) in pending.items():
+            new_type = sa.Integer() if to_compact else sa.Numeric(precision, scale)
+            batch_op.alter_column(f'{name}_new', new_column_name=name, existing_type=new_type,
+                                  nullable=nullable)
+
+
+def upgrade():
+    if os.getenv('NUMERIC_STORAGE', 'decimal') != 'compact':
+        return
+    for table, columns in _tables().items():
+        _convert(table, columns, to_compact=True)
+
+
+def downgrade():
+    for table, columns in _tables().items():
+        _convert(table, columns, to_compact=False)
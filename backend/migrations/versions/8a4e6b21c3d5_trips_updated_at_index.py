@@ -0,0 +1,24 @@
+"""index trips.updated_at for incremental aggregate catch-up
+
+Revision ID: 8a4e6b21c3d5
+Revises: 3f1c2a7d9b10
+Create Date: 2026-10-19 11:40:03.552617
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a4e6b21c3d5'
+down_revision = '3f1c2a7d9b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_trips_updated_at', 'trips', ['updated_at'])
+
+
+def downgrade():
+    op.drop_index('ix_trips_updated_at', table_name='trips')
@@ -0,0 +1,52 @@
+"""user_name_tokens table for the user directory
+
+Revision ID: 9d3b7e51a2c8
+Revises: e2a4c6f80b13
+Create Date: 2026-10-19 18:02:14.507319
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d3b7e51a2c8'
+down_revision = 'e2a4c6f80b13'
+branch_labels = None
+depends_on = None
+
+
+def _tokens(*values):
+    tokens = set()
+    for value in values:
+        if not value:
+            continue
+        value = value.strip().lower()
+        tokens.add(value[:50])
+        tokens.update(word[:50] for word in re.findall(r'[^\W_]+', value))
+    tokens.discard('')
+    return tokens
+
+
+def upgrade():
+    tokens = op.create_table('user_name_tokens',
+    sa.Column('token', sa.String(length=50), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('token', 'user_id')
+    )
+    op.create_index('ix_user_name_tokens_user_id', 'user_name_tokens', ['user_id'])
+
+    # Backfill from existing users
+    conn = op.get_bind()
+    rows = conn.execute(sa.text('SELECT id, username, first_name, last_name FROM users')).fetchall()
+    values = [{'token': token, 'user_id': row[0]} for row in rows for token in _tokens(*row[1:])]
+    if values:
+        op.bulk_insert(tokens, values)
+
+
+def downgrade():
+    op.drop_index('ix_user_name_tokens_user_id', table_name='user_name_tokens')
+    op.drop_table('user_name_tokens')
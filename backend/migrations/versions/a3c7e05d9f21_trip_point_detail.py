@@ -0,0 +1,25 @@
+"""trips.point_detail: whether a trip's points were thinned or dropped by retention
+
+Revision ID: a3c7e05d9f21
+Revises: 6d1e8a3f5b72
+Create Date: 2026-10-19 23:10:44.207391
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c7e05d9f21'
+down_revision = '6d1e8a3f5b72'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('trips', sa.Column('point_detail', sa.String(length=10), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('trips') as batch_op:
+        batch_op.drop_column('point_detail')
@@ -0,0 +1,49 @@
+"""jobs table for the background job queue
+
+Revision ID: b51f0d7c3e94
+Revises: 4c6e1f9a8b27
+Create Date: 2026-10-19 19:48:05.271930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b51f0d7c3e94'
+down_revision = '4c6e1f9a8b27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'jobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=50), nullable=False),
+        sa.Column('key', sa.String(length=100), nullable=True),
+        sa.Column('payload', sa.JSON(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('priority', sa.Integer(), nullable=False),
+        sa.Column('run_at', sa.DateTime(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('max_attempts', sa.Integer(), nullable=False),
+        sa.Column('progress', sa.Float(), nullable=False),
+        sa.Column('message', sa.String(length=255), nullable=True),
+        sa.Column('result', sa.JSON(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('locked_by', sa.String(length=100), nullable=True),
+        sa.Column('locked_at', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_jobs_claim', 'jobs', ['status', 'priority', 'run_at'])
+    op.create_index('ix_jobs_key', 'jobs', ['key'])
+
+
+def downgrade():
+    op.drop_index('ix_jobs_key', table_name='jobs')
+    op.drop_index('ix_jobs_claim', table_name='jobs')
+    op.drop_table('jobs')
@@ -0,0 +1,35 @@
+"""jobs.user_id: the user a job works for
+
+Revision ID: b9e4f17a2c58
+Revises: f4b8d2c6e913
+Create Date: 2026-10-21 10:04:51.318842
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b9e4f17a2c58'
+down_revision = 'f4b8d2c6e913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('jobs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('user_id', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_jobs_user_id'), ['user_id'], unique=False)
+
+    # Jobs queued before the column existed name their user in the payload
+    jobs = sa.table('jobs', sa.column('id', sa.Integer), sa.column('user_id', sa.Integer), sa.column('payload', sa.JSON))
+    connection = op.get_bind()
+    for job_id, payload in connection.execute(sa.select(jobs.c.id, jobs.c.payload)).all():
+        if isinstance(payload, dict) and payload.get('user_id') is not None:
+            connection.execute(jobs.update().where(jobs.c.id == job_id).values(user_id=payload['user_id']))
+
+
+def downgrade():
+    with op.batch_alter_table('jobs', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_jobs_user_id'))
+        batch_op.drop_column('user_id')
@@ -0,0 +1,49 @@
+"""places table and trips.place_id
+
+Revision ID: c7d93e0f4a62
+Revises: 8a4e6b21c3d5
+Create Date: 2026-10-19 14:05:27.904113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d93e0f4a62'
+down_revision = '8a4e6b21c3d5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('places',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('lat', sa.Float(), nullable=False),
+    sa.Column('lng', sa.Float(), nullable=False),
+    sa.Column('cell', sa.BigInteger(), nullable=True),
+    sa.Column('label', sa.String(length=255), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_places_user_id', 'places', ['user_id'])
+    op.create_index('ix_places_cell', 'places', ['cell'])
+
+    with op.batch_alter_table('trips') as batch_op:
+        batch_op.add_column(sa.Column('place_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_trips_place_id', 'places', ['place_id'], ['id'])
+        batch_op.create_index('ix_trips_user_place', ['user_id', 'place_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('trips') as batch_op:
+        batch_op.drop_index('ix_trips_user_place')
+        batch_op.drop_constraint('fk_trips_place_id', type_='foreignkey')
+        batch_op.drop_column('place_id')
+
+    op.drop_index('ix_places_cell', table_name='places')
+    op.drop_index('ix_places_user_id', table_name='places')
+    op.drop_table('places')
@@ -0,0 +1,33 @@
+"""start_time indexes for time-sliced cohort scans
+
+Revision ID: d5a8c3e17f40
+Revises: b9e4f17a2c58
+Create Date: 2026-10-21 14:37:12.905126
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5a8c3e17f40'
+down_revision = 'b9e4f17a2c58'
+branch_labels = None
+depends_on = None
+
+
+def _has_manual_trips():
+    # manual_trip predates migrations on some installs and is created by create_all
+    return 'manual_trip' in sa.inspect(op.get_bind()).get_table_names()
+
+
+def upgrade():
+    op.create_index('ix_trips_start_time', 'trips', ['start_time'])
+    if _has_manual_trips():
+        op.create_index('ix_manual_trip_start_time', 'manual_trip', ['start_time'])
+
+
+def downgrade():
+    if _has_manual_trips():
+        op.drop_index('ix_manual_trip_start_time', table_name='manual_trip')
+    op.drop_index('ix_trips_start_time', table_name='trips')
@@ -0,0 +1,39 @@
+"""user_live_state table
+
+Revision ID: e2a4c6f80b13
+Revises: 5b08f2d1e947
+Create Date: 2026-10-19 16:48:55.031872
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a4c6f80b13'
+down_revision = '5b08f2d1e947'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user_live_state',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('trip_id', sa.Integer(), nullable=True),
+    sa.Column('lat', sa.Float(), nullable=False),
+    sa.Column('lng', sa.Float(), nullable=False),
+    sa.Column('cell', sa.BigInteger(), nullable=True),
+    sa.Column('speed', sa.Float(), nullable=True),
+    sa.Column('heading', sa.Float(), nullable=True),
+    sa.Column('mode', sa.String(length=20), nullable=True),
+    sa.Column('fix_time', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    op.create_index('ix_user_live_state_fix_time', 'user_live_state', ['fix_time'])
+
+
+def downgrade():
+    op.drop_index('ix_user_live_state_fix_time', table_name='user_live_state')
+    op.drop_table('user_live_state')
@@ -0,0 +1,39 @@
+"""user_shards map and id_blocks allocator for user-keyed sharding
+
+Revision ID: f4b8d2c6e913
+Revises: a3c7e05d9f21
+Create Date: 2026-10-20 09:12:37.604118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4b8d2c6e913'
+down_revision = 'a3c7e05d9f21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user_shards',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('shard', sa.String(length=50), nullable=False),
+    sa.Column('moving_to', sa.String(length=50), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    op.create_index('ix_user_shards_shard', 'user_shards', ['shard'])
+    op.create_table('id_blocks',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('next_id', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('id_blocks')
+    op.drop_index('ix_user_shards_shard', table_name='user_shards')
+    op.drop_table('user_shards')
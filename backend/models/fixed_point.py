@@ -0,0 +1,84 @@
+"""Column type for coordinates and metrics with an opt-in compact storage mode.
+
+NUMERIC_STORAGE=decimal (default) keeps the original NUMERIC(p, s) columns,
+which read back as Decimal. NUMERIC_STORAGE=compact stores the same values
+as scaled integers: coordinates as int32 microdegrees (~0.1 m) and metrics
+in hundredths. Values read back as float and written from any number.
+Comparisons and SUM() work on the integers, because bound parameters and
+results pass through the type. Model attributes and route code are the
+same in both modes.
+
+The mode must match the schema. Migration 7e2d94c1a5f3 converts the columns
+when it is applied with NUMERIC_STORAGE=compact, and converts them back on
+downgrade. The servers call check_schema() before serving and refuse to
+start on a mismatch, which would otherwise misread every stored value.
+"""
+
+import os
+
+from sqlalchemy import Integer, Numeric, inspect
+from sqlalchemy.types import TypeDecorator
+
+COMPACT = os.getenv('NUMERIC_STORAGE', 'decimal') == 'compact'
+
+COORDINATE_SCALE = 6
+METRIC_SCALE = 2
+
+
+class FixedPoint(TypeDecorator):
+    """NUMERIC(precision, scale), or an integer scaled by 10**compact_scale"""
+
+    impl = Numeric
+    cache_ok = True
+
+    def __init__(self, precision, scale, compact_scale):
+        super().__init__(precision, scale)
+        self.precision = precision
+        self.scale = scale
+        self.compact_scale = compact_scale
+        self.factor = 10 ** compact_scale
+
+    def load_dialect_impl(self, dialect):
+        if COMPACT:
+            return dialect.type_descriptor(Integer())
+        return dialect.type_descriptor(Numeric(self.precision, self.scale))
+
+    def process_bind_param(self, value, dialect):
+        if value is None or not COMPACT:
+            return value
+        return round(float(value) * self.factor)
+
+    def process_result_value(self, value, dialect):
+        if value is None or not COMPACT:
+            return value
+        return value / self.factor
+
+    def copy(self, **kw):
+        return FixedPoint(self.precision, self.scale, self.compact_scale)
+
+
+def Coordinate(precision=10, scale=8):
+    return FixedPoint(precision, scale, COORDINATE_SCALE)
+
+
+def Metric(precision=8, scale=2):
+    return FixedPoint(precision, scale, METRIC_SCALE)
+
+
+def check_schema(engines, table='trips', column='start_lat'):
+    """Raise RuntimeError when a database's column storage does not match NUMERIC_STORAGE.
+
+    Databases without the table yet (before the first migration) pass.
+    """
+    for engine in engines:
+        inspector = inspect(engine)
+        if not inspector.has_table(table):
+            continue
+        stored = next(c['type'] for c in inspector.get_columns(table) if c['name'] == column)
+        compact = isinstance(stored, Integer)
+        if compact != COMPACT:
+            raise RuntimeError(
+                f"NUMERIC_STORAGE={'compact' if COMPACT else 'decimal'} but {table}.{column} on "
+                f"{engine.url.render_as_string(hide_password=True)} is {stored}; set NUMERIC_STORAGE to "
+                f"match the schema or convert it with `flask db upgrade` / downgrade of 7e2d94c1a5f3"
+            )
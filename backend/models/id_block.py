@@ -0,0 +1,12 @@
+from extensions import db
+
+class IdBlock(db.Model):
+    """Next free id of a table whose ids are unique across shards (services/sharding.py)"""
+    
+    __tablename__ = 'id_blocks'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    next_id = db.Column(db.BigInteger, nullable=False)
+    
+    def __repr__(self):
+        return f'<IdBlock {self.name}: {self.next_id}>'
@@ -0,0 +1,53 @@
+from extensions import db
+from datetime import datetime
+
+class Job(db.Model):
+    """A unit of background work, claimed and run by the job workers (services/jobs.py)"""
+    
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_claim', 'status', 'priority', 'run_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    key = db.Column(db.String(100), index=True)  # de-duplicates queued/running work, e.g. user:42
+    user_id = db.Column(db.Integer, index=True)  # the user the job works for; None for fleet-wide jobs
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed, cancelled
+    priority = db.Column(db.Integer, nullable=False, default=0)  # higher runs first
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    progress = db.Column(db.Float, nullable=False, default=0.0)  # 0.0 to 1.0
+    message = db.Column(db.String(255))
+    result = db.Column(db.JSON)
+    error = db.Column(db.Text)
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)  # refreshed on progress; stale locks are reclaimed
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        """Convert job to dictionary"""
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'user_id': self.user_id,
+            'status': self.status,
+            'priority': self.priority,
+            'progress': round(self.progress or 0.0, 4),
+            'message': self.message,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'result': self.result,
+            'error': self.error,
+            'run_at': self.run_at.isoformat() if self.run_at else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+    
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.status}>'
@@ -1,24 +1,29 @@
 from extensions import db
+from models.fixed_point import Coordinate, Metric
 from datetime import datetime
 
 class ManualTrip(db.Model):
     __tablename__ = 'manual_trip'
+    __table_args__ = (
+        db.Index('ix_manual_trip_user_start', 'user_id', 'start_time'),
+        db.Index('ix_manual_trip_start_time', 'start_time'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     start_time = db.Column(db.DateTime, nullable=False)
     end_time = db.Column(db.DateTime)
-    start_lat = db.Column(db.Numeric(10, 8))
-    start_lng = db.Column(db.Numeric(11, 8))
-    end_lat = db.Column(db.Numeric(10, 8))
-    end_lng = db.Column(db.Numeric(11, 8))
+    start_lat = db.Column(Coordinate(10, 8))
+    start_lng = db.Column(Coordinate(11, 8))
+    end_lat = db.Column(Coordinate(10, 8))
+    end_lng = db.Column(Coordinate(11, 8))
     start_address = db.Column(db.String(255))
     end_address = db.Column(db.String(255))
-    distance_km = db.Column(db.Numeric(8, 2))
+    distance_km = db.Column(Metric(8, 2))
     duration_minutes = db.Column(db.Integer)
     mode = db.Column(db.String(20), nullable=False)
-    co2_kg = db.Column(db.Numeric(8, 2))
-    cost_usd = db.Column(db.Numeric(8, 2))
+    co2_kg = db.Column(Metric(8, 2))
+    cost_usd = db.Column(Metric(8, 2))
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
@@ -0,0 +1,31 @@
+from extensions import db
+from datetime import datetime
+
+class Place(db.Model):
+    """A user's frequently visited location, found by clustering trip ends"""
+    
+    __tablename__ = 'places'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    lat = db.Column(db.Float, nullable=False)
+    lng = db.Column(db.Float, nullable=False)
+    cell = db.Column(db.BigInteger, index=True)  # Morton-coded, see services/geo.py
+    label = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        """Convert place to dictionary"""
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'lat': self.lat,
+            'lng': self.lng,
+            'label': self.label,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+    
+    def __repr__(self):
+        return f'<Place {self.id}: ({self.lat}, {self.lng}) {self.label}>'
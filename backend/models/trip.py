@@ -1,32 +1,45 @@
 from extensions import db
+from models.fixed_point import Coordinate, Metric
 from datetime import datetime
 from decimal import Decimal
+from services.geo import cell_id
 
 class Trip(db.Model):
     """Trip model for storing travel data"""
     
     __tablename__ = 'trips'
+    __table_args__ = (
+        db.Index('ix_trips_user_place', 'user_id', 'place_id'),
+        db.Index('ix_trips_user_start', 'user_id', 'start_time'),
+        db.Index('ix_trips_start_time', 'start_time'),  # time-sliced cohort scans
+        db.Index('uq_trips_user_idempotency_key', 'user_id', 'idempotency_key', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     start_time = db.Column(db.DateTime, nullable=False)
     end_time = db.Column(db.DateTime)
-    start_lat = db.Column(db.Numeric(10, 8))
-    start_lng = db.Column(db.Numeric(11, 8))
-    end_lat = db.Column(db.Numeric(10, 8))
-    end_lng = db.Column(db.Numeric(11, 8))
+    start_lat = db.Column(Coordinate(10, 8))
+    start_lng = db.Column(Coordinate(11, 8))
+    end_lat = db.Column(Coordinate(10, 8))
+    end_lng = db.Column(Coordinate(11, 8))
     start_address = db.Column(db.String(255))
     end_address = db.Column(db.String(255))
-    distance_km = db.Column(db.Numeric(8, 2))
+    start_cell = db.Column(db.BigInteger, index=True)  # Morton-coded, see services/geo.py
+    end_cell = db.Column(db.BigInteger, index=True)
+    place_id = db.Column(db.Integer, db.ForeignKey('places.id'))  # clustered destination
+    distance_km = db.Column(Metric(8, 2))
     duration_minutes = db.Column(db.Integer)
     mode = db.Column(db.String(20), nullable=False)  # walking, cycling, bus, car, train
-    mode_confidence = db.Column(db.Numeric(3, 2))  # 0.00 to 1.00
-    co2_kg = db.Column(db.Numeric(8, 2))  # kg CO2
-    cost_usd = db.Column(db.Numeric(8, 2))
+    mode_confidence = db.Column(Metric(3, 2))  # 0.00 to 1.00
+    co2_kg = db.Column(Metric(8, 2))  # kg CO2
+    cost_usd = db.Column(Metric(8, 2))
     is_manual = db.Column(db.Boolean, default=False)
     notes = db.Column(db.Text)
+    idempotency_key = db.Column(db.String(100))  # Idempotency-Key of the creating request
+    point_detail = db.Column(db.String(10))  # None (full), thinned or dropped; see services/point_retention.py
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
     # Relationships
     trip_points = db.relationship('TripPoint', backref='trip', lazy=True, cascade='all, delete-orphan')
@@ -52,6 +65,7 @@ class Trip(db.Model):
         self.is_manual = is_manual
         self.notes = notes
         self.end_time = end_time
+        self.calculate_cells()
     
     def calculate_co2_kg(self):
         """Calculate CO2 emissions based on mode and distance"""
@@ -87,6 +101,11 @@ class Trip(db.Model):
         self.cost_usd = float(self.distance_km) * factor
         return self.cost_usd
     
+    def calculate_cells(self):
+        """Refresh the spatial cell IDs from the start/end coordinates"""
+        self.start_cell = cell_id(self.start_lat, self.start_lng)
+        self.end_cell = cell_id(self.end_lat, self.end_lng)
+    
     def calculate_duration(self):
         """Calculate trip duration in minutes"""
         if self.start_time and self.end_time:
@@ -110,7 +129,8 @@ class Trip(db.Model):
             'end_location': {
                 'lat': float(self.end_lat) if self.end_lat else None,
                 'lng': float(self.end_lng) if self.end_lng else None,
-                'address': self.end_address
+                'address': self.end_address,
+                'place_id': self.place_id
             },
             'distance_km': float(self.distance_km) if self.distance_km else None,
             'duration_minutes': self.duration_minutes,
@@ -120,6 +140,7 @@ class Trip(db.Model):
             'cost_usd': float(self.cost_usd) if self.cost_usd else None,
             'is_manual': self.is_manual,
             'notes': self.notes,
+            'point_detail': self.point_detail or 'full',
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
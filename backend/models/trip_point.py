@@ -1,19 +1,26 @@
 from extensions import db
+from models.fixed_point import Coordinate, Metric
 from datetime import datetime
+from services.geo import cell_id
 
 class TripPoint(db.Model):
     """TripPoint model for storing GPS coordinates during trip tracking"""
     
     __tablename__ = 'trip_points'
+    __table_args__ = (
+        # One fix per trip and instant; retried uploads are ignored on insert
+        db.Index('uq_trip_points_trip_timestamp', 'trip_id', 'timestamp', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     trip_id = db.Column(db.Integer, db.ForeignKey('trips.id'), nullable=False)
-    latitude = db.Column(db.Numeric(10, 8), nullable=False)
-    longitude = db.Column(db.Numeric(11, 8), nullable=False)
-    altitude = db.Column(db.Numeric(8, 2))
-    accuracy = db.Column(db.Numeric(8, 2))
-    speed = db.Column(db.Numeric(8, 2))  # m/s
-    heading = db.Column(db.Numeric(5, 2))  # degrees
+    latitude = db.Column(Coordinate(10, 8), nullable=False)
+    longitude = db.Column(Coordinate(11, 8), nullable=False)
+    altitude = db.Column(Metric(8, 2))
+    accuracy = db.Column(Metric(8, 2))
+    speed = db.Column(Metric(8, 2))  # m/s
+    heading = db.Column(Metric(5, 2))  # degrees
+    cell = db.Column(db.BigInteger, index=True)  # Morton-coded, see services/geo.py
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     
     def __init__(self, trip_id, latitude, longitude, altitude=None, accuracy=None, 
@@ -25,6 +32,7 @@ class TripPoint(db.Model):
         self.accuracy = accuracy
         self.speed = speed
         self.heading = heading
+        self.cell = cell_id(latitude, longitude)
         if timestamp:
             self.timestamp = timestamp
     
@@ -15,16 +15,22 @@ class User(db.Model):
     last_name = db.Column(db.String(50))
     phone = db.Column(db.String(20))
     is_active = db.Column(db.Boolean, default=True)
+    deleted_at = db.Column(db.DateTime)  # set while the user's data is removed in the background
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
     trips = db.relationship('Trip', backref='user', lazy=True, cascade='all, delete-orphan')
     
-    def __init__(self, username, email, password, first_name=None, last_name=None, phone=None):
+    def __init__(self, username, email, password=None, first_name=None, last_name=None, phone=None,
+                 password_hash=None):
         self.username = username
         self.email = email
-        self.set_password(password)
+        # Request handlers hash on the auth pool and pass the result in
+        if password_hash is not None:
+            self.password_hash = password_hash
+        else:
+            self.set_password(password)
         self.first_name = first_name
         self.last_name = last_name
         self.phone = phone
@@ -47,6 +53,7 @@ class User(db.Model):
             'last_name': self.last_name,
             'phone': self.phone,
             'is_active': self.is_active,
+            'deleting': self.deleted_at is not None,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
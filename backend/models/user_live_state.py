@@ -0,0 +1,34 @@
+from extensions import db
+from datetime import datetime
+
+class UserLiveState(db.Model):
+    """Latest known position of each user, upserted as GPS fixes arrive"""
+    
+    __tablename__ = 'user_live_state'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    trip_id = db.Column(db.Integer)  # trip in progress, NULL once it closes
+    lat = db.Column(db.Float, nullable=False)
+    lng = db.Column(db.Float, nullable=False)
+    cell = db.Column(db.BigInteger)  # Morton-coded, see services/geo.py
+    speed = db.Column(db.Float)  # m/s
+    heading = db.Column(db.Float)
+    mode = db.Column(db.String(20))
+    fix_time = db.Column(db.DateTime, nullable=False, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        """Convert live state to dictionary"""
+        return {
+            'user_id': self.user_id,
+            'trip_id': self.trip_id,
+            'lat': self.lat,
+            'lng': self.lng,
+            'speed': self.speed,
+            'heading': self.heading,
+            'mode': self.mode,
+            'fix_time': self.fix_time.isoformat() if self.fix_time else None
+        }
+    
+    def __repr__(self):
+        return f'<UserLiveState {self.user_id}: ({self.lat}, {self.lng}) at {self.fix_time}>'
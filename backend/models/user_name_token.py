@@ -0,0 +1,12 @@
+from extensions import db
+
+class UserNameToken(db.Model):
+    """Lower-cased name fragments of a user, indexed for prefix search in the user directory"""
+    
+    __tablename__ = 'user_name_tokens'
+    
+    token = db.Column(db.String(50), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True, index=True)
+    
+    def __repr__(self):
+        return f'<UserNameToken {self.token} -> {self.user_id}>'
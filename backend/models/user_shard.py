@@ -0,0 +1,15 @@
+from extensions import db
+from datetime import datetime
+
+class UserShard(db.Model):
+    """Which shard holds a user's data (services/sharding.py); users without a row are on the primary"""
+    
+    __tablename__ = 'user_shards'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    shard = db.Column(db.String(50), nullable=False, index=True)
+    moving_to = db.Column(db.String(50))  # set while a move copies the user's rows; writes wait
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<UserShard {self.user_id}: {self.shard}>'
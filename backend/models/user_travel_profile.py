@@ -0,0 +1,48 @@
+from extensions import db
+from datetime import datetime
+
+class UserTravelProfile(db.Model):
+    """Running per-user travel pattern counters, updated as each trip closes"""
+    
+    __tablename__ = 'user_travel_profiles'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    trip_count = db.Column(db.Integer, nullable=False, default=0)
+    hour_of_week = db.Column(db.JSON, nullable=False)  # 168 counts, Monday 00:00 first
+    destinations = db.Column(db.JSON, nullable=False)  # {place_id: count}
+    modes = db.Column(db.JSON, nullable=False)  # {mode: count}
+    transitions = db.Column(db.JSON, nullable=False)  # {"slot:from_place": {to_place: count}}
+    last_place_id = db.Column(db.Integer)
+    last_trip_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.reset()
+    
+    def reset(self):
+        """Clear all counters"""
+        self.trip_count = 0
+        self.hour_of_week = [0] * 168
+        self.destinations = {}
+        self.modes = {}
+        self.transitions = {}
+        self.last_place_id = None
+        self.last_trip_at = None
+    
+    def to_dict(self):
+        """Convert profile to dictionary"""
+        return {
+            'user_id': self.user_id,
+            'trip_count': self.trip_count,
+            'hour_of_week': self.hour_of_week,
+            'destinations': self.destinations,
+            'modes': self.modes,
+            'transitions': self.transitions,
+            'last_place_id': self.last_place_id,
+            'last_trip_at': self.last_trip_at.isoformat() if self.last_trip_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+    
+    def __repr__(self):
+        return f'<UserTravelProfile {self.user_id}: {self.trip_count} trips>'
@@ -1,17 +1,33 @@
 from flask import Blueprint, request, jsonify
 from extensions import db
 from models.trip import Trip
-from models.user import User
-from sqlalchemy import func, extract, and_
+from models.place import Place
+from services.place_clustering import recluster_user
+from services.travel_profile import get_profile, predict_next, rebuild_profile
+from services import auth, cohort_analytics, query_budget, timeline
+from services.od_matrix import od_engine, DEFAULT_ZONE_LEVEL, MIN_ZONE_LEVEL, MAX_ZONE_LEVEL, TIME_BINS
+from sqlalchemy import func, extract, and_, case
 from datetime import datetime, timedelta
 import json
 import os
-import mysql.connector
 
 analytics_bp = Blueprint('analytics', __name__)
 
 
+def _places_by_id(place_ids):
+    if not place_ids:
+        return {}
+    return {p.id: p for p in Place.query.filter(Place.id.in_(place_ids)).all()}
+
+
+def _place_label(place):
+    return place.label or f'{place.lat:.4f}, {place.lng:.4f}'
+
+
 def get_mysql_conn():
+    # Imported here so the driver does not slow down worker startup
+    import mysql.connector
+
     return mysql.connector.connect(
         host=os.environ.get('MYSQL_HOST', 'localhost'),
         user=os.environ.get('MYSQL_USER', 'root'),
@@ -43,6 +59,7 @@ def mysql_summary():
         return jsonify({'error': str(e)}), 500
 
 @analytics_bp.route('/analytics/summary', methods=['GET'])
+@query_budget.budget()
 def get_analytics_summary():
     """Get analytics summary for a user"""
     user_id = request.args.get('user_id', type=int)
@@ -50,39 +67,36 @@ def get_analytics_summary():
         return jsonify({'error': 'user_id is required'}), 400
     
     # Check if user exists
-    user = User.query.get(user_id)
-    if not user:
+    if not auth.principal(user_id):
         return jsonify({'error': 'User not found'}), 404
     
     # Get date range
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
     
-    # Build base query
-    query = Trip.query.filter_by(user_id=user_id)
+    start_dt = datetime.fromisoformat(start_date.replace('Z', '+00:00')) if start_date else None
+    end_dt = datetime.fromisoformat(end_date.replace('Z', '+00:00')) if end_date else None
     
-    if start_date:
-        start_dt = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-        query = query.filter(Trip.start_time >= start_dt)
-    
-    if end_date:
-        end_dt = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-        query = query.filter(Trip.start_time <= end_dt)
+    # Trips and manual trips together, filtered inside each branch
+    where = timeline.range_filter(user_id, start_dt, end_dt)
+    trips = timeline.entries(where)
     
     # Get basic stats
-    total_trips = query.count()
-    total_distance = query.with_entities(func.sum(Trip.distance_km)).scalar() or 0
-    total_duration = query.with_entities(func.sum(Trip.duration_minutes)).scalar() or 0
-    total_co2 = query.with_entities(func.sum(Trip.co2_kg)).scalar() or 0
-    total_cost = query.with_entities(func.sum(Trip.cost_usd)).scalar() or 0
+    total_trips, total_distance, total_duration, total_co2, total_cost = db.session.query(
+        func.count(trips.c.id),
+        func.sum(trips.c.distance_km),
+        func.sum(trips.c.duration_minutes),
+        func.sum(trips.c.co2_kg),
+        func.sum(trips.c.cost_usd)
+    ).one()
     
     # Get mode distribution
-    mode_stats = query.with_entities(
-        Trip.mode,
-        func.count(Trip.id).label('count'),
-        func.sum(Trip.distance_km).label('total_distance'),
-        func.avg(Trip.duration_minutes).label('avg_duration')
-    ).group_by(Trip.mode).all()
+    mode_stats = db.session.query(
+        trips.c.mode,
+        func.count(trips.c.id).label('count'),
+        func.sum(trips.c.distance_km).label('total_distance'),
+        func.avg(trips.c.duration_minutes).label('avg_duration')
+    ).group_by(trips.c.mode).all()
     
     mode_distribution = []
     for mode, count, distance, avg_duration in mode_stats:
@@ -95,14 +109,15 @@ def get_analytics_summary():
     
     # Get daily travel time ranges for the last 30 days
     thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-    daily_travel_times = query.filter(
-        Trip.start_time >= thirty_days_ago,
-        Trip.end_time.isnot(None)
-    ).with_entities(
-        func.date(Trip.start_time).label('date'),
-        func.min(extract('hour', Trip.start_time)).label('min_start_hour'),
-        func.max(extract('hour', Trip.end_time)).label('max_end_hour')
-    ).group_by(func.date(Trip.start_time)).order_by(func.date(Trip.start_time)).all()
+    recent = timeline.entries(lambda table: where(table) + [
+        table.c.start_time >= thirty_days_ago,
+        table.c.end_time.isnot(None)
+    ])
+    daily_travel_times = db.session.query(
+        func.date(recent.c.start_time).label('date'),
+        func.min(extract('hour', recent.c.start_time)).label('min_start_hour'),
+        func.max(extract('hour', recent.c.end_time)).label('max_end_hour')
+    ).group_by(func.date(recent.c.start_time)).order_by(func.date(recent.c.start_time)).all()
 
     daily_data = []
     for date, min_hour, max_hour in daily_travel_times:
@@ -116,48 +131,53 @@ def get_analytics_summary():
     return jsonify({
         'summary': {
             'total_trips': total_trips,
-            'total_distance_km': float(total_distance),
-            'total_duration_minutes': total_duration,
-            'total_co2_kg': float(total_co2),
-            'total_cost_usd': float(total_cost)
+            'total_distance_km': float(total_distance or 0),
+            'total_duration_minutes': total_duration or 0,
+            'total_co2_kg': float(total_co2 or 0),
+            'total_cost_usd': float(total_cost or 0)
         },
         'mode_distribution': mode_distribution,
         'daily_trips': daily_data
     })
 
 @analytics_bp.route('/analytics/heatmap', methods=['GET'])
+@query_budget.budget()
 def get_heatmap_data():
     """Get heatmap data for visualization"""
     user_id = request.args.get('user_id', type=int)
     if not user_id:
         return jsonify({'error': 'user_id is required'}), 400
     
-    # Get all trip start and end points
-    trips = Trip.query.filter_by(user_id=user_id).filter(
-        and_(Trip.start_lat.isnot(None), Trip.start_lng.isnot(None))
-    ).all()
+    # Get all trip start and end points, manual trips included
+    trips = timeline.entries(lambda table: timeline.range_filter(user_id)(table) + [
+        table.c.start_lat.isnot(None), table.c.start_lng.isnot(None)
+    ])
+    rows = query_budget.fetch_all(db.session.query(
+        trips.c.start_lat, trips.c.start_lng, trips.c.end_lat, trips.c.end_lng,
+        trips.c.mode, trips.c.start_time, trips.c.end_time
+    ))
     
     heatmap_data = []
     
-    for trip in trips:
+    for start_lat, start_lng, end_lat, end_lng, mode, start_time, end_time in rows:
         # Add start point
-        if trip.start_lat and trip.start_lng:
+        if start_lat and start_lng:
             heatmap_data.append({
-                'lat': float(trip.start_lat),
-                'lng': float(trip.start_lng),
+                'lat': float(start_lat),
+                'lng': float(start_lng),
                 'type': 'start',
-                'mode': trip.mode,
-                'timestamp': trip.start_time.isoformat()
+                'mode': mode,
+                'timestamp': start_time.isoformat()
             })
         
         # Add end point
-        if trip.end_lat and trip.end_lng:
+        if end_lat and end_lng:
             heatmap_data.append({
-                'lat': float(trip.end_lat),
-                'lng': float(trip.end_lng),
+                'lat': float(end_lat),
+                'lng': float(end_lng),
                 'type': 'end',
-                'mode': trip.mode,
-                'timestamp': trip.end_time.isoformat() if trip.end_time else trip.start_time.isoformat()
+                'mode': mode,
+                'timestamp': end_time.isoformat() if end_time else start_time.isoformat()
             })
     
     return jsonify({
@@ -172,12 +192,13 @@ def get_predictions():
     if not user_id:
         return jsonify({'error': 'user_id is required'}), 400
     
-    # Get recent trips for pattern analysis
-    recent_trips = Trip.query.filter_by(user_id=user_id).order_by(
-        Trip.start_time.desc()
-    ).limit(100).all()
+    # Patterns come from the user's running profile: one row, full history
+    # (built from the trips on first use)
+    profile = get_profile(user_id)
+    if profile is None:
+        return jsonify({'error': 'User not found'}), 404
     
-    if not recent_trips:
+    if not profile.trip_count:
         return jsonify({'error': 'Insufficient data for predictions'}), 400
     
     # Simple prediction logic (can be enhanced with ML)
@@ -189,37 +210,32 @@ def get_predictions():
     
     # Analyze peak hours
     hour_counts = {}
-    for trip in recent_trips:
-        hour = trip.start_time.hour
-        hour_counts[hour] = hour_counts.get(hour, 0) + 1
+    for slot, count in enumerate(profile.hour_of_week):
+        if count:
+            hour_counts[slot % 24] = hour_counts.get(slot % 24, 0) + count
     
     # Get top 3 peak hours
     peak_hours = sorted(hour_counts.items(), key=lambda x: x[1], reverse=True)[:3]
     predictions['peak_hours'] = [{'hour': hour, 'frequency': count} for hour, count in peak_hours]
     
-    # Analyze destinations
-    destination_counts = {}
-    for trip in recent_trips:
-        if trip.end_address:
-            dest = trip.end_address
-            destination_counts[dest] = destination_counts.get(dest, 0) + 1
-    
-    # Get top 5 destinations
-    top_destinations = sorted(destination_counts.items(), key=lambda x: x[1], reverse=True)[:5]
+    # Get top 5 destinations by clustered place
+    top_destinations = sorted(profile.destinations.items(), key=lambda x: x[1], reverse=True)[:5]
+    places = _places_by_id([int(place_id) for place_id, _ in top_destinations])
     predictions['likely_destinations'] = [
-        {'address': dest, 'frequency': count} for dest, count in top_destinations
+        {
+            'place_id': int(place_id),
+            'address': _place_label(places[int(place_id)]),
+            'lat': places[int(place_id)].lat,
+            'lng': places[int(place_id)].lng,
+            'frequency': count
+        }
+        for place_id, count in top_destinations if int(place_id) in places
     ]
     
-    # Analyze mode usage
-    mode_counts = {}
-    for trip in recent_trips:
-        mode = trip.mode
-        mode_counts[mode] = mode_counts.get(mode, 0) + 1
-    
     # Get mode recommendations
-    total_trips = len(recent_trips)
+    total_trips = profile.trip_count
     mode_recommendations = []
-    for mode, count in mode_counts.items():
+    for mode, count in profile.modes.items():
         percentage = (count / total_trips) * 100
         mode_recommendations.append({
             'mode': mode,
@@ -235,7 +251,50 @@ def get_predictions():
     
     return jsonify(predictions)
 
+@analytics_bp.route('/analytics/predict-next', methods=['GET'])
+def get_next_trip_prediction():
+    """Predict the user's next destination from their place transition history"""
+    user_id = request.args.get('user_id', type=int)
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+    
+    at = None
+    if request.args.get('at'):
+        try:
+            at = datetime.fromisoformat(request.args['at'].replace('Z', '+00:00'))
+        except ValueError:
+            return jsonify({'error': 'Invalid at format'}), 400
+    
+    profile = get_profile(user_id)
+    if profile is None:
+        return jsonify({'error': 'User not found'}), 404
+    if not profile.destinations:
+        return jsonify({'error': 'Insufficient data for predictions'}), 400
+    
+    place_ids = {int(place_id) for place_id in profile.destinations}
+    result = predict_next(
+        profile,
+        _places_by_id(list(place_ids)),
+        at=at,
+        from_place_id=request.args.get('from_place_id', type=int)
+    )
+    return jsonify(result)
+
+@analytics_bp.route('/analytics/profile/rebuild', methods=['POST'])
+def rebuild_travel_profile():
+    """Recompute a user's travel profile from their full trip history"""
+    data = request.get_json() or {}
+    user_id = data.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+    
+    if not auth.principal(user_id):
+        return jsonify({'error': 'User not found'}), 404
+    
+    return jsonify(rebuild_profile(user_id).to_dict())
+
 @analytics_bp.route('/analytics/reports', methods=['GET'])
+@query_budget.budget()
 def get_reports():
     """Get detailed reports including CO2 and cost analysis"""
     user_id = request.args.get('user_id', type=int)
@@ -246,65 +305,58 @@ def get_reports():
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
     
-    # Build query
-    query = Trip.query.filter_by(user_id=user_id)
-    
-    if start_date:
-        start_dt = datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-        query = query.filter(Trip.start_time >= start_dt)
-    
-    if end_date:
-        end_dt = datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-        query = query.filter(Trip.start_time <= end_dt)
-    
-    trips = query.all()
-    
-    if not trips:
+    start_dt = datetime.fromisoformat(start_date.replace('Z', '+00:00')) if start_date else None
+    end_dt = datetime.fromisoformat(end_date.replace('Z', '+00:00')) if end_date else None
+    
+    # Per-mode sums over trips and manual trips, computed in one grouped query
+    trips = timeline.entries(timeline.range_filter(user_id, start_dt, end_dt))
+    efficient = and_(trips.c.duration_minutes > 0, trips.c.distance_km != 0)
+    by_mode = db.session.query(
+        trips.c.mode,
+        func.count(trips.c.id),
+        func.sum(trips.c.co2_kg),
+        func.count(case((trips.c.co2_kg != 0, 1))),
+        func.sum(trips.c.cost_usd),
+        func.count(case((trips.c.cost_usd != 0, 1))),
+        func.sum(trips.c.duration_minutes),
+        func.sum(trips.c.distance_km),
+        func.sum(case((efficient, trips.c.distance_km))),
+        func.sum(case((efficient, trips.c.duration_minutes)))
+    ).group_by(trips.c.mode).all()
+    
+    total_trips = sum(row[1] for row in by_mode)
+    if not total_trips:
         return jsonify({'error': 'No trips found for the specified period'}), 404
     
-    # CO2 Analysis
+    # CO2 and cost analysis
     co2_by_mode = {}
-    total_co2 = 0
-    
-    for trip in trips:
-        if trip.co2_kg:
-            mode = trip.mode
-            if mode not in co2_by_mode:
-                co2_by_mode[mode] = 0
-            co2_by_mode[mode] += float(trip.co2_kg)
-            total_co2 += float(trip.co2_kg)
-    
-    # Cost Analysis
     cost_by_mode = {}
-    total_cost = 0
-    
-    for trip in trips:
-        if trip.cost_usd:
-            mode = trip.mode
-            if mode not in cost_by_mode:
-                cost_by_mode[mode] = 0
-            cost_by_mode[mode] += float(trip.cost_usd)
-            total_cost += float(trip.cost_usd)
+    mode_efficiency = {}
+    total_duration = 0
+    total_distance = 0
+    
+    for mode, count, co2, co2_trips, cost, cost_trips, duration, distance, eff_distance, eff_duration in by_mode:
+        if co2_trips:
+            co2_by_mode[mode] = float(co2)
+        if cost_trips:
+            cost_by_mode[mode] = float(cost)
+        total_duration += duration or 0
+        total_distance += float(distance or 0)
+        if eff_duration:
+            mode_efficiency[mode] = {'total_distance': float(eff_distance), 'total_duration': eff_duration}
+    
+    total_co2 = sum(co2_by_mode.values())
+    total_cost = sum(cost_by_mode.values())
     
     # Efficiency Analysis
     efficiency_metrics = {
-        'avg_trip_duration': sum(trip.duration_minutes or 0 for trip in trips) / len(trips),
-        'avg_trip_distance': sum(float(trip.distance_km or 0) for trip in trips) / len(trips),
+        'avg_trip_duration': total_duration / total_trips,
+        'avg_trip_distance': total_distance / total_trips,
         'most_efficient_mode': None,
         'least_efficient_mode': None
     }
     
-    # Calculate efficiency by mode (distance per minute)
-    mode_efficiency = {}
-    for trip in trips:
-        if trip.duration_minutes and trip.distance_km and trip.duration_minutes > 0:
-            mode = trip.mode
-            if mode not in mode_efficiency:
-                mode_efficiency[mode] = {'total_distance': 0, 'total_duration': 0}
-            mode_efficiency[mode]['total_distance'] += float(trip.distance_km)
-            mode_efficiency[mode]['total_duration'] += trip.duration_minutes
-    
-    # Calculate efficiency scores
+    # Calculate efficiency scores (distance per minute)
     efficiency_scores = {}
     for mode, data in mode_efficiency.items():
         if data['total_duration'] > 0:
@@ -331,11 +383,11 @@ def get_reports():
         'cost_analysis': {
             'total_cost_usd': round(total_cost, 2),
             'by_mode': {mode: round(cost, 2) for mode, cost in cost_by_mode.items()},
-            'avg_cost_per_trip': round(total_cost / len(trips), 2)
+            'avg_cost_per_trip': round(total_cost / total_trips, 2)
         },
         'efficiency_metrics': efficiency_metrics,
         'summary': {
-            'total_trips': len(trips),
+            'total_trips': total_trips,
             'period': {
                 'start': start_date,
                 'end': end_date
@@ -344,16 +396,18 @@ def get_reports():
     })
 
 @analytics_bp.route('/analytics/travel-times', methods=['GET'])
+@query_budget.budget()
 def get_travel_times():
     user_id = request.args.get('user_id')
     if not user_id:
         return jsonify({'error': 'user_id is required'}), 400
 
-    # Aggregate trip durations by hour of the day
+    # Aggregate trip durations by hour of the day, manual trips included
+    trips = timeline.entries(timeline.range_filter(user_id))
     travel_times = db.session.query(
-        db.func.extract('hour', Trip.start_time).label('hour'),
-        db.func.avg(Trip.duration_minutes).label('avg_duration')
-    ).filter(Trip.user_id == user_id).group_by('hour').order_by('hour').all()
+        db.func.extract('hour', trips.c.start_time).label('hour'),
+        db.func.avg(trips.c.duration_minutes).label('avg_duration')
+    ).group_by('hour').order_by('hour').all()
 
     # Format for Chart.js
     labels = [f"{int(t.hour)}:00" for t in travel_times]
@@ -361,18 +415,137 @@ def get_travel_times():
     return jsonify({'labels': labels, 'data': data})
 
 @analytics_bp.route('/analytics/top-destinations', methods=['GET'])
+@query_budget.budget()
 def get_top_destinations():
     user_id = request.args.get('user_id')
     if not user_id:
         return jsonify({'error': 'user_id is required'}), 400
 
-    # Count top 5 destinations
+    # Count top 5 destinations (indexed group-by on the clustered place)
     top_destinations = db.session.query(
-        Trip.end_address,
-        db.func.count(Trip.end_address).label('count')
-    ).filter(Trip.user_id == user_id, Trip.end_address.isnot(None)).\
-    group_by(Trip.end_address).order_by(db.desc('count')).limit(5).all()
+        Trip.place_id,
+        db.func.count(Trip.id).label('count')
+    ).filter(Trip.user_id == user_id, Trip.place_id.isnot(None)).\
+    group_by(Trip.place_id).order_by(db.desc('count')).limit(5).all()
 
-    labels = [d.end_address for d in top_destinations]
+    places = _places_by_id([d.place_id for d in top_destinations])
+    top_destinations = [d for d in top_destinations if d.place_id in places]
+    labels = [_place_label(places[d.place_id]) for d in top_destinations]
     data = [d.count for d in top_destinations]
     return jsonify({'labels': labels, 'data': data})
+
+@analytics_bp.route('/analytics/od-matrix', methods=['GET'])
+def get_od_matrix():
+    """Sparse origin-destination matrix between zones, for transport planners"""
+    level = request.args.get('level', DEFAULT_ZONE_LEVEL, type=int)
+    if not MIN_ZONE_LEVEL <= level <= MAX_ZONE_LEVEL:
+        return jsonify({'error': f'level must be between {MIN_ZONE_LEVEL} and {MAX_ZONE_LEVEL}'}), 400
+
+    time_bin = request.args.get('time_bin', 'total')
+    if time_bin not in TIME_BINS:
+        return jsonify({'error': f"time_bin must be one of {', '.join(TIME_BINS)}"}), 400
+
+    try:
+        start_dt = datetime.fromisoformat(request.args['start_date'].replace('Z', '+00:00')) \
+            if request.args.get('start_date') else None
+        end_dt = datetime.fromisoformat(request.args['end_date'].replace('Z', '+00:00')) \
+            if request.args.get('end_date') else None
+    except ValueError:
+        return jsonify({'error': 'Invalid date format'}), 400
+
+    matrix = od_engine.matrix(
+        level=level,
+        start=start_dt,
+        end=end_dt,
+        mode=request.args.get('mode'),
+        time_bin=time_bin,
+        min_trips=request.args.get('min_trips', 1, type=int),
+        limit=min(request.args.get('limit', 1000, type=int), 10000)
+    )
+    return jsonify(matrix)
+
+@analytics_bp.route('/analytics/places', methods=['GET'])
+@query_budget.budget()
+def get_places():
+    """Get a user's clustered places with visit counts"""
+    user_id = request.args.get('user_id', type=int)
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+
+    visits = dict(db.session.query(Trip.place_id, db.func.count(Trip.id)).filter(
+        Trip.user_id == user_id, Trip.place_id.isnot(None)
+    ).group_by(Trip.place_id).all())
+
+    places = Place.query.filter_by(user_id=user_id).all()
+    results = []
+    for place in places:
+        item = place.to_dict()
+        item['label'] = _place_label(place)
+        item['visits'] = visits.get(place.id, 0)
+        results.append(item)
+    results.sort(key=lambda p: p['visits'], reverse=True)
+    return jsonify({'places': results})
+
+@analytics_bp.route('/analytics/places/recluster', methods=['POST'])
+def recluster_places():
+    """Re-run destination clustering over a user's whole trip history"""
+    data = request.get_json() or {}
+    user_id = data.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+
+    if not auth.principal(user_id):
+        return jsonify({'error': 'User not found'}), 404
+
+    return jsonify(recluster_user(user_id))
+
+
+def _parse_cohort(args):
+    """CohortFilter from query params; raises ValueError on bad input"""
+    user_ids = [int(v) for v in args.get('user_ids', '').split(',') if v.strip()]
+    modes = [m.strip() for m in args.get('mode', '').split(',') if m.strip()]
+
+    bbox = None
+    if args.get('bbox'):
+        bbox = tuple(float(v) for v in args['bbox'].split(','))
+        if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            raise ValueError('bbox must be min_lat,min_lng,max_lat,max_lng')
+    area = args.get('area', 'start')
+    if area not in cohort_analytics.AREA_ENDPOINTS:
+        raise ValueError(f"area must be one of {', '.join(cohort_analytics.AREA_ENDPOINTS)}")
+
+    start_dt = datetime.fromisoformat(args['start_date'].replace('Z', '+00:00')) \
+        if args.get('start_date') else None
+    end_dt = datetime.fromisoformat(args['end_date'].replace('Z', '+00:00')) \
+        if args.get('end_date') else None
+
+    return cohort_analytics.CohortFilter(user_ids=user_ids, modes=modes, bbox=bbox, area=area,
+                                         start=start_dt, end=end_dt)
+
+@analytics_bp.route('/analytics/cohort/summary', methods=['GET'])
+def get_cohort_summary():
+    """Analytics summary across all users or a cohort, scanned in parallel partitions"""
+    try:
+        cohort = _parse_cohort(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    split = request.args.get('split', 'time')
+    if split not in cohort_analytics.SPLITS:
+        return jsonify({'error': f"split must be one of {', '.join(cohort_analytics.SPLITS)}"}), 400
+    partitions = request.args.get('partitions', cohort_analytics.WORKERS, type=int)
+
+    job, scan = cohort_analytics.start_scan(cohort, split=split, partitions=partitions)
+
+    # Wait up to `wait` seconds; unfinished scans return partial results to poll
+    scan.done.wait(max(0.0, min(request.args.get('wait', 30, type=float), 300)))
+    db.session.refresh(job)
+    return jsonify(cohort_analytics.render(job)), 200 if scan.done.is_set() else 202
+
+@analytics_bp.route('/analytics/cohort/scans/<int:scan_id>', methods=['GET'])
+def get_cohort_scan(scan_id):
+    """Progress and (partial) results of a cohort scan, from whichever worker runs it"""
+    job = cohort_analytics.get_scan(scan_id)
+    if not job:
+        return jsonify({'error': 'Scan not found'}), 404
+    return jsonify(cohort_analytics.render(job))
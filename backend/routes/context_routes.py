@@ -1,24 +1,37 @@
 from flask import Blueprint, jsonify, request
 from extensions import db
 from models.trip import Trip
+from services import live_state
 
 context_bp = Blueprint('context', __name__)
 
 @context_bp.route('/context/last-location', methods=['GET'])
 def get_last_location():
     """Get the last known location for a given user."""
-    user_id = request.args.get('user_id')
+    user_id = request.args.get('user_id', type=int)
     if not user_id:
         return jsonify({'error': 'user_id is required'}), 400
 
     try:
-        last_trip = Trip.query.filter_by(user_id=user_id).order_by(Trip.end_time.desc()).first()
+        # O(1) primary-key lookup (usually served from the in-process cache)
+        state = live_state.get_state(user_id)
+        if state:
+            return jsonify(state)
 
-        if last_trip and last_trip.end_lat is not None and last_trip.end_lng is not None:
-            return jsonify({
-                'lat': float(last_trip.end_lat),
-                'lng': float(last_trip.end_lng)
-            })
+        # No live state yet (e.g. trips imported before it existed): use the
+        # most recent trip, counting in-progress trips by their start time
+        last_trip = Trip.query.filter_by(user_id=user_id).order_by(
+            db.func.coalesce(Trip.end_time, Trip.start_time).desc()
+        ).first()
+
+        if last_trip:
+            lat = last_trip.end_lat if last_trip.end_time is not None else last_trip.start_lat
+            lng = last_trip.end_lng if last_trip.end_time is not None else last_trip.start_lng
+            if lat is not None and lng is not None:
+                return jsonify({
+                    'lat': float(lat),
+                    'lng': float(lng)
+                })
         
         # Fallback for users with no trips or incomplete location data
         return jsonify({'lat': 19.0760, 'lng': 72.8777, 'default': True})
@@ -26,3 +39,20 @@ def get_last_location():
     except Exception as e:
         print(f"Error fetching last location: {e}")
         return jsonify({'error': 'An internal error occurred.'}), 500
+
+@context_bp.route('/context/moving', methods=['GET'])
+def get_moving_users():
+    """Get users who reported a moving fix recently, optionally inside a bounding box."""
+    within_seconds = request.args.get('within_seconds', 300, type=int)
+    min_speed = request.args.get('min_speed', 0.5, type=float)
+    limit = min(request.args.get('limit', 500, type=int), 5000)
+
+    bbox = None
+    if 'min_lat' in request.args:
+        try:
+            bbox = tuple(float(request.args[name]) for name in ('min_lat', 'min_lng', 'max_lat', 'max_lng'))
+        except (KeyError, ValueError):
+            return jsonify({'error': 'min_lat, min_lng, max_lat and max_lng are required together'}), 400
+
+    users = live_state.moving_users(within_seconds=within_seconds, min_speed=min_speed, bbox=bbox, limit=limit)
+    return jsonify({'users': users, 'count': len(users)})
@@ -1,17 +1,22 @@
 from flask import Blueprint, jsonify
 from models.user import User
 from models.trip import Trip
-from models.trip_point import TripPoint
+from models.manual_trip import ManualTrip
+from services import query_budget, sharding
+from services.point_store import point_store
 from extensions import db
-from sqlalchemy import func
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
+# Polled by every open dashboard, so it gets a tighter budget
 @dashboard_bp.route('/dashboard-summary', methods=['GET'])
+@query_budget.budget(seconds=5)
 def get_dashboard_summary():
     total_users = User.query.count()
-    total_trips = Trip.query.count()
-    total_data_points = db.session.query(func.count(TripPoint.id)).scalar()
+    # Trips and points are per-user tables, spread over the shards
+    totals = sharding.gather(lambda: (Trip.query.count() + ManualTrip.query.count(), point_store.count()))
+    total_trips = sum(trips for trips, _ in totals)
+    total_data_points = sum(points for _, points in totals)
     
     # Placeholder for analysis hours
     analysis_hours = 12 # Replace with actual calculation if available
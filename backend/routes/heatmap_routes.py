@@ -1,12 +1,14 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, send_file
 from extensions import db
 from models.trip import Trip
-from models.trip_point import TripPoint
+from services import auth, heatmap_tiles, query_budget
+from services.point_store import point_store
 from sqlalchemy import text
 
 heatmap_bp = Blueprint('heatmap', __name__)
 
 @heatmap_bp.route('/heatmap-data', methods=['GET'])
+@query_budget.budget()
 def get_heatmap_data():
     user_id = request.args.get('user_id')
     heatmap_type = request.args.get('type', 'density')
@@ -15,18 +17,19 @@ def get_heatmap_data():
         return jsonify({'error': 'user_id is required'}), 400
 
     # Base query to select trips for the given user
-    base_query = db.session.query(TripPoint.latitude, TripPoint.longitude, Trip.co2_kg, Trip.mode).\
-        join(Trip, Trip.id == TripPoint.trip_id).\
+    points = point_store.source()
+    base_query = db.session.query(points.latitude, points.longitude, Trip.co2_kg, Trip.mode).\
+        join(Trip, Trip.id == points.trip_id).\
         filter(Trip.user_id == user_id)
 
     if heatmap_type == 'density':
-        points = base_query.all()
+        points = query_budget.fetch_all(base_query)
         # For density, intensity is uniform
         heatmap_data = [[float(p.latitude), float(p.longitude), 0.5] for p in points]
 
 
     elif heatmap_type == 'co2':
-        points = base_query.filter(Trip.co2_kg.isnot(None)).all()
+        points = query_budget.fetch_all(base_query.filter(Trip.co2_kg.isnot(None)))
         # Normalize CO2 values for better visualization (e.g., 0 to 1)
         max_co2 = max([p.co2_kg for p in points if p.co2_kg is not None], default=1)
         heatmap_data = [[float(p.latitude), float(p.longitude), float(p.co2_kg / max_co2 if max_co2 > 0 and p.co2_kg is not None else 0)] for p in points]
@@ -35,3 +38,34 @@ def get_heatmap_data():
         return jsonify({'error': 'Invalid heatmap type'}), 400
 
     return jsonify(heatmap_data)
+
+
+@heatmap_bp.route('/heatmap/bounds', methods=['GET'])
+def get_heatmap_bounds():
+    """Extent of a user's trip start points, for fitting a tile overlay"""
+    user_id = request.args.get('user_id', type=int)
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+
+    min_lat, min_lng, max_lat, max_lng = db.session.query(
+        db.func.min(Trip.start_lat),
+        db.func.min(Trip.start_lng),
+        db.func.max(Trip.start_lat),
+        db.func.max(Trip.start_lng)
+    ).filter(Trip.user_id == user_id).one()
+    if min_lat is None:
+        return jsonify({'bounds': None})
+    return jsonify({'bounds': [float(min_lat), float(min_lng), float(max_lat), float(max_lng)]})
+
+@heatmap_bp.route('/heatmap/tiles/<int:user_id>/<kind>/<int:z>/<int:x>/<int:y>.png', methods=['GET'])
+def get_heatmap_tile(user_id, kind, z, x, y):
+    """A 256 px heatmap PNG tile for map overlays, rendered on the server and cached on disk"""
+    if kind not in heatmap_tiles.KINDS:
+        return jsonify({'error': f"type must be one of {', '.join(heatmap_tiles.KINDS)}"}), 400
+    if not heatmap_tiles.valid_tile(z, x, y):
+        return jsonify({'error': 'Invalid tile coordinates'}), 400
+    if not auth.principal(user_id):
+        return jsonify({'error': 'User not found'}), 404
+
+    path, version = heatmap_tiles.tile_path(user_id, kind, z, x, y)
+    return send_file(path, mimetype='image/png', etag=version, max_age=heatmap_tiles.MAX_AGE_SECONDS)
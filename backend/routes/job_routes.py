@@ -0,0 +1,32 @@
+from flask import Blueprint, jsonify
+from extensions import db
+from models.job import Job
+from services import auth, jobs
+from services import point_retention  # noqa: F401  registers the point_retention job
+
+job_bp = Blueprint('jobs', __name__)
+
+@job_bp.route('/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status and progress of a background job"""
+    job = db.session.get(Job, job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if not auth.may_access(job.user_id):
+        return auth.forbidden()
+    return jsonify(job.to_dict())
+
+@job_bp.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a queued or running job"""
+    job = db.session.get(Job, job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if not auth.may_access(job.user_id):
+        return auth.forbidden()
+    if not jobs.cancellable(job.kind):
+        return jsonify({'error': f'{job.kind} jobs cannot be cancelled'}), 409
+    if not jobs.cancel(job_id):
+        return jsonify({'error': f'Job is already {job.status}'}), 409
+    db.session.refresh(job)
+    return jsonify(job.to_dict())
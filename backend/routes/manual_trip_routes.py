@@ -1,6 +1,8 @@
 from flask import Blueprint, jsonify, request
 from extensions import db
 from models.manual_trip import ManualTrip
+from services import auth, serialization
+from services.trip_lifecycle import manual_trip_saved, manual_trip_deleted
 from datetime import datetime
 
 manual_trip_bp = Blueprint('manual_trip', __name__)
@@ -11,8 +13,9 @@ def get_manual_trips():
     if not user_id:
         return jsonify({'error': 'user_id is required'}), 400
     
-    trips = ManualTrip.query.filter_by(user_id=user_id).order_by(ManualTrip.start_time.desc()).all()
-    return jsonify([trip.to_dict() for trip in trips])
+    rows = db.session.query(*serialization.MANUAL_TRIP.columns(ManualTrip)).\
+        filter_by(user_id=user_id).order_by(ManualTrip.start_time.desc()).all()
+    return serialization.json_response(serialization.MANUAL_TRIP.encode_all(rows))
 
 @manual_trip_bp.route('/manual-trips', methods=['POST'])
 def add_manual_trip():
@@ -43,7 +46,8 @@ def add_manual_trip():
             notes=data.get('notes')
         )
         db.session.add(new_trip)
-        db.session.commit()
+        db.session.flush()
+        manual_trip_saved(new_trip)
         return jsonify(new_trip.to_dict()), 201
     except Exception as e:
         db.session.rollback()
@@ -54,10 +58,12 @@ def delete_manual_trip(trip_id):
     trip = ManualTrip.query.get(trip_id)
     if not trip:
         return jsonify({'error': 'Trip not found'}), 404
+    if not auth.may_access(trip.user_id):
+        return auth.forbidden()
     
     try:
         db.session.delete(trip)
-        db.session.commit()
+        manual_trip_deleted(trip)
         return jsonify({'message': 'Trip deleted successfully'}), 200
     except Exception as e:
         db.session.rollback()
@@ -1,6 +1,7 @@
 from flask import Blueprint, jsonify, request
 from extensions import db
 from models.ml_prediction import MLPrediction
+from services import serialization
 
 ml_bp = Blueprint('ml', __name__)
 
@@ -8,8 +9,8 @@ ml_bp = Blueprint('ml', __name__)
 def get_ml_predictions():
     """Get all ML predictions. The user_id is ignored for now as the table is global."""
     try:
-        predictions = MLPrediction.query.all()
-        results = [p.to_dict() for p in predictions]
+        rows = db.session.query(*serialization.ML_PREDICTION.columns(MLPrediction)).all()
+        results = serialization.ML_PREDICTION.encode_all(rows)
 
         # This is a placeholder for how you might group data for different charts.
         # You will need to adjust the logic based on how you identify which row belongs to which chart.
@@ -31,7 +32,7 @@ def get_ml_predictions():
             {'prediction_type': 'per_day_mode_area', 'result': per_day_mode_area},
         ]
 
-        return jsonify(response_data)
+        return serialization.json_response(response_data)
     except Exception as e:
         print(f"Error fetching ML predictions: {e}")
         return jsonify({'error': 'An internal error occurred.'}), 500
@@ -0,0 +1,184 @@
+from flask import Blueprint, jsonify, request
+from extensions import db
+from models.trip import Trip
+from services import geo, query_budget, sharding
+from services.point_store import point_store
+from services.spatial_index import endpoint_grid
+from sqlalchemy import or_
+from datetime import datetime, timedelta
+
+spatial_bp = Blueprint('spatial', __name__)
+
+ENDPOINT_KINDS = ('start', 'end', 'any', 'points')
+MAX_RADIUS_M = 50000
+MAX_LIMIT = 500
+
+
+def _cell_filter(column, ranges):
+    """OR of BETWEEN predicates so the B-tree index on column is range-scanned"""
+    return or_(*[column.between(low, high) for low, high in ranges])
+
+
+def _on_shards(user_id, query):
+    """Rows of query on the user's shard, or from every shard when no user is given.
+
+    Each fetch is held to the request's row budget.
+    """
+    if user_id:
+        return query_budget.fetch_all(query)
+    return [row for rows in sharding.gather(lambda: query_budget.fetch_all(query)) for row in rows]
+
+
+def _endpoint_hits(kind, bbox, user_id, since):
+    """(trip_id, lat, lng) rows whose start or end falls in bbox"""
+    min_lat, min_lng, max_lat, max_lng = bbox
+    ranges = geo.cover_ranges(*bbox)
+    cell_col, lat_col, lng_col = {
+        'start': (Trip.start_cell, Trip.start_lat, Trip.start_lng),
+        'end': (Trip.end_cell, Trip.end_lat, Trip.end_lng)
+    }[kind]
+
+    query = db.session.query(Trip.id, lat_col, lng_col).filter(
+        _cell_filter(cell_col, ranges),
+        lat_col.between(min_lat, max_lat),
+        lng_col.between(min_lng, max_lng)
+    )
+    if user_id:
+        query = query.filter(Trip.user_id == user_id)
+    if since:
+        query = query.filter(Trip.updated_at >= since)
+    return _on_shards(user_id, query)
+
+
+def _point_hits(bbox, user_id, since):
+    """(trip_id, lat, lng) rows for GPS points inside bbox"""
+    min_lat, min_lng, max_lat, max_lng = bbox
+    ranges = geo.cover_ranges(*bbox)
+    points = point_store.source(start=since)
+    query = db.session.query(points.trip_id, points.latitude, points.longitude).filter(
+        _cell_filter(points.cell, ranges),
+        points.latitude.between(min_lat, max_lat),
+        points.longitude.between(min_lng, max_lng)
+    )
+    if user_id:
+        query = query.join(Trip, Trip.id == points.trip_id).filter(Trip.user_id == user_id)
+    if since:
+        query = query.filter(points.timestamp >= since)
+    return _on_shards(user_id, query)
+
+
+def _search(kind, bbox, user_id, since, center=None, radius_m=None):
+    """Best match per trip as {trip_id: (distance_m, matched_kind, hits)}"""
+    kinds = ('start', 'end') if kind == 'any' else (kind,)
+    matches = {}
+    for matched in kinds:
+        rows = _point_hits(bbox, user_id, since) if matched == 'points' else \
+            _endpoint_hits(matched, bbox, user_id, since)
+        for trip_id, lat, lng in rows:
+            distance = geo.haversine_m(center[0], center[1], float(lat), float(lng)) if center else None
+            if radius_m is not None and distance > radius_m:
+                continue
+            best = matches.get(trip_id)
+            if best is None:
+                matches[trip_id] = [distance, matched, 1]
+            else:
+                best[2] += 1
+                if distance is not None and distance < best[0]:
+                    best[0], best[1] = distance, matched
+    return matches
+
+
+def _render(matches, limit, source, user_id=None):
+    by_distance = all(m[0] is not None for m in matches.values())
+    if by_distance:
+        ordered = sorted(matches.items(), key=lambda item: item[1][0])
+    else:
+        # Bounding-box searches have no centre; newest trips first
+        ordered = sorted(matches.items(), reverse=True)
+    ordered = ordered[:limit]
+
+    query = Trip.query.filter(Trip.id.in_([trip_id for trip_id, _ in ordered]))
+    trips = {t.id: t for t in _on_shards(user_id, query)} if ordered else {}
+
+    results = []
+    for trip_id, (distance, matched, hits) in ordered:
+        trip = trips.get(trip_id)
+        if not trip:
+            continue
+        item = trip.to_dict()
+        item['matched'] = matched
+        if by_distance:
+            item['distance_m'] = round(distance, 1)
+        if matched == 'points':
+            item['matched_points'] = hits
+        results.append(item)
+
+    return jsonify({'trips': results, 'count': len(results), 'source': source})
+
+
+def _parse_common():
+    kind = request.args.get('endpoint', 'any')
+    if kind not in ENDPOINT_KINDS:
+        raise ValueError(f"endpoint must be one of {', '.join(ENDPOINT_KINDS)}")
+    limit = min(request.args.get('limit', 50, type=int), MAX_LIMIT)
+    user_id = request.args.get('user_id', type=int)
+    since_minutes = request.args.get('since_minutes', type=float)
+    return kind, limit, user_id, since_minutes
+
+
+@spatial_bp.route('/trips/nearby', methods=['GET'])
+@query_budget.budget()
+def get_nearby_trips():
+    """Trips that started, ended or passed within radius_m of a point"""
+    lat = request.args.get('lat', type=float)
+    lng = request.args.get('lng', type=float)
+    radius_m = request.args.get('radius_m', 500, type=float)
+    if lat is None or lng is None:
+        return jsonify({'error': 'lat and lng are required'}), 400
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return jsonify({'error': 'lat/lng out of range'}), 400
+    if not 0 < radius_m <= MAX_RADIUS_M:
+        return jsonify({'error': f'radius_m must be between 0 and {MAX_RADIUS_M}'}), 400
+
+    try:
+        kind, limit, user_id, since_minutes = _parse_common()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Recent endpoint activity is served from the in-memory grid once it has caught up with the database
+    if since_minutes and kind != 'points' and since_minutes * 60 <= endpoint_grid.window:
+        endpoint_grid.sync()
+    if since_minutes and kind != 'points' and endpoint_grid.covers(since_minutes * 60):
+        kinds = ('start', 'end') if kind == 'any' else (kind,)
+        matches = {}
+        for distance, trip_id, matched in endpoint_grid.nearby(lat, lng, radius_m, since_minutes * 60,
+                                                                kinds=kinds, user_id=user_id):
+            if trip_id not in matches:
+                matches[trip_id] = [distance, matched, 1]
+        return _render(matches, limit, 'memory', user_id)
+
+    since = datetime.utcnow() - timedelta(minutes=since_minutes) if since_minutes else None
+    bbox = geo.radius_bbox(lat, lng, radius_m)
+    matches = _search(kind, bbox, user_id, since, center=(lat, lng), radius_m=radius_m)
+    return _render(matches, limit, 'index', user_id)
+
+
+@spatial_bp.route('/trips/within', methods=['GET'])
+@query_budget.budget()
+def get_trips_within():
+    """Trips that started, ended or passed inside a bounding box"""
+    try:
+        bbox = tuple(float(request.args[name]) for name in ('min_lat', 'min_lng', 'max_lat', 'max_lng'))
+    except (KeyError, ValueError):
+        return jsonify({'error': 'min_lat, min_lng, max_lat and max_lng are required'}), 400
+    if bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+        return jsonify({'error': 'min_lat/min_lng must not exceed max_lat/max_lng'}), 400
+
+    try:
+        kind, limit, user_id, since_minutes = _parse_common()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    since = datetime.utcnow() - timedelta(minutes=since_minutes) if since_minutes else None
+    matches = _search(kind, bbox, user_id, since)
+    return _render(matches, limit, 'index', user_id)
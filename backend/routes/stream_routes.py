@@ -0,0 +1,139 @@
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from services import auth
+from services.events import broker, region_topics_for_bbox
+import json
+import os
+import threading
+
+stream_bp = Blueprint('stream', __name__)
+
+HEARTBEAT_SECONDS = float(os.getenv('STREAM_HEARTBEAT_SECONDS', '15'))
+PUBLIC_TOPICS = ('dashboard',)
+# Each open stream holds a worker thread; leave the rest for ordinary requests
+MAX_STREAMS = int(os.getenv('STREAM_MAX_CONNECTIONS', str(max(1, int(os.getenv('GUNICORN_THREADS', '8')) // 2))))
+RETRY_AFTER_SECONDS = 10
+
+_stream_slots = threading.BoundedSemaphore(MAX_STREAMS)
+
+
+class StreamForbidden(Exception):
+    """A user topic was asked for without that user's token"""
+
+
+def _take_slot():
+    """A release function for one of this process's stream slots, or None when all are taken"""
+    if not _stream_slots.acquire(blocking=False):
+        return None
+    released = threading.Event()
+
+    def release():
+        if not released.is_set():
+            released.set()
+            _stream_slots.release()
+    return release
+
+
+def _parse_topics(args):
+    """Topics for a subscription from user_id, bbox and topics query params"""
+    topics = []
+    user_id = args.get('user_id', type=int)
+    if user_id:
+        # A user's own events only; before_request has already refused someone else's token
+        if auth.current_user_id() != user_id:
+            raise StreamForbidden('user_id streams need that user\'s access token')
+        topics.append(f'user:{user_id}')
+
+    bbox = args.get('bbox')
+    if bbox:
+        try:
+            min_lat, min_lng, max_lat, max_lng = (float(v) for v in bbox.split(','))
+        except ValueError:
+            raise ValueError('bbox must be min_lat,min_lng,max_lat,max_lng')
+        if min_lat > max_lat or min_lng > max_lng:
+            raise ValueError('min_lat/min_lng must not exceed max_lat/max_lng')
+        topics.extend(region_topics_for_bbox(min_lat, min_lng, max_lat, max_lng))
+
+    for topic in filter(None, args.get('topics', '').split(',')):
+        if topic not in PUBLIC_TOPICS:
+            raise ValueError(f"topics must be among {', '.join(PUBLIC_TOPICS)}")
+        topics.append(topic)
+
+    if not topics:
+        raise ValueError('subscribe with user_id, bbox or topics')
+    return topics
+
+
+def _sse(message):
+    return f"id: {message['id']}\nevent: {message['type']}\ndata: {json.dumps(message)}\n\n"
+
+
+@stream_bp.route('/stream', methods=['GET'])
+def stream_events():
+    """Server-sent events for a user, a map region and/or dashboard counters"""
+    try:
+        topics = _parse_topics(request.args)
+    except StreamForbidden as e:
+        return jsonify({'error': str(e)}), 401
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    release = _take_slot()
+    if release is None:
+        response = jsonify({'error': 'Too many open streams, retry later'})
+        response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+        return response, 503
+
+    subscription = broker.subscribe(topics)
+
+    def generate():
+        try:
+            yield f"retry: 3000\nevent: ready\ndata: {json.dumps({'topics': topics})}\n\n"
+            while True:
+                message = subscription.get(HEARTBEAT_SECONDS)
+                # Comment lines keep proxies from closing an idle stream
+                yield _sse(message) if message else ': heartbeat\n\n'
+        finally:
+            broker.unsubscribe(subscription)
+            release()
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # Also frees the slot when the client goes away before the first chunk
+    response.call_on_close(release)
+    return response
+
+
+def init_websocket(app):
+    """Register /api/ws when flask-sock is installed; SSE works without it"""
+    try:
+        from flask_sock import Sock
+    except ImportError:
+        return None
+
+    sock = Sock(app)
+
+    @sock.route('/api/ws')
+    def websocket_events(ws):
+        try:
+            topics = _parse_topics(request.args)
+        except (StreamForbidden, ValueError) as e:
+            ws.send(json.dumps({'type': 'error', 'error': str(e)}))
+            return
+
+        release = _take_slot()
+        if release is None:
+            ws.send(json.dumps({'type': 'error', 'error': 'Too many open streams, retry later'}))
+            return
+
+        subscription = broker.subscribe(topics)
+        try:
+            ws.send(json.dumps({'type': 'ready', 'data': {'topics': topics}}))
+            while True:
+                message = subscription.get(HEARTBEAT_SECONDS)
+                ws.send(json.dumps(message if message else {'type': 'heartbeat'}))
+        finally:
+            broker.unsubscribe(subscription)
+            release()
+
+    return sock
@@ -0,0 +1,46 @@
+from flask import Blueprint, jsonify, request
+from services import auth, serialization, timeline
+from datetime import datetime
+
+timeline_bp = Blueprint('timeline', __name__)
+
+@timeline_bp.route('/timeline', methods=['GET'])
+def get_timeline():
+    """A user's trips and manual trips in start_time order, keyset-paginated"""
+    user_id = request.args.get('user_id', type=int)
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+
+    if not auth.principal(user_id):
+        return jsonify({'error': 'User not found'}), 404
+
+    order = request.args.get('order', 'desc')
+    if order not in ('asc', 'desc'):
+        return jsonify({'error': 'order must be asc or desc'}), 400
+
+    try:
+        start_dt = datetime.fromisoformat(request.args['start_date'].replace('Z', '+00:00')) \
+            if request.args.get('start_date') else None
+        end_dt = datetime.fromisoformat(request.args['end_date'].replace('Z', '+00:00')) \
+            if request.args.get('end_date') else None
+    except ValueError:
+        return jsonify({'error': 'Invalid date format'}), 400
+
+    modes = [m.strip() for m in request.args.get('mode', '').split(',') if m.strip()]
+    sources = [s.strip() for s in request.args.get('source', '').split(',') if s.strip()]
+    if any(source not in timeline.SOURCES for source in sources):
+        return jsonify({'error': f"source must be one of {', '.join(timeline.SOURCES)}"}), 400
+    try:
+        result = timeline.page(
+            user_id,
+            limit=request.args.get('limit', timeline.DEFAULT_LIMIT, type=int),
+            cursor=request.args.get('cursor'),
+            order=order,
+            start=start_dt,
+            end=end_dt,
+            modes=modes,
+            sources=sources
+        )
+    except timeline.InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    return serialization.json_response(result)
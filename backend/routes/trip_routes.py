@@ -1,13 +1,63 @@
 from flask import Blueprint, request, jsonify
+from sqlalchemy.exc import IntegrityError
 from extensions import db
 from models.trip import Trip
 from models.trip_point import TripPoint
-from models.user import User
+from services import auth, deletion, serialization
+from services.point_store import point_store
+from services.point_buffer import point_buffer
+from services.trip_lifecycle import trip_saved, trip_deleted, point_added, points_added
 from datetime import datetime
 import json
 
 trip_bp = Blueprint('trips', __name__)
 
+# Most points accepted by one batch upload
+POINT_BATCH_LIMIT = 1000
+
+
+def _load_trip(trip_id):
+    """The trip, or an error response when it is missing or another user's"""
+    trip = Trip.query.get(trip_id)
+    if not trip:
+        return None, (jsonify({'error': 'Trip not found'}), 404)
+    if not auth.may_access(trip.user_id):
+        return None, auth.forbidden()
+    return trip, None
+
+
+def _existing_trip(user_id, idempotency_key):
+    return Trip.query.filter_by(user_id=user_id, idempotency_key=idempotency_key).first()
+
+
+def _already_created(trip):
+    return jsonify({
+        'message': 'Trip already created',
+        'trip': trip.to_dict()
+    })
+
+
+def _valid_coordinates(data):
+    try:
+        lat, lng = float(data['latitude']), float(data['longitude'])
+    except (TypeError, ValueError):
+        return False
+    # NaN fails both comparisons
+    return -90 <= lat <= 90 and -180 <= lng <= 180
+
+
+def _trip_point(trip_id, data, timestamp):
+    return TripPoint(
+        trip_id=trip_id,
+        latitude=data['latitude'],
+        longitude=data['longitude'],
+        altitude=data.get('altitude'),
+        accuracy=data.get('accuracy'),
+        speed=data.get('speed'),
+        heading=data.get('heading'),
+        timestamp=timestamp
+    )
+
 @trip_bp.route('/trips', methods=['GET'])
 def get_trips():
     """Get all trips for a user"""
@@ -16,8 +66,7 @@ def get_trips():
         return jsonify({'error': 'user_id is required'}), 400
     
     # Check if user exists
-    user = User.query.get(user_id)
-    if not user:
+    if not auth.principal(user_id):
         return jsonify({'error': 'User not found'}), 404
     
     # Get query parameters
@@ -44,11 +93,11 @@ def get_trips():
     # Order by start time descending
     query = query.order_by(Trip.start_time.desc())
     
-    # Apply pagination
-    trips = query.offset(offset).limit(limit).all()
+    # Apply pagination; plain column tuples, no ORM objects
+    rows = query.with_entities(*serialization.TRIP.columns(Trip)).offset(offset).limit(limit).all()
     
-    return jsonify({
-        'trips': [trip.to_dict() for trip in trips],
+    return serialization.json_response({
+        'trips': serialization.TRIP.encode_all(rows),
         'total': query.count(),
         'limit': limit,
         'offset': offset
@@ -66,10 +115,18 @@ def create_trip():
             return jsonify({'error': f'{field} is required'}), 400
     
     # Check if user exists
-    user = User.query.get(data['user_id'])
-    if not user:
+    if not auth.principal(data['user_id']):
         return jsonify({'error': 'User not found'}), 404
     
+    # A retry carrying the same Idempotency-Key gets the trip the first request created
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if idempotency_key is not None:
+        if not idempotency_key or len(idempotency_key) > 100:
+            return jsonify({'error': 'Idempotency-Key must be 1 to 100 characters'}), 400
+        existing = _existing_trip(data['user_id'], idempotency_key)
+        if existing:
+            return _already_created(existing)
+    
     # Parse start time
     try:
         start_time = datetime.fromisoformat(data['start_time'].replace('Z', '+00:00'))
@@ -102,16 +159,26 @@ def create_trip():
         is_manual=data.get('is_manual', False),
         notes=data.get('notes')
     )
+    trip.idempotency_key = idempotency_key
     
     # Calculate derived fields
     if end_time:
         trip.calculate_duration()
     if trip.distance_km:
-        trip.calculate_co2_emissions()
+        trip.calculate_co2_kg()
         trip.calculate_cost()
     
     db.session.add(trip)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent retry with the same key inserted first
+        db.session.rollback()
+        existing = _existing_trip(data['user_id'], idempotency_key) if idempotency_key else None
+        if existing is None:
+            raise
+        return _already_created(existing)
+    trip_saved(trip, closed=end_time is not None, created=True)
     
     return jsonify({
         'message': 'Trip created successfully',
@@ -121,20 +188,22 @@ def create_trip():
 @trip_bp.route('/trips/<int:trip_id>', methods=['GET'])
 def get_trip(trip_id):
     """Get a specific trip by ID"""
-    trip = Trip.query.get(trip_id)
-    if not trip:
-        return jsonify({'error': 'Trip not found'}), 404
+    trip, error = _load_trip(trip_id)
+    if error:
+        return error
     
     return jsonify(trip.to_dict())
 
 @trip_bp.route('/trips/<int:trip_id>', methods=['PUT'])
 def update_trip(trip_id):
     """Update a trip"""
-    trip = Trip.query.get(trip_id)
-    if not trip:
-        return jsonify({'error': 'Trip not found'}), 404
+    trip, error = _load_trip(trip_id)
+    if error:
+        return error
     
     data = request.get_json()
+    was_open = trip.end_time is None
+    counted = (trip.start_time, trip.mode)
     
     # Update fields
     if 'start_time' in data:
@@ -172,13 +241,16 @@ def update_trip(trip_id):
         trip.notes = data['notes']
     
     # Recalculate derived fields
+    trip.calculate_cells()
     if trip.end_time:
         trip.calculate_duration()
     if trip.distance_km:
-        trip.calculate_co2_emissions()
+        trip.calculate_co2_kg()
         trip.calculate_cost()
     
     db.session.commit()
+    recount = not was_open and (trip.end_time is None or (trip.start_time, trip.mode) != counted)
+    trip_saved(trip, closed=was_open and trip.end_time is not None, recount=recount)
     
     return jsonify({
         'message': 'Trip updated successfully',
@@ -188,41 +260,62 @@ def update_trip(trip_id):
 @trip_bp.route('/trips/<int:trip_id>', methods=['DELETE'])
 def delete_trip(trip_id):
     """Delete a trip"""
-    trip = Trip.query.get(trip_id)
-    if not trip:
-        return jsonify({'error': 'Trip not found'}), 404
+    trip, error = _load_trip(trip_id)
+    if error:
+        return error
     
-    db.session.delete(trip)
+    user_id = trip.user_id
+    points = deletion.delete_trip(trip_id)
     db.session.commit()
+    trip_deleted(trip_id, user_id, points)
     
     return jsonify({'message': 'Trip deleted successfully'})
 
 @trip_bp.route('/trips/<int:trip_id>/points', methods=['POST'])
 def add_trip_point(trip_id):
     """Add a GPS point to a trip"""
-    trip = Trip.query.get(trip_id)
-    if not trip:
-        return jsonify({'error': 'Trip not found'}), 404
+    trip, error = _load_trip(trip_id)
+    if error:
+        return error
     
     data = request.get_json()
     
     # Validate required fields
     if 'latitude' not in data or 'longitude' not in data:
         return jsonify({'error': 'latitude and longitude are required'}), 400
+    if not _valid_coordinates(data):
+        return jsonify({'error': 'latitude and longitude must be numbers in range'}), 400
     
-    # Create trip point
-    trip_point = TripPoint(
-        trip_id=trip_id,
-        latitude=data['latitude'],
-        longitude=data['longitude'],
-        altitude=data.get('altitude'),
-        accuracy=data.get('accuracy'),
-        speed=data.get('speed'),
-        heading=data.get('heading'),
-        timestamp=datetime.fromisoformat(data['timestamp'].replace('Z', '+00:00')) if data.get('timestamp') else None
-    )
+    try:
+        timestamp = datetime.fromisoformat(data['timestamp'].replace('Z', '+00:00')) if data.get('timestamp') else None
+    except ValueError:
+        return jsonify({'error': 'Invalid timestamp format'}), 400
     
-    db.session.add(trip_point)
+    # Create trip point; a retried upload of the same fix is not stored twice
+    trip_point = _trip_point(trip_id, data, timestamp)
+    
+    # Write-behind mode: logged now, stored by the next bulk flush
+    if point_buffer.app is not None:
+        try:
+            accepted = point_buffer.append(trip_point, trip.user_id)
+        except ValueError as e:
+            return jsonify({'error': f'Invalid point: {e}'}), 400
+        if not accepted:
+            response = jsonify({'error': 'Too many points waiting to be stored, retry later'})
+            response.headers['Retry-After'] = str(point_buffer.retry_after())
+            return response, 429
+        return jsonify({
+            'message': 'Trip point accepted',
+            'trip_point': trip_point.to_dict()
+        }), 202
+    
+    if point_store.add(trip_point) is None:
+        return jsonify({
+            'message': 'Trip point already recorded',
+            'trip_point': point_store.find(trip_id, trip_point.timestamp).to_dict()
+        })
+    
+    point_added(trip, trip_point)
     db.session.commit()
     
     return jsonify({
@@ -230,16 +323,54 @@ def add_trip_point(trip_id):
         'trip_point': trip_point.to_dict()
     }), 201
 
+@trip_bp.route('/trips/<int:trip_id>/points/batch', methods=['POST'])
+def add_trip_points(trip_id):
+    """Add many GPS points to a trip in one request; points already recorded are skipped"""
+    trip, error = _load_trip(trip_id)
+    if error:
+        return error
+    
+    data = request.get_json() or {}
+    items = data.get('points')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'points must be a non-empty list'}), 400
+    if len(items) > POINT_BATCH_LIMIT:
+        return jsonify({'error': f'At most {POINT_BATCH_LIMIT} points per batch'}), 400
+    
+    # Timestamps are required here: they are what makes a retried batch recognisable
+    points = []
+    for item in items:
+        if not isinstance(item, dict) or 'latitude' not in item or 'longitude' not in item or not item.get('timestamp'):
+            return jsonify({'error': 'Each point needs latitude, longitude and timestamp'}), 400
+        try:
+            timestamp = datetime.fromisoformat(item['timestamp'].replace('Z', '+00:00'))
+        except (AttributeError, ValueError):
+            return jsonify({'error': 'Invalid timestamp format'}), 400
+        if not _valid_coordinates(item):
+            return jsonify({'error': 'latitude and longitude must be numbers in range'}), 400
+        points.append(_trip_point(trip_id, item, timestamp))
+    
+    stored = point_store.add_many(points)
+    if stored:
+        points_added(trip, stored)
+    db.session.commit()
+    
+    return jsonify({
+        'message': 'Trip points added successfully',
+        'inserted': len(stored),
+        'duplicates': len(points) - len(stored)
+    }), 201 if stored else 200
+
 @trip_bp.route('/trips/<int:trip_id>/points', methods=['GET'])
 def get_trip_points(trip_id):
     """Get all GPS points for a trip"""
-    trip = Trip.query.get(trip_id)
-    if not trip:
-        return jsonify({'error': 'Trip not found'}), 404
+    trip, error = _load_trip(trip_id)
+    if error:
+        return error
     
-    points = TripPoint.query.filter_by(trip_id=trip_id).order_by(TripPoint.timestamp).all()
+    rows = point_store.trip_point_rows(trip, serialization.TRIP_POINT.attributes)
     
-    return jsonify({
+    return serialization.json_response({
         'trip_id': trip_id,
-        'points': [point.to_dict() for point in points]
+        'points': serialization.TRIP_POINT.encode_all(rows)
     })
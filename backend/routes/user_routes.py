@@ -1,6 +1,9 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from extensions import db
 from models.user import User
+from models.trip import Trip
+from services.events import publish_after_commit
+from services import auth, deletion, serialization, sharding, user_directory
 from datetime import datetime
 import json
 
@@ -9,8 +12,19 @@ user_bp = Blueprint('users', __name__)
 @user_bp.route('/users', methods=['GET'])
 def get_users():
     """Get all users for dropdowns and admin."""
-    users = User.query.all()
-    return jsonify([u.to_dict() for u in users])
+    rows = db.session.query(*serialization.USER.columns(User)).filter(User.deleted_at.is_(None)).all()
+    return serialization.json_response(serialization.USER.encode_all(rows))
+
+@user_bp.route('/users/directory', methods=['GET'])
+def get_user_directory():
+    """Id and display name of users for dropdowns, with prefix search and paging"""
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 1000)
+    page = user_directory.directory_page(
+        prefix=request.args.get('q', ''),
+        after_id=request.args.get('cursor', 0, type=int),
+        limit=limit
+    )
+    return jsonify(page)
 
 @user_bp.route('/users', methods=['POST'])
 def create_user():
@@ -30,17 +44,28 @@ def create_user():
     if User.query.filter_by(email=data['email']).first():
         return jsonify({'error': 'Email already exists'}), 400
     
+    # Hash on the bounded pool so a sign-up burst cannot tie up the request threads
+    try:
+        password_hash = auth.hash_password(data['password'])
+    except auth.HashPoolBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+    
     # Create user
     user = User(
         username=data['username'],
         email=data['email'],
-        password=data['password'],
+        password_hash=password_hash,
         first_name=data.get('first_name'),
         last_name=data.get('last_name'),
         phone=data.get('phone')
     )
     
     db.session.add(user)
+    sharding.shards.assign(user)
+    user_directory.index_user(user)
+    # The id may have been looked up (and cached as missing) before it existed
+    auth.forget(user.id)
+    publish_after_commit(db.session, 'dashboard', 'counters', {'total_users': 1})
     db.session.commit()
     
     return jsonify({
@@ -83,6 +108,7 @@ def update_user(user_id):
             return jsonify({'error': 'Email already exists'}), 400
         user.email = data['email']
     
+    user_directory.index_user(user)
     db.session.commit()
     
     return jsonify({
@@ -97,10 +123,16 @@ def delete_user(user_id):
     if not user:
         return jsonify({'error': 'User not found'}), 404
     
-    db.session.delete(user)
-    db.session.commit()
+    # Heavy users can own millions of points; remove them in the background
+    job = deletion.start_user_purge(user)
     
-    return jsonify({'message': 'User deleted successfully'})
+    return jsonify({
+        'message': 'User deletion started',
+        'user_id': user_id,
+        'status': 'deleting',
+        'job_id': job.id,
+        'job_url': f'/api/jobs/{job.id}'
+    }), 202
 
 @user_bp.route('/users/login', methods=['POST'])
 def login():
@@ -115,7 +147,11 @@ def login():
         (User.username == data['username']) | (User.email == data['username'])
     ).first()
     
-    if not user or not user.check_password(data['password']):
+    try:
+        valid = bool(user) and auth.check_password(user, data['password'])
+    except auth.HashPoolBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+    if not valid:
         return jsonify({'error': 'Invalid credentials'}), 401
     
     if not user.is_active:
@@ -123,7 +159,10 @@ def login():
     
     return jsonify({
         'message': 'Login successful',
-        'user': user.to_dict()
+        'user': user.to_dict(),
+        'access_token': auth.issue_token(current_app, user),
+        'token_type': 'Bearer',
+        'expires_in': auth.TOKEN_SECONDS
     })
 
 @user_bp.route('/users/change-password', methods=['POST'])
@@ -138,10 +177,14 @@ def change_password():
     if not user:
         return jsonify({'error': 'User not found'}), 404
     
-    if not user.check_password(data['current_password']):
-        return jsonify({'error': 'Current password is incorrect'}), 401
-    
-    user.set_password(data['new_password'])
+    try:
+        if not auth.check_password(user, data['current_password']):
+            return jsonify({'error': 'Current password is incorrect'}), 401
+        user.password_hash = auth.hash_password(data['new_password'])
+    except auth.HashPoolBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+    # The new hash changes the token stamp, so tokens issued before now stop working
+    auth.forget(user.id)
     db.session.commit()
     
     return jsonify({'message': 'Password changed successfully'})
@@ -149,8 +192,7 @@ def change_password():
 @user_bp.route('/users/<int:user_id>/stats', methods=['GET'])
 def get_user_stats(user_id):
     """Get user statistics"""
-    user = User.query.get(user_id)
-    if not user:
+    if not auth.principal(user_id):
         return jsonify({'error': 'User not found'}), 404
     
     # Get basic trip statistics
@@ -0,0 +1,231 @@
+"""Signed access tokens and cached principal lookups.
+
+Login issues a stateless token (itsdangerous, signed with SECRET_KEY)
+carrying the user id and a short stamp of the password hash. Requests
+send it as ``Authorization: Bearer <token>``; verifying it is a signature
+check plus a lookup in the principal cache, so it normally costs no
+query. Changing the password changes the stamp, which retires older tokens.
+
+Principals (id, username, active flag, password stamp) are cached for
+PRINCIPAL_CACHE_SECONDS, including misses. Routes use ``principal()`` in
+place of loading the whole User row just to check that it exists. Updates
+and deletes evict the entry after their commit; other workers see the
+change once their TTL lapses.
+
+Password hashing (PBKDF2) runs on a small pool of AUTH_HASH_WORKERS
+threads. At most AUTH_HASH_QUEUE hashes may be pending; beyond that the
+caller gets ``HashPoolBusy`` and answers 503 instead of tying up more
+request workers.
+
+With AUTH_REQUIRED=1 every endpoint except login, sign-up and the public
+ones needs a token. Either way, a request with a token may only ask
+about its own user_id, and routes keyed by a row id (trips, manual trips,
+jobs) check the row's owner with ``may_access``. Browsers cannot set
+headers on EventSource or WebSocket, so the stream endpoints also take the
+token as ``access_token`` in the query string.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import g, jsonify, request
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from extensions import db
+from models.user import User
+from services.db_routing import request_user_id
+
+TOKEN_SECONDS = int(os.getenv('ACCESS_TOKEN_SECONDS', str(7 * 24 * 3600)))
+AUTH_REQUIRED = os.getenv('AUTH_REQUIRED', '0') == '1'
+CACHE_SECONDS = float(os.getenv('PRINCIPAL_CACHE_SECONDS', '60'))
+MAX_PRINCIPALS = 10000
+HASH_WORKERS = int(os.getenv('AUTH_HASH_WORKERS', '2'))
+HASH_QUEUE = int(os.getenv('AUTH_HASH_QUEUE', '32'))
+HASH_TIMEOUT = float(os.getenv('AUTH_HASH_TIMEOUT', '10'))
+
+TOKEN_SALT = 'access-token'
+
+# Reachable without a token even when AUTH_REQUIRED is set
+PUBLIC_ENDPOINTS = {
+    'users.login', 'users.create_user', 'health_check', 'get_config',
+    'dashboard_static', 'dashboard_index', 'static'
+}
+
+# Endpoints that accept the token as ?access_token= (browsers' EventSource sends no headers)
+QUERY_TOKEN_ENDPOINTS = {'stream.stream_events', 'websocket_events'}
+
+_principals = {}
+_principals_lock = threading.Lock()
+
+_hash_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='auth-hash')
+_hash_slots = threading.BoundedSemaphore(HASH_QUEUE)
+
+
+class HashPoolBusy(Exception):
+    """Too many password hashes are already waiting"""
+
+
+# -- password hashing -----------------------------------------------------
+
+def _run_hash(fn, *args):
+    if not _hash_slots.acquire(blocking=False):
+        raise HashPoolBusy('Too many sign-in attempts in progress, try again shortly')
+    try:
+        future = _hash_pool.submit(fn, *args)
+    except Exception:
+        _hash_slots.release()
+        raise
+    future.add_done_callback(lambda _: _hash_slots.release())
+    return future.result(timeout=HASH_TIMEOUT)
+
+
+def check_password(user, password):
+    """check_password_hash on the hash pool"""
+    return _run_hash(check_password_hash, user.password_hash, password)
+
+
+def hash_password(password):
+    """generate_password_hash on the hash pool"""
+    return _run_hash(generate_password_hash, password)
+
+
+# -- principals -----------------------------------------------------------
+
+def password_stamp(password_hash):
+    return hashlib.sha256(password_hash.encode()).hexdigest()[:12]
+
+
+def _load_principal(user_id):
+    row = db.session.query(User.id, User.username, User.is_active, User.password_hash).\
+        filter(User.id == user_id, User.deleted_at.is_(None)).first()
+    if row is None:
+        return None
+    return {
+        'id': row.id,
+        'username': row.username,
+        'is_active': row.is_active is not False,
+        'stamp': password_stamp(row.password_hash)
+    }
+
+
+def principal(user_id):
+    """Cached {'id', 'username', 'is_active', 'stamp'} of a user, or None if there is none"""
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    now = time.time()
+    with _principals_lock:
+        cached = _principals.get(user_id)
+        if cached and cached[0] > now:
+            return cached[1]
+
+    found = _load_principal(user_id)
+    with _principals_lock:
+        if len(_principals) >= MAX_PRINCIPALS:
+            expired = [key for key, (expires, _) in _principals.items() if expires <= now]
+            # Nothing expired: drop the oldest tenth (dicts keep insertion order)
+            for key in expired or list(_principals)[:MAX_PRINCIPALS // 10]:
+                del _principals[key]
+        _principals[user_id] = (now + CACHE_SECONDS, found)
+    return found
+
+
+def forget(user_id):
+    """Drop a cached principal once the current transaction commits"""
+    db.session.info.setdefault('auth_forget', set()).add(int(user_id))
+
+
+def _evict(user_ids):
+    with _principals_lock:
+        for user_id in user_ids:
+            _principals.pop(user_id, None)
+
+
+@event.listens_for(Session, 'after_commit')
+def _forget_after_commit(session):
+    _evict(session.info.pop('auth_forget', ()))
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _keep_on_rollback(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop('auth_forget', None)
+
+
+# -- tokens ---------------------------------------------------------------
+
+def _serializer(app):
+    return URLSafeTimedSerializer(app.config['SECRET_KEY'], salt=TOKEN_SALT)
+
+
+def issue_token(app, user):
+    """Signed access token for a user"""
+    return _serializer(app).dumps({'uid': user.id, 'ps': password_stamp(user.password_hash)})
+
+
+def verify_token(app, token):
+    """The principal a token belongs to, or None when it is invalid, expired or retired"""
+    try:
+        payload = _serializer(app).loads(token, max_age=TOKEN_SECONDS)
+    except (SignatureExpired, BadSignature):
+        return None
+    found = principal(payload.get('uid'))
+    if not found or not found['is_active'] or found['stamp'] != payload.get('ps'):
+        return None
+    return found
+
+
+def _bearer_token():
+    header = request.headers.get('Authorization', '')
+    scheme, _, token = header.partition(' ')
+    if scheme.lower() == 'bearer' and token.strip():
+        return token.strip()
+    if request.endpoint in QUERY_TOKEN_ENDPOINTS:
+        return request.args.get('access_token') or None
+    return None
+
+
+def current_user_id():
+    """Id of the token holder for this request, or None without a token"""
+    return g.get('auth_user_id')
+
+
+def may_access(owner_id):
+    """Whether this request may touch a row owned by owner_id; without a token it may"""
+    holder = current_user_id()
+    return holder is None or owner_id == holder
+
+
+def forbidden():
+    return jsonify({'error': 'Token does not grant access to this user'}), 403
+
+
+def init_app(app):
+    @app.before_request
+    def _authenticate():
+        g.auth_user_id = None
+        if request.method == 'OPTIONS':
+            return None
+
+        token = _bearer_token()
+        if token is None:
+            if AUTH_REQUIRED and request.endpoint not in PUBLIC_ENDPOINTS:
+                return jsonify({'error': 'Authentication required'}), 401
+            return None
+
+        found = verify_token(app, token)
+        if found is None:
+            return jsonify({'error': 'Invalid or expired token'}), 401
+        g.auth_user_id = found['id']
+
+        asked_for = request_user_id()
+        if asked_for is not None and asked_for != found['id']:
+            return forbidden()
+        return None
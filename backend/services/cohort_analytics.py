@@ -0,0 +1,392 @@
+"""Fleet-wide and cohort analytics over the whole trips table.
+
+A scan is split into partitions. They are either equal slices of the time
+window (``split=time``) or equal user_id ranges (``split=user``), so each
+partition is a range scan on the start_time or (user_id, start_time)
+indexes. Each partition runs on a separate pooled connection in a worker
+thread. It makes one grouped aggregate query, by mode, day and hour, and
+one query for the distinct users. Partials are merged as they arrive, so a
+long scan can be polled for progress and for results over the partitions
+finished so far.
+
+A scan is a row in the jobs table (kind ``cohort_scan``). The process that
+starts it runs it and saves the merged partial after every partition, so
+any worker can answer a poll. If that process dies, its lease runs out and
+a job worker runs the scan again from the start.
+
+With user shards (services/sharding.py) every partition runs on every
+shard and the partials are merged the same way.
+
+Manual trips are counted alongside recorded ones. Every aggregate runs over
+the trips/manual_trip union from services/timeline.py, with the cohort and
+partition filters pushed into both branches.
+"""
+
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import and_, extract, func, or_, select, update
+
+from extensions import db
+from models.job import Job
+from services import db_routing, geo, jobs, timeline
+from services.sharding import shards
+
+WORKERS = int(os.getenv('COHORT_WORKERS', '4'))
+MAX_PARTITIONS = 64
+SPLITS = ('time', 'user')
+AREA_ENDPOINTS = ('start', 'end', 'any')
+KIND = 'cohort_scan'
+
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='cohort')
+
+COLUMNS = ('id', 'user_id', 'start_time', 'mode', 'distance_km', 'duration_minutes', 'co2_kg', 'cost_usd')
+
+
+class CohortFilter:
+    """Which trips a scan covers; every field is optional"""
+
+    def __init__(self, user_ids=None, modes=None, bbox=None, area='start', start=None, end=None):
+        self.user_ids = sorted(set(user_ids)) if user_ids else None
+        self.modes = sorted(set(modes)) if modes else None
+        self.bbox = bbox
+        self.area = area
+        self.start = start
+        self.end = end
+
+    def clauses(self, table):
+        """Filter clauses for one source table (trips or manual_trip)"""
+        clauses = []
+        if self.user_ids:
+            clauses.append(table.c.user_id.in_(self.user_ids))
+        if self.modes:
+            clauses.append(table.c.mode.in_(self.modes))
+        if self.start:
+            clauses.append(table.c.start_time >= self.start)
+        if self.end:
+            clauses.append(table.c.start_time <= self.end)
+        if self.bbox:
+            clauses.append(self._area_clause(table))
+        return clauses
+
+    def _area_clause(self, table):
+        min_lat, min_lng, max_lat, max_lng = self.bbox
+        # Manual trips have no Morton cells; their coordinates are checked directly
+        ranges = geo.cover_ranges(*self.bbox) if 'start_cell' in table.c else None
+
+        def inside(prefix):
+            clauses = [table.c[f'{prefix}_lat'].between(min_lat, max_lat),
+                       table.c[f'{prefix}_lng'].between(min_lng, max_lng)]
+            if ranges is not None:
+                cell = table.c[f'{prefix}_cell']
+                clauses.insert(0, or_(*[cell.between(low, high) for low, high in ranges]))
+            return and_(*clauses)
+
+        start, end = inside('start'), inside('end')
+        return {'start': start, 'end': end, 'any': or_(start, end)}[self.area]
+
+    def to_dict(self):
+        return {
+            'user_ids': self.user_ids,
+            'modes': self.modes,
+            'bbox': list(self.bbox) if self.bbox else None,
+            'area': self.area if self.bbox else None,
+            'start': self.start.isoformat() if self.start else None,
+            'end': self.end.isoformat() if self.end else None
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            user_ids=data.get('user_ids'),
+            modes=data.get('modes'),
+            bbox=tuple(data['bbox']) if data.get('bbox') else None,
+            area=data.get('area') or 'start',
+            start=datetime.fromisoformat(data['start']) if data.get('start') else None,
+            end=datetime.fromisoformat(data['end']) if data.get('end') else None
+        )
+
+
+def _empty_partial():
+    return {'modes': {}, 'hours': {}, 'days': {}, 'users': set()}
+
+
+def _add(totals, values):
+    for i, value in enumerate(values):
+        totals[i] += float(value or 0)
+
+
+def _scan_partition(engine, where):
+    """Grouped aggregates for one partition on its own connection"""
+    partial = _empty_partial()
+    trips = timeline.entries(where, columns=COLUMNS)
+    day = func.date(trips.c.start_time)
+    hour = extract('hour', trips.c.start_time)
+    with engine.connect() as conn:
+        rows = conn.execute(select(
+            trips.c.mode,
+            day,
+            hour,
+            func.count(trips.c.id),
+            func.sum(trips.c.distance_km),
+            func.sum(trips.c.duration_minutes),
+            func.count(trips.c.duration_minutes),
+            func.sum(trips.c.co2_kg),
+            func.sum(trips.c.cost_usd)
+        ).group_by(trips.c.mode, day, hour))
+        for mode, day_value, hour_value, count, distance, duration, durations, co2, cost in rows:
+            _add(partial['modes'].setdefault(mode, [0.0] * 6), (count, distance, duration, durations, co2, cost))
+            _add(partial['hours'].setdefault(int(hour_value), [0.0] * 3), (count, duration, durations))
+            key = str(day_value)
+            partial['days'][key] = partial['days'].get(key, 0) + count
+
+        partial['users'] = set(conn.execute(select(trips.c.user_id).distinct()).scalars())
+    return partial
+
+
+def _merge(into, partial):
+    for key in ('modes', 'hours'):
+        for group, values in partial[key].items():
+            _add(into[key].setdefault(group, [0.0] * len(values)), values)
+    for day, count in partial['days'].items():
+        into['days'][day] = into['days'].get(day, 0) + count
+    into['users'] |= partial['users']
+
+
+def _bounds(low, high, partitions):
+    step = (high - low) / partitions
+    return [low + step * i for i in range(partitions)] + [high]
+
+
+def _scan_engines():
+    """Engines a scan reads: a replica (or the primary), plus every other shard"""
+    return [db_routing.read_engine(db)] + [shards.engine(name) for name in shards.names[1:]]
+
+
+def _span(engines, column):
+    """min and max of a column over the scanned trips on every engine"""
+    lows, highs = [], []
+    for engine in engines:
+        with engine.connect() as conn:
+            low, high = conn.execute(select(func.min(column), func.max(column))).one()
+        if low is not None:
+            lows.append(low)
+            highs.append(high)
+    return (min(lows), max(highs)) if lows else (None, None)
+
+
+def _time_partitions(engines, cohort, partitions):
+    """Split the cohort's time window into equal start_time slices"""
+    start, end = cohort.start, cohort.end
+    if start is None or end is None:
+        trips = timeline.entries(cohort.clauses, columns=('start_time',))
+        first, last = _span(engines, trips.c.start_time)
+        if first is None:
+            return []
+        start, end = start or first, end or last
+
+    if end <= start:
+        return [lambda table: [table.c.start_time == start]] if end == start else []
+
+    bounds = _bounds(start, end, partitions)
+
+    def time_slice(low, high, closed):
+        # Half-open slices, with the last one closed so `end` is included
+        def clauses(table):
+            upper = table.c.start_time <= high if closed else table.c.start_time < high
+            return [table.c.start_time >= low, upper]
+        return clauses
+
+    return [time_slice(bounds[i], bounds[i + 1], i == partitions - 1) for i in range(partitions)]
+
+
+def _user_partitions(engines, cohort, partitions):
+    """Split the cohort's users into equal user_id ranges"""
+    if cohort.user_ids:
+        first, last = cohort.user_ids[0], cohort.user_ids[-1]
+    else:
+        trips = timeline.entries(cohort.clauses, columns=('user_id',))
+        first, last = _span(engines, trips.c.user_id)
+        if first is None:
+            return []
+    partitions = min(partitions, last - first + 1)
+    bounds = [round(b) for b in _bounds(first, last + 1, partitions)]
+
+    def user_range(low, high):
+        return lambda table: [table.c.user_id >= low, table.c.user_id < high]
+    return [user_range(bounds[i], bounds[i + 1]) for i in range(partitions)]
+
+
+class CohortScan:
+    """A running scan; its merged partial is saved on its jobs row after every partition"""
+
+    def __init__(self, store, job_id, owner, partitions, finish_job):
+        self.store = store
+        self.job_id = job_id
+        self.owner = owner
+        self.partitions = partitions
+        self.partitions_done = 0
+        self.error = None
+        self.finish_job = finish_job
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+        self._result = _empty_partial()
+
+    def _partition_finished(self, future):
+        with self._lock:
+            error = future.exception()
+            if error is not None:
+                self.error = self.error or f'{type(error).__name__}: {error}'
+            else:
+                _merge(self._result, future.result())
+            self.partitions_done += 1
+            finished = self.partitions_done >= self.partitions
+            self._save(finished)
+        if finished:
+            self.done.set()
+
+    def result(self):
+        """The merged partial in the JSON form kept in jobs.result"""
+        merged = self._result
+        return {
+            'partitions': self.partitions,
+            'partitions_done': self.partitions_done,
+            'modes': [[mode, values] for mode, values in merged['modes'].items()],
+            'hours': [[hour, values] for hour, values in merged['hours'].items()],
+            'days': [[day, count] for day, count in merged['days'].items()],
+            'total_users': len(merged['users'])
+        }
+
+    def _save(self, finished=False):
+        now = datetime.utcnow()
+        values = {'result': self.result(), 'progress': self.partitions_done / max(self.partitions, 1),
+                  'locked_at': now}
+        if finished and self.finish_job:
+            values.update(status='failed' if self.error else 'succeeded', error=self.error,
+                          finished_at=now, locked_by=None)
+        with self.store.begin() as conn:
+            # A scan whose lease was taken over by a job worker stops writing
+            conn.execute(update(Job).where(
+                Job.id == self.job_id, Job.status == 'running', Job.locked_by == self.owner
+            ).values(**values))
+
+
+def _launch(store, job_id, owner, cohort, split, partitions, finish_job):
+    engines = _scan_engines()
+    if split == 'user':
+        slices = _user_partitions(engines, cohort, partitions)
+    else:
+        slices = _time_partitions(engines, cohort, partitions)
+
+    scan = CohortScan(store, job_id, owner, len(slices) * len(engines), finish_job)
+    if not slices:
+        scan._save(finished=True)
+        scan.done.set()
+        return scan
+
+    for extra in slices:
+        def where(table, extra=extra):
+            return cohort.clauses(table) + extra(table)
+        for engine in engines:
+            future = _executor.submit(_scan_partition, engine, where)
+            future.add_done_callback(scan._partition_finished)
+    return scan
+
+
+def start_scan(cohort, split='time', partitions=WORKERS):
+    """Record a scan in the jobs table and run its partitions on this process's pool; returns the job"""
+    partitions = max(1, min(partitions, MAX_PARTITIONS))
+    owner = f'{socket.gethostname()}:{os.getpid()}:cohort'
+    job = jobs.start_inline(KIND, {'filters': cohort.to_dict(), 'split': split, 'partitions': partitions}, owner)
+    db.session.commit()
+    scan = _launch(db.engine, job.id, owner, cohort, split, partitions, finish_job=True)
+    return job, scan
+
+
+@jobs.handler(KIND)
+def _rerun(payload, job):
+    """Run a scan whose process went away; the job runner records the result"""
+    scan = _launch(db.engine, job.id, job.worker_name,
+                   CohortFilter.from_dict(payload['filters']), payload['split'], payload['partitions'],
+                   finish_job=False)
+    scan.done.wait()
+    if scan.error:
+        raise RuntimeError(scan.error)
+    return scan.result()
+
+
+def render(job):
+    """API view of a scan job, complete or partial"""
+    saved = job.result or {}
+    merged = {
+        'modes': {mode: values for mode, values in saved.get('modes', [])},
+        'hours': {int(hour): values for hour, values in saved.get('hours', [])},
+        'days': {day: count for day, count in saved.get('days', [])},
+        'total_users': saved.get('total_users', 0)
+    }
+    status = {'succeeded': 'complete', 'queued': 'running'}.get(job.status, job.status)
+    finished = job.finished_at or datetime.utcnow()
+    return {
+        'scan_id': job.id,
+        'status': status,
+        'partial': status != 'complete',
+        'error': job.error,
+        'split': job.payload.get('split'),
+        'filters': job.payload.get('filters'),
+        'progress': {
+            'partitions': saved.get('partitions', job.payload.get('partitions')),
+            'partitions_done': saved.get('partitions_done', 0),
+            'elapsed_seconds': round((finished - (job.started_at or finished)).total_seconds(), 3)
+        },
+        **_render(merged)
+    }
+
+
+def _render(merged):
+    total_trips = sum(int(v[0]) for v in merged['modes'].values())
+    users = merged['total_users']
+    mode_distribution = []
+    totals = [0.0] * 6
+    for mode, values in sorted(merged['modes'].items(), key=lambda item: -item[1][0]):
+        count, distance, duration, durations, co2, cost = values
+        _add(totals, values)
+        mode_distribution.append({
+            'mode': mode,
+            'count': int(count),
+            'share': round(count / total_trips, 4) if total_trips else 0.0,
+            'total_distance': round(distance, 2),
+            'avg_duration': round(duration / durations, 1) if durations else 0.0,
+            'total_co2_kg': round(co2, 2),
+            'total_cost_usd': round(cost, 2),
+            'km_per_minute': round(distance / duration, 3) if duration else None
+        })
+
+    hourly = [{
+        'hour': hour,
+        'trips': int(count),
+        'avg_duration': round(duration / durations, 1) if durations else 0.0
+    } for hour, (count, duration, durations) in sorted(merged['hours'].items())]
+
+    return {
+        'summary': {
+            'total_trips': total_trips,
+            'total_users': users,
+            'total_distance_km': round(totals[1], 2),
+            'total_duration_minutes': int(totals[2]),
+            'total_co2_kg': round(totals[4], 2),
+            'total_cost_usd': round(totals[5], 2),
+            'avg_trips_per_user': round(total_trips / users, 2) if users else 0.0
+        },
+        'mode_distribution': mode_distribution,
+        'hourly': hourly,
+        'daily_trips': [{'date': day, 'trips': count} for day, count in sorted(merged['days'].items())]
+    }
+
+
+def get_scan(scan_id):
+    job = db.session.get(Job, scan_id)
+    return job if job is not None and job.kind == KIND else None
@@ -0,0 +1,302 @@
+"""Read-replica routing for the Flask-SQLAlchemy session.
+
+Replica URLs (DATABASE_REPLICA_URLS, comma separated) are registered as
+extra binds named ``replica_<n>``. Safe-method requests (GET/HEAD/OPTIONS)
+read from a healthy replica chosen round-robin; everything else, and every
+flush, uses the primary. A request is pinned to the primary when:
+
+* it sends ``X-Read-Primary: 1``,
+* the client wrote within REPLICA_STICKY_SECONDS (``db_primary_until``
+  cookie set on write responses), or
+* the ``user_id`` it asks about was written within that window (clients
+  that do not keep cookies, like the mobile app). Recent writers are kept
+  in Redis when REPLICA_STICKY_REDIS_URL (or EVENTS_REDIS_URL) is set, so
+  every worker sees them; otherwise each process only knows its own.
+
+Replicas are health-checked at most every REPLICA_CHECK_SECONDS. One that
+fails to connect, errors, or lags the primary by more than
+REPLICA_MAX_LAG_SECONDS is skipped until a later check passes; with no
+usable replica, reads go to the primary.
+"""
+
+import itertools
+import os
+import threading
+import time
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session as FlaskSession
+from sqlalchemy import event, text
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+BIND_PREFIX = 'replica_'
+STICKY_COOKIE = 'db_primary_until'
+
+MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', '5'))
+CHECK_SECONDS = float(os.getenv('REPLICA_CHECK_SECONDS', '10'))
+STICKY_SECONDS = float(os.getenv('REPLICA_STICKY_SECONDS', '10'))
+
+# Lag queries per dialect; dialects without one (SQLite) report no lag
+_PG_LAG = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+def replica_binds(urls):
+    """SQLALCHEMY_BINDS entries for a list of replica URLs"""
+    return {f'{BIND_PREFIX}{i}': url for i, url in enumerate(urls)}
+
+
+class Replica:
+    def __init__(self, key):
+        self.key = key
+        self.healthy = True
+        self.lag = None
+        self.error = None
+        self.checked_at = 0.0
+
+    def to_dict(self):
+        return {
+            'bind': self.key,
+            'healthy': self.healthy,
+            'lag_seconds': round(self.lag, 3) if self.lag is not None else None,
+            'error': self.error,
+            'checked_at': self.checked_at
+        }
+
+
+def _measure_lag(conn):
+    dialect = conn.dialect.name
+    if dialect == 'postgresql':
+        lag = conn.execute(_PG_LAG).scalar()
+        return float(lag or 0)
+    if dialect == 'mysql':
+        for statement, column in (('SHOW REPLICA STATUS', 'Seconds_Behind_Source'),
+                                  ('SHOW SLAVE STATUS', 'Seconds_Behind_Master')):
+            try:
+                row = conn.execute(text(statement)).mappings().first()
+            except Exception:
+                continue
+            if row is None:
+                return 0.0
+            if row[column] is None:
+                raise RuntimeError('replication is not running')
+            return float(row[column])
+        return 0.0
+    conn.execute(text('SELECT 1'))
+    return 0.0
+
+
+class LocalWriters:
+    """Users written recently by this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._until = {}
+
+    def wrote(self, user_ids, until):
+        with self._lock:
+            for user_id in user_ids:
+                self._until[user_id] = until
+            if len(self._until) > 10000:
+                now = time.time()
+                self._until = {k: v for k, v in self._until.items() if v > now}
+
+    def recently_wrote(self, user_id):
+        return self._until.get(user_id, 0) > time.time()
+
+
+class RedisWriters:
+    """Users written recently by any process, as Redis keys that expire with the window"""
+
+    KEY_PREFIX = 'journo:db_wrote:'
+
+    def __init__(self, url):
+        import redis
+
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5)
+
+    def wrote(self, user_ids, until):
+        milliseconds = max(1, int((until - time.time()) * 1000))
+        try:
+            with self._client.pipeline(transaction=False) as pipe:
+                for user_id in user_ids:
+                    pipe.set(f'{self.KEY_PREFIX}{user_id}', 1, px=milliseconds)
+                pipe.execute()
+        except Exception as e:
+            print(f"[db_routing] could not record recent writers in Redis: {e}")
+
+    def recently_wrote(self, user_id):
+        try:
+            return bool(self._client.exists(f'{self.KEY_PREFIX}{user_id}'))
+        except Exception as e:
+            # Unknown: reading the primary is always correct
+            print(f"[db_routing] Redis unavailable, reading from the primary: {e}")
+            return True
+
+
+def _make_writers():
+    url = os.getenv('REPLICA_STICKY_REDIS_URL') or os.getenv('EVENTS_REDIS_URL')
+    if url:
+        try:
+            return RedisWriters(url)
+        except ImportError:
+            print("[db_routing] a Redis URL is set but the redis package is missing; "
+                  "recent writers are tracked per process")
+    return LocalWriters()
+
+
+class ReplicaRouter:
+    """Round-robin choice among healthy, caught-up replicas"""
+
+    def __init__(self, writers=None):
+        self.replicas = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self.writers = writers or LocalWriters()
+
+    def configure(self, keys):
+        self.replicas = [Replica(key) for key in keys]
+
+    def check(self, replica, engines):
+        try:
+            with engines[replica.key].connect() as conn:
+                replica.lag = _measure_lag(conn)
+            replica.healthy = replica.lag <= MAX_LAG_SECONDS
+            replica.error = None if replica.healthy else f'lag {replica.lag:.1f}s exceeds {MAX_LAG_SECONDS:g}s'
+        except Exception as e:
+            replica.healthy = False
+            replica.error = str(e)
+        replica.checked_at = time.time()
+        if not replica.healthy:
+            print(f"[db_routing] replica {replica.key} skipped: {replica.error}")
+
+    def choose(self, engines):
+        """Key of the replica to read from, or None for the primary"""
+        if not self.replicas:
+            return None
+        now = time.time()
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[next(self._counter) % len(self.replicas)]
+            if now - replica.checked_at > CHECK_SECONDS:
+                with self._lock:
+                    if now - replica.checked_at > CHECK_SECONDS:
+                        self.check(replica, engines)
+            if replica.healthy:
+                return replica.key
+        return None
+
+    def mark_failed(self, key, error):
+        for replica in self.replicas:
+            if replica.key == key:
+                replica.healthy = False
+                replica.error = str(error)
+                replica.checked_at = time.time()
+
+    # -- read-your-writes --------------------------------------------------
+
+    def wrote(self, user_ids):
+        if user_ids:
+            self.writers.wrote(user_ids, time.time() + STICKY_SECONDS)
+
+    def recently_wrote(self, user_id):
+        return self.writers.recently_wrote(user_id)
+
+
+router = ReplicaRouter(_make_writers())
+
+
+class RoutingSession(FlaskSession):
+    """Session that sends reads of replica-routed requests to a replica bind"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_request_context():
+            key = g.get('db_replica')
+            if key is not None:
+                return self._db.engines[key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def request_user_id():
+    """The user_id a request is about (URL, query string or JSON body), if any"""
+    user_id = (request.view_args or {}).get('user_id') or request.args.get('user_id', type=int)
+    if user_id is None and request.is_json:
+        user_id = (request.get_json(silent=True) or {}).get('user_id')
+    try:
+        return int(user_id) if user_id is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _wants_primary():
+    if request.headers.get('X-Read-Primary') == '1':
+        return True
+    try:
+        if float(request.cookies.get(STICKY_COOKIE, 0)) > time.time():
+            return True
+    except ValueError:
+        pass
+    user_id = request_user_id()
+    return user_id is not None and router.recently_wrote(user_id)
+
+
+@event.listens_for(FlaskSession, 'before_flush')
+def _pin_to_primary(session, flush_context, instances):
+    """A request that writes reads its own writes from the primary from now on"""
+    if has_request_context():
+        g.db_replica = None
+        g.db_wrote = True
+
+
+@event.listens_for(FlaskSession, 'after_flush')
+def _note_writers(session, flush_context):
+    """Remember whose data was written (new rows have their ids by now)"""
+    if not has_request_context():
+        return
+    users = g.setdefault('db_written_users', set())
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        user_id = getattr(obj, 'user_id', None)
+        if user_id is None and type(obj).__name__ == 'User':
+            user_id = obj.id
+        if user_id is not None:
+            users.add(user_id)
+
+
+def read_engine(db):
+    """Engine for heavy background reads: a healthy replica, else the primary"""
+    key = router.choose(db.engines)
+    return db.engines[key] if key is not None else db.engine
+
+
+def init_app(app, db):
+    keys = sorted(key for key in (app.config.get('SQLALCHEMY_BINDS') or {}) if key.startswith(BIND_PREFIX))
+    router.configure(keys)
+    if not keys:
+        return
+    print(f"[db_routing] routing safe-method reads across {len(keys)} replica(s)")
+
+    with app.app_context():
+        for key in keys:
+            @event.listens_for(db.engines[key], 'handle_error')
+            def _replica_error(context, key=key):
+                if context.is_disconnect:
+                    router.mark_failed(key, context.original_exception)
+
+    @app.before_request
+    def _route_request():
+        g.db_replica = None
+        if request.method in SAFE_METHODS and not _wants_primary():
+            g.db_replica = router.choose(db.engines)
+        g.db_route = g.db_replica or 'primary'
+
+    @app.after_request
+    def _mark_route(response):
+        if g.get('db_wrote') or request.method not in SAFE_METHODS:
+            until = time.time() + STICKY_SECONDS
+            response.set_cookie(STICKY_COOKIE, f'{until:.3f}', max_age=int(STICKY_SECONDS) + 1,
+                                httponly=True, samesite='Lax')
+            user_id = request_user_id()
+            router.wrote(g.get('db_written_users', set()) | ({user_id} if user_id is not None else set()))
+        response.headers['X-DB-Route'] = g.get('db_route', 'primary')
+        return response
@@ -0,0 +1,136 @@
+"""Set-based, batched deletion of users and trips.
+
+Deleting through the ORM cascade loads every trip and point of a user into
+the session and deletes them row by row. Instead, ``delete_trip`` removes a
+trip's points and the trip with plain DELETE statements, and
+``start_user_purge`` marks the user as deleting (``users.deleted_at``) and
+queues a ``user_purge`` job. The job removes points, trips, manual trips
+and the user's other rows in batches of DELETE_BATCH_SIZE, each in its own
+short transaction, pausing DELETE_BATCH_PAUSE_SECONDS between batches so
+live traffic keeps its share of the database. Every step is idempotent, so
+a retried or reclaimed job picks up where the last attempt stopped.
+
+A user marked as deleting no longer resolves as a principal, so no new
+trips can be started for them while the purge runs.
+"""
+
+import os
+import time
+from datetime import datetime
+
+from sqlalchemy import delete, select
+
+from extensions import db
+from models.manual_trip import ManualTrip
+from models.place import Place
+from models.trip import Trip
+from models.user import User
+from models.user_live_state import UserLiveState
+from models.user_travel_profile import UserTravelProfile
+from services import auth, heatmap_tiles, jobs, sharding, user_directory
+from services.events import publish_after_commit
+from services.point_store import point_store
+
+BATCH_SIZE = int(os.getenv('DELETE_BATCH_SIZE', '5000'))
+PAUSE_SECONDS = float(os.getenv('DELETE_BATCH_PAUSE_SECONDS', '0.05'))
+# Trips whose points are cleared before the trips themselves are deleted
+TRIP_BATCH = 200
+PURGE_PRIORITY = 10
+
+
+def delete_trip(trip_id):
+    """Delete one trip and its points without loading them (the caller commits); returns the point count"""
+    points = point_store.delete_trips([trip_id])
+    db.session.execute(delete(Trip).where(Trip.id == trip_id))
+    return points
+
+
+def _pause():
+    if PAUSE_SECONDS:
+        time.sleep(PAUSE_SECONDS)
+
+
+def _delete_in_batches(model, where):
+    """Delete matching rows BATCH_SIZE at a time, committing each batch"""
+    total = 0
+    while True:
+        ids = db.session.execute(select(model.id).where(where).limit(BATCH_SIZE)).scalars().all()
+        if not ids:
+            return total
+        db.session.execute(delete(model).where(model.id.in_(ids)))
+        db.session.commit()
+        total += len(ids)
+        _pause()
+
+
+def _purge_trips(user_id, job=None):
+    points = trips = 0
+    total = db.session.query(Trip.id).filter(Trip.user_id == user_id).count()
+    while True:
+        trip_ids = db.session.execute(
+            select(Trip.id).where(Trip.user_id == user_id).order_by(Trip.id).limit(TRIP_BATCH)
+        ).scalars().all()
+        if not trip_ids:
+            return points, trips
+        while True:
+            deleted = point_store.delete_trips(trip_ids, limit=BATCH_SIZE)
+            if not deleted:
+                break
+            db.session.commit()
+            points += deleted
+            _pause()
+        # Sweep points that arrived since, in the same transaction as the trips
+        points += point_store.delete_trips(trip_ids)
+        db.session.execute(delete(Trip).where(Trip.id.in_(trip_ids)))
+        db.session.commit()
+        trips += len(trip_ids)
+        if job is not None:
+            job.progress(0.9 * trips / max(total, 1), f'{trips} of {total} trips deleted')
+            db.session.commit()
+        _pause()
+
+
+def purge_rows(user_id, job=None):
+    """Remove a user's rows on the current shard (the caller commits the last step)"""
+    points, trips = _purge_trips(user_id, job)
+    manual = _delete_in_batches(ManualTrip, ManualTrip.user_id == user_id)
+    places = _delete_in_batches(Place, Place.user_id == user_id)
+
+    for model in (UserTravelProfile, UserLiveState):
+        db.session.execute(delete(model).where(model.user_id == user_id))
+    return {'points': points, 'trips': trips, 'manual_trips': manual, 'places': places}
+
+
+def purge_user(user_id, job=None):
+    """Remove everything a user owns, then the user row"""
+    started = time.time()
+    counts = purge_rows(user_id, job)
+    user_directory.remove_user(user_id)
+    sharding.shards.forget_user(user_id)
+    db.session.execute(delete(User).where(User.id == user_id))
+    auth.forget(user_id)
+    # Trip and point totals drop by an unknown amount; dashboards re-fetch the summary
+    publish_after_commit(db.session, 'dashboard', 'resync', {'reason': 'user_deleted'})
+    db.session.commit()
+    heatmap_tiles.forget_user(user_id)
+    print(f"[deletion] user {user_id}: {counts['points']} points, {counts['trips']} trips, "
+          f"{counts['manual_trips']} manual trips, {counts['places']} places in {time.time() - started:.1f}s")
+    return {'user_id': user_id, **counts}
+
+
+# The account is already gone, so the purge has to run to the end
+@jobs.handler('user_purge', cancellable=False)
+def _purge_job(payload, job):
+    return purge_user(payload['user_id'], job)
+
+
+def start_user_purge(user):
+    """Mark a user as deleting now and queue the purge of their data; returns the job"""
+    if user.deleted_at is None:
+        user.deleted_at = datetime.utcnow()
+        user.is_active = False
+    auth.forget(user.id)
+    user_directory.remove_user(user.id)
+    job = jobs.enqueue('user_purge', {'user_id': user.id}, priority=PURGE_PRIORITY, key=f'user_purge:{user.id}')
+    db.session.commit()
+    return job
@@ -0,0 +1,198 @@
+"""In-process publish/subscribe broker for live updates.
+
+Ingest code publishes small delta events (new point, trip closed, counter
+changed) to topics such as ``user:<id>``, ``region:<zone>`` and
+``dashboard``; the SSE/WebSocket routes subscribe to topics and stream the
+events to browsers.
+
+Events published inside a database transaction are held until it commits
+and dropped if it rolls back, so clients never see data that was not
+stored. Delivery goes through a pluggable backend: the default keeps
+everything inside this process, while EVENTS_REDIS_URL fans events out to
+every worker through Redis-compatible pub/sub.
+"""
+
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, scoped_session
+
+from services import geo
+
+# Region topics are Morton cells at this level (~20 km x 40 km)
+REGION_LEVEL = 10
+MAX_REGION_ZONES = 64
+
+QUEUE_SIZE = int(os.getenv('EVENTS_QUEUE_SIZE', '1000'))
+
+_event_ids = itertools.count(1)
+
+
+def region_topic(lat, lng):
+    return f'region:{geo.cell_id(lat, lng, REGION_LEVEL)}'
+
+
+def region_topics_for_bbox(min_lat, min_lng, max_lat, max_lng):
+    """Region topics covering a bounding box; ValueError if it is too large"""
+    x0, y0 = geo.quantize(min_lat, min_lng, REGION_LEVEL)
+    x1, y1 = geo.quantize(max_lat, max_lng, REGION_LEVEL)
+    if (x1 - x0 + 1) * (y1 - y0 + 1) > MAX_REGION_ZONES:
+        raise ValueError('bounding box is too large to subscribe to')
+    return [f'region:{geo.interleave(x, y)}' for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+class Subscription:
+    """Bounded queue of events for one client; the oldest are dropped when full"""
+
+    def __init__(self, topics):
+        self.topics = set(topics)
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.dropped = 0
+
+    def deliver(self, message):
+        while True:
+            try:
+                self.queue.put_nowait(message)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class LocalBackend:
+    """Delivers events to subscribers in this process only"""
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, subscription):
+        with self._lock:
+            for topic in subscription.topics:
+                self._subscribers.setdefault(topic, set()).add(subscription)
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for topic in subscription.topics:
+                members = self._subscribers.get(topic)
+                if members:
+                    members.discard(subscription)
+                    if not members:
+                        del self._subscribers[topic]
+
+    def publish(self, message):
+        self.dispatch(message)
+
+    def dispatch(self, message):
+        with self._lock:
+            targets = list(self._subscribers.get(message['topic'], ()))
+        for subscription in targets:
+            subscription.deliver(message)
+
+
+class RedisBackend(LocalBackend):
+    """Fans events out across processes through Redis pub/sub"""
+
+    CHANNEL_PREFIX = 'journo:events:'
+
+    def __init__(self, url):
+        super().__init__()
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+        self._listener = None
+
+    def subscribe(self, subscription):
+        # Started on first use so a preloaded app forks before any thread exists
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, daemon=True)
+                self._listener.start()
+        super().subscribe(subscription)
+
+    def publish(self, message):
+        self._client.publish(self.CHANNEL_PREFIX + message['topic'], json.dumps(message))
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(self.CHANNEL_PREFIX + '*')
+                for item in pubsub.listen():
+                    if item.get('type') == 'pmessage':
+                        self.dispatch(json.loads(item['data']))
+            except Exception as e:
+                print(f"[events] Redis listener error, reconnecting: {e}")
+                time.sleep(1)
+
+
+class Broker:
+    def __init__(self, backend=None):
+        self.backend = backend or LocalBackend()
+
+    def subscribe(self, topics):
+        subscription = Subscription(topics)
+        self.backend.subscribe(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.backend.unsubscribe(subscription)
+
+    def publish(self, topic, event_type, data):
+        self.backend.publish({
+            'id': next(_event_ids),
+            'topic': topic,
+            'type': event_type,
+            'data': data,
+            'ts': time.time()
+        })
+
+
+def _make_backend():
+    url = os.getenv('EVENTS_REDIS_URL')
+    if url:
+        try:
+            return RedisBackend(url)
+        except ImportError:
+            print("[events] EVENTS_REDIS_URL is set but the redis package is missing; using local broker")
+    return LocalBackend()
+
+
+broker = Broker(_make_backend())
+
+
+def publish_after_commit(session, topic, event_type, data):
+    """Queue an event on the session; it is published only if the transaction commits"""
+    if isinstance(session, scoped_session):
+        session = session()
+    if not session.in_transaction():
+        # Begin now so a rollback before any SQL still discards the event
+        session.begin()
+    session.info.setdefault('pending_events', []).append((topic, event_type, data))
+
+
+@event.listens_for(Session, 'after_commit')
+def _flush_pending(session):
+    for topic, event_type, data in session.info.pop('pending_events', []):
+        broker.publish(topic, event_type, data)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _drop_pending(session, previous_transaction):
+    # Fires on every rollback() call, even when no SQL had been issued yet
+    if previous_transaction.parent is None:
+        session.info.pop('pending_events', None)
@@ -0,0 +1,133 @@
+"""Geospatial helpers shared by the spatial index, zoning and map routes.
+
+Coordinates are bucketed into Morton-coded (Z-order) integer cells: latitude
+and longitude are quantized to CELL_LEVEL bits each and the bits are
+interleaved, so a cell at a coarser level is a contiguous range of
+CELL_LEVEL cell IDs. That lets a plain B-tree index on the cell column
+answer bounding-box queries with a handful of range scans.
+"""
+
+import math
+
+# 20 bits per axis: ~19 m of latitude per cell
+CELL_LEVEL = 20
+
+EARTH_RADIUS_M = 6371000.0
+
+# Upper bound on cells used to cover one bounding box
+MAX_COVER_CELLS = 32
+
+
+def _spread_bits(value):
+    """Insert a zero bit between each of the low 32 bits of value"""
+    value &= 0xFFFFFFFF
+    value = (value | (value << 16)) & 0x0000FFFF0000FFFF
+    value = (value | (value << 8)) & 0x00FF00FF00FF00FF
+    value = (value | (value << 4)) & 0x0F0F0F0F0F0F0F0F
+    value = (value | (value << 2)) & 0x3333333333333333
+    value = (value | (value << 1)) & 0x5555555555555555
+    return value
+
+
+def _compact_bits(value):
+    """Inverse of _spread_bits"""
+    value &= 0x5555555555555555
+    value = (value | (value >> 1)) & 0x3333333333333333
+    value = (value | (value >> 2)) & 0x0F0F0F0F0F0F0F0F
+    value = (value | (value >> 4)) & 0x00FF00FF00FF00FF
+    value = (value | (value >> 8)) & 0x0000FFFF0000FFFF
+    value = (value | (value >> 16)) & 0x00000000FFFFFFFF
+    return value
+
+
+def quantize(lat, lng, level=CELL_LEVEL):
+    """Map a coordinate to integer (x, y) grid positions at level"""
+    size = 1 << level
+    x = int((float(lng) + 180.0) / 360.0 * size)
+    y = int((float(lat) + 90.0) / 180.0 * size)
+    return min(max(x, 0), size - 1), min(max(y, 0), size - 1)
+
+
+def interleave(x, y):
+    return _spread_bits(x) | (_spread_bits(y) << 1)
+
+
+def cell_id(lat, lng, level=CELL_LEVEL):
+    """Morton-coded cell containing (lat, lng), or None for missing coordinates"""
+    if lat is None or lng is None:
+        return None
+    x, y = quantize(lat, lng, level)
+    return interleave(x, y)
+
+
+def parent_cell(cell, level, from_level=CELL_LEVEL):
+    """Cell at a coarser level containing a cell"""
+    return cell >> (2 * (from_level - level))
+
+
+def cell_bounds(cell, level=CELL_LEVEL):
+    """(min_lat, min_lng, max_lat, max_lng) of a cell"""
+    x = _compact_bits(cell)
+    y = _compact_bits(cell >> 1)
+    size = float(1 << level)
+    return (
+        y / size * 180.0 - 90.0,
+        x / size * 360.0 - 180.0,
+        (y + 1) / size * 180.0 - 90.0,
+        (x + 1) / size * 360.0 - 180.0
+    )
+
+
+def cell_center(cell, level=CELL_LEVEL):
+    min_lat, min_lng, max_lat, max_lng = cell_bounds(cell, level)
+    return (min_lat + max_lat) / 2.0, (min_lng + max_lng) / 2.0
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """Great-circle distance in metres"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_bbox(lat, lng, radius_m):
+    """Bounding box that contains the circle of radius_m around (lat, lng)"""
+    dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+    coslat = max(math.cos(math.radians(lat)), 1e-6)
+    dlng = min(180.0, math.degrees(radius_m / (EARTH_RADIUS_M * coslat)))
+    return (
+        max(-90.0, lat - dlat),
+        max(-180.0, lng - dlng),
+        min(90.0, lat + dlat),
+        min(180.0, lng + dlng)
+    )
+
+
+def cover_ranges(min_lat, min_lng, max_lat, max_lng, max_cells=MAX_COVER_CELLS):
+    """Inclusive CELL_LEVEL cell-id ranges covering a bounding box.
+
+    Picks the finest level at which the box is covered by at most max_cells
+    cells, then expands each cell into its range of CELL_LEVEL IDs and merges
+    ranges that touch.
+    """
+    for level in range(CELL_LEVEL, -1, -1):
+        x0, y0 = quantize(min_lat, min_lng, level)
+        x1, y1 = quantize(max_lat, max_lng, level)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) <= max_cells:
+            break
+
+    shift = 2 * (CELL_LEVEL - level)
+    cells = sorted(interleave(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1))
+
+    ranges = []
+    for cell in cells:
+        low = cell << shift
+        high = ((cell + 1) << shift) - 1
+        if ranges and ranges[-1][1] + 1 >= low:
+            ranges[-1][1] = high
+        else:
+            ranges.append([low, high])
+    return [tuple(r) for r in ranges]
@@ -0,0 +1,231 @@
+"""Offline reverse geocoding from a local gazetteer index.
+
+The index is built once from a GeoNames dump or a name,lat,lng CSV with
+``tools/geocoder.py build`` and memory-mapped at first use, so workers
+share one copy through the page cache. It holds one entry per named place,
+sorted by the Morton id of a coarse grid bucket (BUCKET_LEVEL, about
+10 x 5 km at the equator). A lookup binary-searches the buckets around a
+coordinate and takes the nearest entry within GEOCODER_MAX_DISTANCE_M.
+Results are kept in an LRU cache keyed by the coordinate rounded to about
+11 m.
+
+File layout (little endian): magic, entry count, names length, then
+bucket ids (u8), latitudes (f4), longitudes (f4), name offsets (u4,
+count + 1), and the UTF-8 names.
+
+Without an index file, lookups return None and trips keep whatever
+address the client sent.
+"""
+
+import math
+import mmap
+import os
+import struct
+import threading
+from functools import lru_cache
+
+import numpy as np
+from sqlalchemy import and_, or_, update
+
+from extensions import db
+from models.place import Place
+from models.trip import Trip
+from services import geo, jobs, sharding
+
+INDEX_PATH = os.getenv('GEOCODER_INDEX',
+                       os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'gazetteer.idx'))
+MAX_DISTANCE_M = float(os.getenv('GEOCODER_MAX_DISTANCE_M', '5000'))
+CACHE_SIZE = int(os.getenv('GEOCODER_CACHE_SIZE', '100000'))
+BACKFILL_BATCH_SIZE = int(os.getenv('GEOCODER_BACKFILL_BATCH_SIZE', '1000'))
+
+BUCKET_LEVEL = 12
+CACHE_DECIMALS = 4
+
+MAGIC = b'JGAZ\x00\x00\x00\x01'
+HEADER = struct.Struct('<8sQQ')
+
+_BUCKET_LAT_DEG = 180.0 / (1 << BUCKET_LEVEL)
+_BUCKET_LNG_DEG = 360.0 / (1 << BUCKET_LEVEL)
+_M_PER_DEG = math.pi * geo.EARTH_RADIUS_M / 180.0
+
+
+def bucket_id(lat, lng):
+    return geo.interleave(*geo.quantize(lat, lng, BUCKET_LEVEL))
+
+
+def write_index(path, entries):
+    """Write an index from (name, lat, lng) entries; returns the entry count"""
+    rows = sorted(
+        ((bucket_id(lat, lng), float(lat), float(lng), name) for name, lat, lng in entries
+         if name and -90 <= float(lat) <= 90 and -180 <= float(lng) <= 180),
+        key=lambda row: row[0]
+    )
+    names = [row[3].encode('utf-8') for row in rows]
+    offsets = np.zeros(len(rows) + 1, dtype='<u4')
+    np.cumsum([len(name) for name in names], out=offsets[1:])
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(rows), int(offsets[-1])))
+        f.write(np.array([row[0] for row in rows], dtype='<u8').tobytes())
+        f.write(np.array([row[1] for row in rows], dtype='<f4').tobytes())
+        f.write(np.array([row[2] for row in rows], dtype='<f4').tobytes())
+        f.write(offsets.tobytes())
+        f.write(b''.join(names))
+    return len(rows)
+
+
+class Gazetteer:
+    """A memory-mapped index file"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, names_size = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a gazetteer index')
+        offset = HEADER.size
+        self.buckets = np.frombuffer(self._map, dtype='<u8', count=count, offset=offset)
+        offset += 8 * count
+        self.lats = np.frombuffer(self._map, dtype='<f4', count=count, offset=offset)
+        offset += 4 * count
+        self.lngs = np.frombuffer(self._map, dtype='<f4', count=count, offset=offset)
+        offset += 4 * count
+        self.name_offsets = np.frombuffer(self._map, dtype='<u4', count=count + 1, offset=offset)
+        self.names_start = offset + 4 * (count + 1)
+        self.size = count
+
+    def name(self, index):
+        start = self.names_start + int(self.name_offsets[index])
+        end = self.names_start + int(self.name_offsets[index + 1])
+        return self._map[start:end].decode('utf-8')
+
+    def nearest(self, lat, lng, max_distance_m=MAX_DISTANCE_M):
+        """Name of the closest entry within max_distance_m, or None"""
+        coslat = max(math.cos(math.radians(lat)), 1e-6)
+        reach_y = int(math.ceil(max_distance_m / _M_PER_DEG / _BUCKET_LAT_DEG))
+        reach_x = min(int(math.ceil(max_distance_m / (_M_PER_DEG * coslat) / _BUCKET_LNG_DEG)), 1 << BUCKET_LEVEL)
+        x, y = geo.quantize(lat, lng, BUCKET_LEVEL)
+        size = 1 << BUCKET_LEVEL
+        wanted = np.array(sorted({
+            geo.interleave((x + dx) % size, y + dy)
+            for dx in range(-reach_x, reach_x + 1)
+            for dy in range(-reach_y, reach_y + 1)
+            if 0 <= y + dy < size
+        }), dtype=np.uint64)
+        lows = np.searchsorted(self.buckets, wanted, side='left')
+        highs = np.searchsorted(self.buckets, wanted, side='right')
+        spans = [(low, high) for low, high in zip(lows, highs) if high > low]
+        if not spans:
+            return None
+        candidates = np.concatenate([np.arange(low, high) for low, high in spans])
+
+        # Equirectangular distance is accurate enough at these ranges
+        dlat = (self.lats[candidates] - lat) * _M_PER_DEG
+        dlng = ((self.lngs[candidates] - lng + 180.0) % 360.0 - 180.0) * _M_PER_DEG * coslat
+        distances = dlat * dlat + dlng * dlng
+        best = int(np.argmin(distances))
+        if distances[best] > max_distance_m * max_distance_m:
+            return None
+        return self.name(int(candidates[best]))
+
+
+_gazetteer = None
+_load_failed = False
+_load_lock = threading.Lock()
+
+
+def gazetteer():
+    """The shared index, loaded on first use; None when there is no index file"""
+    global _gazetteer, _load_failed
+    if _gazetteer is None and not _load_failed:
+        with _load_lock:
+            if _gazetteer is None and not _load_failed:
+                try:
+                    _gazetteer = Gazetteer(INDEX_PATH)
+                    print(f"[geocoder] loaded {_gazetteer.size} places from {INDEX_PATH}")
+                except (OSError, ValueError) as e:
+                    _load_failed = True
+                    print(f"[geocoder] no gazetteer index, reverse geocoding disabled: {e}")
+    return _gazetteer
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _lookup(lat, lng):
+    index = gazetteer()
+    return index.nearest(lat, lng) if index is not None else None
+
+
+def reverse(lat, lng):
+    """Nearby place name for a coordinate, or None"""
+    if lat is None or lng is None:
+        return None
+    return _lookup(round(float(lat), CACHE_DECIMALS), round(float(lng), CACHE_DECIMALS))
+
+
+def reverse_many(coordinates):
+    """reverse() for a batch of (lat, lng) pairs"""
+    if gazetteer() is None:
+        return [None] * len(coordinates)
+    return [reverse(lat, lng) for lat, lng in coordinates]
+
+
+def fill_addresses(trip):
+    """Set missing start/end addresses of a trip from its coordinates (the caller commits)"""
+    wanted = [(prefix, getattr(trip, f'{prefix}_lat'), getattr(trip, f'{prefix}_lng'))
+              for prefix in ('start', 'end')
+              if not getattr(trip, f'{prefix}_address') and getattr(trip, f'{prefix}_lat') is not None]
+    if not wanted:
+        return
+    for (prefix, _, _), name in zip(wanted, reverse_many([(lat, lng) for _, lat, lng in wanted])):
+        if name:
+            setattr(trip, f'{prefix}_address', name)
+
+
+def _missing(prefix):
+    address = getattr(Trip, f'{prefix}_address')
+    return and_(or_(address.is_(None), address == ''), getattr(Trip, f'{prefix}_lat').isnot(None))
+
+
+def backfill(job=None, batch_size=BACKFILL_BATCH_SIZE):
+    """Fill missing trip addresses and place labels, one committed batch at a time"""
+    if gazetteer() is None:
+        return {'trips': 0, 'places': 0, 'error': 'no gazetteer index'}
+
+    needs_address = or_(_missing('start'), _missing('end'))
+    total = db.session.query(db.func.count(Trip.id)).filter(needs_address).scalar() or 0
+    last_id, scanned, filled = 0, 0, 0
+    while True:
+        rows = db.session.query(
+            Trip.id, Trip.start_lat, Trip.start_lng, Trip.end_lat, Trip.end_lng,
+            Trip.start_address, Trip.end_address
+        ).filter(needs_address, Trip.id > last_id).order_by(Trip.id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        scanned += len(rows)
+
+        for prefix in ('start', 'end'):
+            pending = [row for row in rows
+                       if not getattr(row, f'{prefix}_address') and getattr(row, f'{prefix}_lat') is not None]
+            names = reverse_many([(getattr(row, f'{prefix}_lat'), getattr(row, f'{prefix}_lng')) for row in pending])
+            updates = [{'id': row.id, f'{prefix}_address': name} for row, name in zip(pending, names) if name]
+            if updates:
+                db.session.execute(update(Trip), updates)
+                filled += len(updates)
+        if job is not None:
+            job.progress(0.9 * scanned / max(total, 1), f'{scanned} of {total} trips checked')
+        db.session.commit()
+
+    places = 0
+    for place in Place.query.filter(or_(Place.label.is_(None), Place.label == '')).yield_per(batch_size):
+        name = reverse(place.lat, place.lng)
+        if name:
+            place.label = name
+            places += 1
+    db.session.commit()
+    print(f"[geocoder] backfill: {filled} addresses on {scanned} trips, {places} place labels")
+    return {'trips': scanned, 'addresses': filled, 'places': places}
+
+
+@jobs.handler('geocode_backfill')
+def _backfill_job(payload, job):
+    return sharding.per_shard(lambda: backfill(job, payload.get('batch_size', BACKFILL_BATCH_SIZE)))
@@ -0,0 +1,305 @@
+"""Server-rendered heatmap tiles (XYZ, Web Mercator, 256 px PNG).
+
+A tile is rendered from the user's trip points inside it, plus a margin
+for the blur. The points are fetched by the indexed point cell ranges
+covering the tile. They are binned with ``numpy.histogram2d`` onto the
+tile's pixel grid and blurred with a separable Gaussian kernel. The result
+is mapped through a colour ramp and encoded as PNG with zlib.
+
+Rendered tiles are cached on disk under HEATMAP_TILE_DIR, keyed by user,
+type, z/x/y and a data version. The version is made from small token files
+that are rewritten after a commit that changes the data:
+
+* one per region (a tile at REGION_ZOOM), for new points inside it;
+* ``all``, for any new point; tiles zoomed out past REGION_ZOOM use it;
+* ``co2``, when a trip's CO2 can have changed (co2 tiles only);
+* ``epoch``, when trips are deleted.
+
+So a new point only invalidates the cached tiles over its own region, and
+every process sharing the directory sees the change. The version is read
+before the points are queried, so a tile rendered during a concurrent write
+is stored under the old version and re-rendered on the next request.
+"""
+
+import hashlib
+import math
+import os
+import shutil
+import struct
+import tempfile
+import uuid
+import zlib
+
+import numpy as np
+from sqlalchemy import and_, event, or_
+from sqlalchemy.orm import Session, scoped_session
+
+from extensions import db
+from models.trip import Trip
+from services import geo
+from services.point_store import point_store
+
+TILE_SIZE = 256
+MAX_ZOOM = 20
+REGION_ZOOM = 8
+KINDS = ('density', 'co2')
+
+TILE_DIR = os.getenv('HEATMAP_TILE_DIR', os.path.join(tempfile.gettempdir(), 'journo-heatmap-tiles'))
+SIGMA_PX = float(os.getenv('HEATMAP_TILE_SIGMA_PX', '6'))
+# Points (or kg of CO2) under one pixel that render at full intensity
+DENSITY_SATURATION = float(os.getenv('HEATMAP_DENSITY_SATURATION', '20'))
+CO2_SATURATION_KG = float(os.getenv('HEATMAP_CO2_SATURATION_KG', '40'))
+# Browsers revalidate tiles (ETag) after this long
+MAX_AGE_SECONDS = int(os.getenv('HEATMAP_TILE_MAX_AGE_SECONDS', '60'))
+
+PAD_PX = int(math.ceil(3 * SIGMA_PX))
+
+# (position, (r, g, b, a)) stops, similar to the browser heatmap's default ramp
+RAMPS = {
+    'density': [(0.0, (0, 255, 0, 0)), (0.2, (102, 255, 0, 150)), (0.45, (255, 255, 0, 200)),
+                (0.7, (255, 140, 0, 220)), (1.0, (255, 0, 0, 235))],
+    'co2': [(0.0, (120, 80, 255, 0)), (0.2, (120, 80, 255, 140)), (0.45, (200, 60, 220, 190)),
+            (0.7, (240, 40, 120, 215)), (1.0, (180, 0, 40, 235))]
+}
+
+
+def _lut(stops):
+    positions = np.linspace(0.0, 1.0, 256)
+    xs = [s[0] for s in stops]
+    return np.stack([
+        np.interp(positions, xs, [s[1][channel] for s in stops]) for channel in range(4)
+    ], axis=1).round().astype(np.uint8)
+
+
+LUTS = {kind: _lut(stops) for kind, stops in RAMPS.items()}
+
+
+def _kernel():
+    offsets = np.arange(-PAD_PX, PAD_PX + 1, dtype=np.float64)
+    kernel = np.exp(-offsets ** 2 / (2 * SIGMA_PX ** 2))
+    return kernel / kernel.sum()
+
+
+KERNEL = _kernel()
+# Blurred value at the centre of a single unit point
+UNIT_PEAK = float(KERNEL.max() ** 2)
+
+
+def valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < (1 << z) and 0 <= y < (1 << z)
+
+
+# -- projection --------------------------------------------------------------
+
+def _world_px(lat, lng, z):
+    """Web Mercator pixel coordinates at zoom z (numpy arrays or floats)"""
+    scale = TILE_SIZE * (1 << z)
+    lat = np.clip(lat, -85.05112878, 85.05112878)
+    siny = np.sin(np.radians(lat))
+    px = (lng + 180.0) / 360.0 * scale
+    py = (0.5 - np.log((1 + siny) / (1 - siny)) / (4 * math.pi)) * scale
+    return px, py
+
+
+def _lat_lng(px, py, z):
+    scale = TILE_SIZE * (1 << z)
+    lng = px / scale * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * py / scale))))
+    return lat, lng
+
+
+def _padded_bbox(z, x, y):
+    """(min_lat, min_lng, max_lat, max_lng) of the tile plus the blur margin"""
+    scale = TILE_SIZE * (1 << z)
+    x0 = max(0, x * TILE_SIZE - PAD_PX)
+    x1 = min(scale, (x + 1) * TILE_SIZE + PAD_PX)
+    y0 = max(0, y * TILE_SIZE - PAD_PX)
+    y1 = min(scale, (y + 1) * TILE_SIZE + PAD_PX)
+    max_lat, min_lng = _lat_lng(x0, y0, z)
+    min_lat, max_lng = _lat_lng(x1, y1, z)
+    return min_lat, min_lng, max_lat, max_lng
+
+
+def _regions(z, x, y):
+    """REGION_ZOOM tiles overlapped by a tile and its margin"""
+    shift = z - REGION_ZOOM
+    span = TILE_SIZE << shift
+    low_x = max(0, x * TILE_SIZE - PAD_PX) // span
+    high_x = min((1 << z) * TILE_SIZE - 1, (x + 1) * TILE_SIZE + PAD_PX) // span
+    low_y = max(0, y * TILE_SIZE - PAD_PX) // span
+    high_y = min((1 << z) * TILE_SIZE - 1, (y + 1) * TILE_SIZE + PAD_PX) // span
+    return [(rx, ry) for rx in range(low_x, high_x + 1) for ry in range(low_y, high_y + 1)]
+
+
+def region_of(lat, lng):
+    px, py = _world_px(float(lat), float(lng), REGION_ZOOM)
+    limit = (1 << REGION_ZOOM) - 1
+    return min(int(px) // TILE_SIZE, limit), min(int(py) // TILE_SIZE, limit)
+
+
+# -- versions ------------------------------------------------------------------
+
+def _version_dir(user_id):
+    return os.path.join(TILE_DIR, str(int(user_id)), 'versions')
+
+
+def _read_token(user_id, name):
+    try:
+        with open(os.path.join(_version_dir(user_id), name)) as f:
+            return f.read()
+    except FileNotFoundError:
+        return '0'
+
+
+def _write_token(user_id, name):
+    directory = _version_dir(user_id)
+    os.makedirs(directory, exist_ok=True)
+    handle, temp = tempfile.mkstemp(dir=directory)
+    with os.fdopen(handle, 'w') as f:
+        f.write(uuid.uuid4().hex)
+    os.replace(temp, os.path.join(directory, name))
+
+
+def data_version(user_id, kind, z, x, y):
+    names = ['epoch']
+    if kind == 'co2':
+        names.append('co2')
+    if z < REGION_ZOOM:
+        names.append('all')
+    else:
+        names += [f'{rx}-{ry}' for rx, ry in _regions(z, x, y)]
+    tokens = '|'.join(f'{name}={_read_token(user_id, name)}' for name in names)
+    return hashlib.sha1(tokens.encode()).hexdigest()[:16]
+
+
+def _pending(session):
+    if isinstance(session, scoped_session):
+        session = session()
+    if not session.in_transaction():
+        session.begin()
+    return session.info.setdefault('tile_tokens', set())
+
+
+def points_changed(session, user_id, coordinates):
+    """Invalidate the regions of new points once the transaction commits"""
+    pending = _pending(session)
+    for lat, lng in coordinates:
+        if lat is None or lng is None:
+            continue
+        rx, ry = region_of(lat, lng)
+        pending.add((user_id, f'{rx}-{ry}'))
+        pending.add((user_id, 'all'))
+
+
+def trips_changed(session, user_id, deleted=False):
+    """Invalidate co2 tiles (trip values changed) or all tiles (trips deleted) after commit"""
+    _pending(session).add((user_id, 'epoch' if deleted else 'co2'))
+
+
+def forget_user(user_id):
+    """Remove every cached tile and version of a deleted user"""
+    shutil.rmtree(os.path.join(TILE_DIR, str(int(user_id))), ignore_errors=True)
+
+
+@event.listens_for(Session, 'after_commit')
+def _write_pending(session):
+    for user_id, name in session.info.pop('tile_tokens', ()):
+        try:
+            _write_token(user_id, name)
+        except OSError as e:
+            print(f"[heatmap_tiles] could not invalidate {user_id}/{name}: {e}")
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _drop_pending(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop('tile_tokens', None)
+
+
+# -- rendering -----------------------------------------------------------------
+
+def _points(user_id, kind, bbox):
+    """(lat, lng, weight) arrays of a user's points inside bbox"""
+    min_lat, min_lng, max_lat, max_lng = bbox
+    points = point_store.source()
+    query = db.session.query(points.latitude, points.longitude, Trip.co2_kg).\
+        join(Trip, Trip.id == points.trip_id).\
+        filter(
+            Trip.user_id == user_id,
+            or_(*[points.cell.between(low, high)
+                  for low, high in geo.cover_ranges(min_lat, min_lng, max_lat, max_lng)]),
+            and_(points.latitude.between(min_lat, max_lat), points.longitude.between(min_lng, max_lng))
+        )
+    if kind == 'co2':
+        query = query.filter(Trip.co2_kg.isnot(None))
+    rows = np.array([(float(lat), float(lng), float(co2 or 0)) for lat, lng, co2 in query],
+                    dtype=np.float64).reshape(-1, 3)
+    weights = rows[:, 2] if kind == 'co2' else np.ones(len(rows))
+    return rows[:, 0], rows[:, 1], weights
+
+
+def _blur(grid):
+    """Separable Gaussian blur of the padded grid, cropped to the tile"""
+    rows = sum(weight * grid[i:i + TILE_SIZE, :] for i, weight in enumerate(KERNEL))
+    return sum(weight * rows[:, i:i + TILE_SIZE] for i, weight in enumerate(KERNEL))
+
+
+def _png(rgba):
+    """Encode an (h, w, 4) uint8 array as PNG"""
+    height, width = rgba.shape[:2]
+    raw = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    raw[:, 1:] = rgba.reshape(height, width * 4)  # filter type 0 per row
+
+    def chunk(tag, data):
+        body = tag + data
+        return struct.pack('>I', len(data)) + body + struct.pack('>I', zlib.crc32(body) & 0xFFFFFFFF)
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + \
+        chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)) + chunk(b'IEND', b'')
+
+
+def render(user_id, kind, z, x, y):
+    """PNG bytes for one tile"""
+    lats, lngs, weights = _points(user_id, kind, _padded_bbox(z, x, y))
+    size = TILE_SIZE + 2 * PAD_PX
+    if len(lats):
+        px, py = _world_px(lats, lngs, z)
+        px = px - x * TILE_SIZE + PAD_PX
+        py = py - y * TILE_SIZE + PAD_PX
+        grid, _, _ = np.histogram2d(py, px, bins=size, range=[[0, size], [0, size]], weights=weights)
+        grid = _blur(grid)
+    else:
+        grid = np.zeros((TILE_SIZE, TILE_SIZE))
+
+    saturation = CO2_SATURATION_KG if kind == 'co2' else DENSITY_SATURATION
+    # Log scale so sparse trails stay visible next to dense hot spots
+    intensity = np.log1p(np.maximum(grid, 0) / UNIT_PEAK) / math.log1p(saturation)
+    levels = (np.clip(intensity, 0.0, 1.0) * 255).astype(np.uint8)
+    return _png(LUTS[kind][levels])
+
+
+def tile_path(user_id, kind, z, x, y):
+    """Cached PNG for a tile, rendering it first when the data version moved on"""
+    version = data_version(user_id, kind, z, x, y)
+    directory = os.path.join(TILE_DIR, str(int(user_id)), kind, str(z), str(x))
+    path = os.path.join(directory, f'{y}-{version}.png')
+    if os.path.exists(path):
+        return path, version
+
+    png = render(user_id, kind, z, x, y)
+    os.makedirs(directory, exist_ok=True)
+    handle, temp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(handle, 'wb') as f:
+        f.write(png)
+    os.replace(temp, path)
+
+    # Drop this tile's older versions
+    prefix = f'{y}-'
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith('.png') and name != os.path.basename(path):
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+    return path, version
@@ -0,0 +1,365 @@
+"""Background job queue backed by the jobs table.
+
+Long-running work (mass deletes, exports, aggregate rebuilds, ML
+refreshes) is queued with ``enqueue(kind, payload)`` and run by job
+workers outside the request cycle. Handlers register per kind:
+
+    @jobs.handler('user_purge')
+    def purge(payload, job):
+        ...
+        job.progress(0.5, 'half way')
+        return {'deleted': n}
+
+Workers claim the highest-priority due job with a conditional UPDATE
+(status='queued' -> 'running'), so several processes can share the table
+without a broker. A failed job is retried up to max_attempts times with
+exponential backoff (JOBS_BACKOFF_SECONDS, doubling, capped at
+JOBS_MAX_BACKOFF_SECONDS). A running job whose worker stops heartbeating
+for JOBS_LEASE_SECONDS is put back in the queue. ``job.progress()`` is the
+heartbeat; it also raises JobCancelled once the job has been cancelled.
+Kinds registered with ``cancellable=False`` (the user purge, which must
+finish once the account is gone) cannot be cancelled.
+
+A job for one user (``payload['user_id']``) records that user as its
+owner, and only they may look at or cancel it through the API.
+
+Workers poll every JOBS_POLL_SECONDS. With JOBS_REDIS_URL set, enqueues
+also push a wake-up through a Redis-compatible list so idle workers start
+at once. The table stays the source of truth either way.
+"""
+
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models.job import Job
+from services import sharding
+
+POLL_SECONDS = float(os.getenv('JOBS_POLL_SECONDS', '1'))
+LEASE_SECONDS = float(os.getenv('JOBS_LEASE_SECONDS', '300'))
+BACKOFF_SECONDS = float(os.getenv('JOBS_BACKOFF_SECONDS', '5'))
+MAX_BACKOFF_SECONDS = float(os.getenv('JOBS_MAX_BACKOFF_SECONDS', '600'))
+MAX_ATTEMPTS = 3
+CLAIM_BATCH = 10
+# Pause after a worker-level error (database down, jobs table not migrated yet)
+ERROR_PAUSE_SECONDS = 10
+
+UNFINISHED = ('queued', 'running')
+
+_handlers = {}
+_uncancellable = set()
+
+
+class JobCancelled(Exception):
+    """The job was cancelled or taken over by another worker while it ran"""
+
+
+def handler(kind, cancellable=True):
+    """Register the function that runs jobs of a kind"""
+    def register(fn):
+        _handlers[kind] = fn
+        if not cancellable:
+            _uncancellable.add(kind)
+        return fn
+    return register
+
+
+def cancellable(kind):
+    return kind not in _uncancellable
+
+
+# -- wake-ups --------------------------------------------------------------
+
+class LocalWaker:
+    """Wakes worker threads in this process; other processes rely on polling"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def notify(self):
+        self._event.set()
+
+    def wait(self, timeout):
+        woken = self._event.wait(timeout)
+        self._event.clear()
+        return woken
+
+
+class RedisWaker(LocalWaker):
+    """Wakes workers in every process through a Redis-compatible list"""
+
+    KEY = 'journo:jobs:wake'
+
+    def __init__(self, url):
+        super().__init__()
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+
+    def notify(self):
+        super().notify()
+        try:
+            self._client.lpush(self.KEY, 1)
+            self._client.ltrim(self.KEY, 0, 99)
+        except Exception as e:
+            print(f"[jobs] Redis wake-up failed, workers will poll: {e}")
+
+    def wait(self, timeout):
+        try:
+            return self._client.brpop(self.KEY, timeout=max(1, int(timeout))) is not None
+        except Exception:
+            return super().wait(timeout)
+
+
+def _make_waker():
+    url = os.getenv('JOBS_REDIS_URL')
+    if url:
+        try:
+            return RedisWaker(url)
+        except ImportError:
+            print("[jobs] JOBS_REDIS_URL is set but the redis package is missing; workers will poll")
+    return LocalWaker()
+
+
+waker = _make_waker()
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_workers(session):
+    if session.info.pop('jobs_enqueued', False):
+        waker.notify()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_enqueued(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop('jobs_enqueued', None)
+
+
+# -- queueing --------------------------------------------------------------
+
+def enqueue(kind, payload=None, priority=0, key=None, max_attempts=MAX_ATTEMPTS, delay=0):
+    """Queue a job (the caller commits).
+
+    With a key, an unfinished job with the same key is returned instead of
+    queueing a second one.
+    """
+    if key is not None:
+        existing = Job.query.filter(Job.key == key, Job.status.in_(UNFINISHED)).first()
+        if existing is not None:
+            return existing
+    job = Job(
+        kind=kind,
+        key=key,
+        user_id=(payload or {}).get('user_id'),
+        payload=payload or {},
+        status='queued',
+        priority=priority,
+        max_attempts=max_attempts,
+        progress=0.0,
+        attempts=0,
+        run_at=datetime.utcnow() + timedelta(seconds=delay)
+    )
+    db.session.add(job)
+    db.session.flush()
+    db.session.info['jobs_enqueued'] = True
+    return job
+
+
+def start_inline(kind, payload, worker_name):
+    """Record a job this process runs itself, already claimed by worker_name (the caller commits).
+
+    The caller renews locked_at as it goes. If it stops, the job is requeued
+    like any other and a worker runs the kind's handler.
+    """
+    now = datetime.utcnow()
+    job = Job(
+        kind=kind,
+        user_id=payload.get('user_id'),
+        payload=payload,
+        status='running',
+        priority=0,
+        max_attempts=MAX_ATTEMPTS,
+        progress=0.0,
+        attempts=1,
+        run_at=now,
+        locked_by=worker_name,
+        locked_at=now,
+        started_at=now
+    )
+    db.session.add(job)
+    db.session.flush()
+    return job
+
+
+def cancel(job_id):
+    """Cancel a queued or running job; a running one stops at its next progress report"""
+    cancelled = db.session.execute(
+        update(Job).where(Job.id == job_id, Job.status.in_(UNFINISHED), Job.kind.notin_(_uncancellable)).
+        values(status='cancelled', finished_at=datetime.utcnow(), locked_by=None)
+    ).rowcount
+    db.session.commit()
+    return bool(cancelled)
+
+
+class JobContext:
+    """Handed to handlers so they can report progress"""
+
+    def __init__(self, job_id, worker_name):
+        self.id = job_id
+        self.worker_name = worker_name
+
+    def progress(self, fraction, message=None):
+        """Record progress and renew the lease; saved with the handler's next commit"""
+        values = {'progress': max(0.0, min(float(fraction), 1.0)), 'locked_at': datetime.utcnow()}
+        if message is not None:
+            values['message'] = message[:255]
+        still_ours = db.session.execute(
+            update(Job).where(Job.id == self.id, Job.status == 'running', Job.locked_by == self.worker_name).
+            values(**values)
+        ).rowcount
+        if not still_ours:
+            raise JobCancelled(f'job {self.id} is no longer running on this worker')
+
+
+def _backoff(attempts):
+    return min(BACKOFF_SECONDS * 2 ** max(attempts - 1, 0), MAX_BACKOFF_SECONDS)
+
+
+# -- workers ---------------------------------------------------------------
+
+class Worker:
+    """Claims and runs jobs until stopped"""
+
+    def __init__(self, app, name=None):
+        self.app = app
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}'
+        self._reclaimed_at = 0.0
+
+    def reclaim_stale(self):
+        """Requeue running jobs whose worker stopped renewing the lease"""
+        if time.time() - self._reclaimed_at < LEASE_SECONDS / 4:
+            return
+        self._reclaimed_at = time.time()
+        cutoff = datetime.utcnow() - timedelta(seconds=LEASE_SECONDS)
+        stale = (Job.status == 'running', Job.locked_at < cutoff)
+        failed = db.session.execute(
+            update(Job).where(*stale, Job.attempts >= Job.max_attempts).
+            values(status='failed', error='worker lost', finished_at=datetime.utcnow(), locked_by=None)
+        ).rowcount
+        requeued = db.session.execute(
+            update(Job).where(*stale).values(status='queued', locked_by=None, run_at=datetime.utcnow())
+        ).rowcount
+        db.session.commit()
+        if failed or requeued:
+            print(f"[jobs] reclaimed stale jobs: {requeued} requeued, {failed} failed")
+
+    def claim(self):
+        """Take the most urgent due job, or None"""
+        now = datetime.utcnow()
+        candidates = db.session.execute(
+            select(Job.id).where(Job.status == 'queued', Job.run_at <= now).
+            order_by(Job.priority.desc(), Job.run_at, Job.id).limit(CLAIM_BATCH)
+        ).scalars().all()
+        for job_id in candidates:
+            claimed = db.session.execute(
+                update(Job).where(Job.id == job_id, Job.status == 'queued').values(
+                    status='running', locked_by=self.name, locked_at=now, started_at=now,
+                    attempts=Job.attempts + 1
+                )
+            ).rowcount
+            db.session.commit()
+            if claimed:
+                return db.session.get(Job, job_id)
+        db.session.commit()
+        return None
+
+    def run(self, job):
+        job_id, kind, attempts, max_attempts = job.id, job.kind, job.attempts, job.max_attempts
+        payload = dict(job.payload or {})
+        mine = (Job.id == job_id, Job.status == 'running', Job.locked_by == self.name)
+        started = time.time()
+        retryable = True
+        try:
+            fn = _handlers.get(kind)
+            if fn is None:
+                retryable = False
+                raise LookupError(f'no handler registered for job kind {kind!r}')
+            # Per-user work runs on the user's shard
+            with sharding.for_user(payload.get('user_id'), writing=True):
+                result = fn(payload, JobContext(job_id, self.name))
+        except sharding.ShardMoving as e:
+            db.session.rollback()
+            # Not the job's fault, so it does not use up an attempt
+            db.session.execute(update(Job).where(*mine).values(
+                status='queued', locked_by=None, attempts=Job.attempts - 1,
+                run_at=datetime.utcnow() + timedelta(seconds=sharding.MOVING_RETRY_SECONDS)
+            ))
+            db.session.commit()
+            print(f"[jobs] job {job_id} ({kind}) waiting: {e}")
+            return
+        except JobCancelled:
+            db.session.rollback()
+            print(f"[jobs] job {job_id} ({kind}) stopped: cancelled")
+            return
+        except Exception as e:
+            db.session.rollback()
+            error = f'{type(e).__name__}: {e}'
+            if retryable and attempts < max_attempts:
+                delay = _backoff(attempts)
+                values = {'status': 'queued', 'locked_by': None, 'error': error,
+                          'run_at': datetime.utcnow() + timedelta(seconds=delay)}
+                print(f"[jobs] job {job_id} ({kind}) attempt {attempts} failed, retrying in {delay:g}s: {error}")
+            else:
+                values = {'status': 'failed', 'locked_by': None, 'error': error, 'finished_at': datetime.utcnow()}
+                print(f"[jobs] job {job_id} ({kind}) failed after {attempts} attempt(s): {error}")
+            db.session.execute(update(Job).where(*mine).values(**values))
+            db.session.commit()
+            return
+
+        db.session.execute(update(Job).where(*mine).values(
+            status='succeeded', progress=1.0, result=result, error=None,
+            locked_by=None, finished_at=datetime.utcnow()
+        ))
+        db.session.commit()
+        print(f"[jobs] job {job_id} ({kind}) done in {time.time() - started:.1f}s")
+
+    def run_once(self):
+        """Run one due job if there is any; True when a job ran"""
+        with self.app.app_context():
+            try:
+                self.reclaim_stale()
+                job = self.claim()
+                if job is None:
+                    return False
+                self.run(job)
+                return True
+            except Exception as e:
+                db.session.rollback()
+                print(f"[jobs] worker {self.name} error: {e}")
+                time.sleep(ERROR_PAUSE_SECONDS)
+                return False
+
+    def run_forever(self, stop=None):
+        stop = stop or threading.Event()
+        print(f"[jobs] worker {self.name} started")
+        while not stop.is_set():
+            if not self.run_once():
+                waker.wait(POLL_SECONDS)
+
+
+def start_worker_threads(app, count):
+    """Run job workers as daemon threads of this process (development server)"""
+    threads = []
+    for i in range(count):
+        worker = Worker(app, name=f'{socket.gethostname()}:{os.getpid()}:jobs-{i}')
+        thread = threading.Thread(target=worker.run_forever, name=f'jobs-{i}', daemon=True)
+        thread.start()
+        threads.append(thread)
+    return threads
@@ -0,0 +1,190 @@
+"""Per-user live location state.
+
+The user_live_state table holds one row per user with the latest fix,
+the trip in progress, speed and mode; it is upserted on every ingested
+point so last-location lookups are a primary-key read. The upsert is a
+single INSERT ... ON CONFLICT (ON DUPLICATE KEY on MySQL) whose update only
+applies when the fix is not older than the stored one, so concurrent
+writers neither collide on the insert nor move the state backwards.
+
+An in-process cache in front of it serves repeat reads without touching
+the database. It is updated only after the writing transaction commits.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import event, func, update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models.user_live_state import UserLiveState
+from services import geo, sharding
+
+CACHE_TTL = float(os.getenv('LIVE_STATE_CACHE_SECONDS', '30'))
+
+_cache = {}
+_lock = threading.Lock()
+
+_UPSERT = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+# Copied from the new row on conflict; fix_time last, MySQL compares against it column by column
+UPDATED = ('trip_id', 'lat', 'lng', 'cell', 'speed', 'heading', 'mode', 'updated_at', 'fix_time')
+
+
+def _naive_utc(value):
+    if value is None:
+        return datetime.utcnow()
+    if value.tzinfo is not None:
+        return datetime.utcfromtimestamp(value.timestamp())
+    return value
+
+
+def _remember(state):
+    with _lock:
+        cached = _cache.get(state['user_id'])
+        # Commits can finish out of order; keep the newer fix
+        if cached is None or (cached[1]['fix_time'] or '') <= (state['fix_time'] or ''):
+            _cache[state['user_id']] = (time.monotonic(), state)
+
+
+def forget(user_id):
+    with _lock:
+        _cache.pop(user_id, None)
+
+
+def _after_commit(user_id, state):
+    """Cache state (or drop the entry when None) once the current transaction commits"""
+    db.session.info.setdefault('live_state', {})[user_id] = state
+
+
+@event.listens_for(Session, 'after_commit')
+def _cache_after_commit(session):
+    for user_id, state in session.info.pop('live_state', {}).items():
+        if state is None:
+            forget(user_id)
+        else:
+            _remember(state)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _drop_on_rollback(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop('live_state', None)
+
+
+def _upsert(values):
+    """INSERT the row, or overwrite it when the stored fix is not newer.
+
+    True when the row changed, False when the stored fix was newer, None when
+    the driver cannot tell (MySQL reports matched rather than changed rows).
+    """
+    table = UserLiveState.__table__
+    dialect = sharding.shards.engine().dialect.name
+    if dialect == 'mysql':
+        statement = mysql.insert(table).values(**values)
+        newer = table.c.fix_time <= statement.inserted.fix_time
+        statement = statement.on_duplicate_key_update(
+            [(name, func.IF(newer, statement.inserted[name], table.c[name])) for name in UPDATED]
+        )
+        db.session.execute(statement)
+        return None
+
+    statement = _UPSERT.get(dialect, postgresql.insert)(table).values(**values)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.user_id],
+        set_={name: statement.excluded[name] for name in UPDATED},
+        where=table.c.fix_time <= statement.excluded.fix_time
+    )
+    return db.session.execute(statement).rowcount != 0
+
+
+def record_fix(user_id, lat, lng, fix_time=None, trip_id=None, speed=None, heading=None, mode=None):
+    """Upsert the user's live row; older fixes (offline replays) are ignored.
+
+    Runs inside the caller's transaction; the caller commits. Returns the
+    new state, or None when nothing was stored.
+    """
+    if lat is None or lng is None:
+        return None
+    fix_time = _naive_utc(fix_time)
+
+    values = {
+        'user_id': user_id,
+        'trip_id': trip_id,
+        'lat': float(lat),
+        'lng': float(lng),
+        'cell': geo.cell_id(lat, lng),
+        'speed': float(speed) if speed is not None else None,
+        'heading': float(heading) if heading is not None else None,
+        'mode': mode,
+        'fix_time': fix_time,
+        'updated_at': datetime.utcnow()
+    }
+    stored = _upsert(values)
+    if stored is False:
+        return None
+    state = UserLiveState(**values).to_dict()
+    # Unsure whether it won: let the next read load the row
+    _after_commit(user_id, state if stored else None)
+    return state
+
+
+def record_trip_point(trip, point):
+    return record_fix(trip.user_id, point.latitude, point.longitude, point.timestamp,
+                      trip_id=trip.id, speed=point.speed, heading=point.heading, mode=trip.mode)
+
+
+def record_trip(trip):
+    """Reflect a trip start or close in the live state"""
+    if trip.end_time is not None:
+        return record_fix(trip.user_id, trip.end_lat, trip.end_lng, trip.end_time,
+                          trip_id=None, speed=0.0, mode=trip.mode)
+    return record_fix(trip.user_id, trip.start_lat, trip.start_lng, trip.start_time,
+                      trip_id=trip.id, mode=trip.mode)
+
+
+def clear_trip(user_id, trip_id):
+    """Drop the in-progress trip reference if it is still trip_id, e.g. after that trip is deleted (the caller commits)"""
+    db.session.execute(
+        update(UserLiveState).where(UserLiveState.user_id == user_id, UserLiveState.trip_id == trip_id).
+        values(trip_id=None)
+    )
+    _after_commit(user_id, None)
+
+
+def get_state(user_id):
+    """Cached live state dict for a user, or None when nothing is known"""
+    with _lock:
+        cached = _cache.get(user_id)
+    if cached and time.monotonic() - cached[0] < CACHE_TTL:
+        return cached[1]
+
+    row = UserLiveState.query.get(user_id)
+    if row is None:
+        return None
+    state = row.to_dict()
+    _remember(state)
+    return state
+
+
+def moving_users(within_seconds=300, min_speed=0.5, bbox=None, limit=500):
+    """Users with a fix in the last within_seconds at or above min_speed"""
+    cutoff = datetime.utcfromtimestamp(time.time() - within_seconds)
+    query = UserLiveState.query.filter(
+        UserLiveState.fix_time >= cutoff,
+        UserLiveState.speed >= min_speed
+    )
+    if bbox:
+        min_lat, min_lng, max_lat, max_lng = bbox
+        query = query.filter(
+            UserLiveState.lat.between(min_lat, max_lat),
+            UserLiveState.lng.between(min_lng, max_lng)
+        )
+    # Live state is per-user data, so every shard holds some of the moving users
+    query = query.order_by(UserLiveState.fix_time.desc()).limit(limit)
+    rows = [row for shard_rows in sharding.gather(query.all) for row in shard_rows]
+    rows.sort(key=lambda row: row.fix_time, reverse=True)
+    return [row.to_dict() for row in rows[:limit]]
@@ -0,0 +1,297 @@
+"""Origin-destination matrix engine.
+
+Closed trips are kept as one columnar row each (start/end Morton cell, hour
+bin, mode, distance, duration). Zones are Morton cells at a coarser level,
+so any zoning level is a right shift of the stored cells, and OD pairs are
+aggregated with vectorized NumPy group-bys at query time.
+
+The store is built from the database once, then kept current by the trip
+lifecycle hooks in this process plus an updated_at watermark catch-up that
+picks up trips closed by other workers. updated_at is set before a
+transaction commits, so a slow commit can land behind the watermark; the
+catch-up therefore re-reads OD_CATCH_UP_OVERLAP_SECONDS before it and skips
+the (id, updated_at) pairs it has already folded in. Deletes seen by other
+workers are only reflected after the periodic full rebuild. With user
+shards, the rebuild and the catch-up read every shard, each with its own
+watermark.
+"""
+
+import calendar
+import os
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+
+from extensions import db
+from services import geo, sharding
+
+DEFAULT_ZONE_LEVEL = 13
+MIN_ZONE_LEVEL = 6
+MAX_ZONE_LEVEL = 16
+
+CATCH_UP_SECONDS = float(os.getenv('OD_CATCH_UP_SECONDS', '30'))
+REBUILD_SECONDS = float(os.getenv('OD_REBUILD_SECONDS', '3600'))
+# How far behind the watermark a late commit can land and still be caught up
+CATCH_UP_OVERLAP = timedelta(seconds=float(os.getenv('OD_CATCH_UP_OVERLAP_SECONDS', '60')))
+
+TIME_BINS = ('total', 'hour', 'day')
+
+MAX_CACHED_RESULTS = 256
+
+_COLUMNS = (
+    ('trip_id', np.int64),
+    ('start_cell', np.int64),
+    ('end_cell', np.int64),
+    ('hour_bin', np.int64),
+    ('mode', np.int16),
+    ('distance_km', np.float64),
+    ('duration_minutes', np.float64),
+)
+
+
+def hour_bin(value):
+    """Hours since the epoch for a (naive UTC or aware) datetime"""
+    return calendar.timegm(value.utctimetuple()) // 3600
+
+
+def _empty():
+    return {name: np.empty(0, dtype=dtype) for name, dtype in _COLUMNS}
+
+
+class ODMatrixEngine:
+    """Columnar store of closed trips with cached OD aggregations"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._data = None
+        self._pending = []
+        self._modes = []
+        self._mode_index = {}
+        self._watermarks = {}  # shard -> newest updated_at seen
+        self._folded = {}  # (shard, trip id) -> updated_at, for rows inside the overlap
+        self._built_at = 0.0
+        self._caught_up_at = 0.0
+        self._cache = {}
+
+    # -- ingestion ---------------------------------------------------------
+
+    def _mode_id(self, mode):
+        if mode not in self._mode_index:
+            self._mode_index[mode] = len(self._modes)
+            self._modes.append(mode)
+        return self._mode_index[mode]
+
+    def _rows_to_columns(self, rows):
+        """Turn (id, start_cell, end_cell, start_time, mode, distance, duration) rows into arrays"""
+        if not rows:
+            return _empty()
+        ids, starts, ends, times, modes, distances, durations = zip(*rows)
+        return {
+            'trip_id': np.fromiter(ids, dtype=np.int64, count=len(rows)),
+            'start_cell': np.fromiter(starts, dtype=np.int64, count=len(rows)),
+            'end_cell': np.fromiter(ends, dtype=np.int64, count=len(rows)),
+            'hour_bin': np.fromiter((hour_bin(t) for t in times), dtype=np.int64, count=len(rows)),
+            'mode': np.fromiter((self._mode_id(m) for m in modes), dtype=np.int16, count=len(rows)),
+            'distance_km': np.array([float(d) if d is not None else 0.0 for d in distances], dtype=np.float64),
+            'duration_minutes': np.array([float(d) if d is not None else 0.0 for d in durations],
+                                         dtype=np.float64),
+        }
+
+    def _query_closed_trips(self, watermarks=None):
+        """Closed trips on every shard as (shard, row) pairs, with updated_at within
+        CATCH_UP_OVERLAP of that shard's watermark or later when given"""
+        from models.trip import Trip
+
+        rows, seen = [], {}
+        for name in sharding.each_shard():
+            query = db.session.query(
+                Trip.id, Trip.start_cell, Trip.end_cell, Trip.start_time,
+                Trip.mode, Trip.distance_km, Trip.duration_minutes, Trip.updated_at
+            ).filter(
+                Trip.end_time.isnot(None),
+                Trip.start_cell.isnot(None),
+                Trip.end_cell.isnot(None)
+            )
+            since = (watermarks or {}).get(name)
+            if since is not None:
+                query = query.filter(Trip.updated_at >= since - CATCH_UP_OVERLAP)
+            shard_rows = query.all()
+            rows.extend((name, row) for row in shard_rows)
+            seen[name] = max((row[7] for row in shard_rows if row[7] is not None), default=since)
+        return rows, seen
+
+    def _remember_folded(self, rows, watermarks):
+        """Keep the (id, updated_at) of rows that the next catch-up's overlap will read again"""
+        folded = {key: updated for key, updated in self._folded.items()
+                  if watermarks.get(key[0]) is not None and updated >= watermarks[key[0]] - CATCH_UP_OVERLAP}
+        for name, row in rows:
+            if row[7] is not None and watermarks.get(name) is not None \
+                    and row[7] >= watermarks[name] - CATCH_UP_OVERLAP:
+                folded[(name, row[0])] = row[7]
+        self._folded = folded
+
+    def _replace(self, columns):
+        """Insert rows, replacing any existing rows for the same trip ids"""
+        if self._data is None or not len(columns['trip_id']):
+            return
+        keep = ~np.isin(self._data['trip_id'], columns['trip_id'])
+        self._data = {
+            name: np.concatenate([self._data[name][keep], columns[name]]) for name, _ in _COLUMNS
+        }
+
+    def rebuild(self):
+        """Reload every closed trip from the database"""
+        rows, seen = self._query_closed_trips()
+        with self._lock:
+            self._data = self._rows_to_columns([row[:7] for _, row in rows])
+            self._pending = []
+            self._watermarks = seen
+            self._folded = {}
+            self._remember_folded(rows, seen)
+            self._built_at = self._caught_up_at = time.time()
+            self._cache.clear()
+
+    def catch_up(self):
+        """Fold in trips closed or edited since the watermark"""
+        rows, seen = self._query_closed_trips(self._watermarks)
+        with self._lock:
+            fresh = [(name, row) for name, row in rows if self._folded.get((name, row[0])) != row[7]]
+            self._watermarks = seen
+            self._remember_folded(rows, seen)
+            if fresh:
+                self._replace(self._rows_to_columns([row[:7] for _, row in fresh]))
+                self._cache.clear()
+            self._caught_up_at = time.time()
+
+    def _ensure_fresh(self):
+        now = time.time()
+        if self._data is None or now - self._built_at > REBUILD_SECONDS:
+            self.rebuild()
+        elif now - self._caught_up_at > CATCH_UP_SECONDS:
+            self.catch_up()
+
+        with self._lock:
+            if self._pending:
+                self._replace(self._rows_to_columns(self._pending))
+                self._pending = []
+                self._cache.clear()
+
+    def record_trip(self, trip):
+        """Add or refresh a closed trip (called from the lifecycle hooks)"""
+        if trip.end_time is None or trip.start_cell is None or trip.end_cell is None:
+            self.remove_trip(trip.id)
+            return
+        with self._lock:
+            if self._data is None:
+                return
+            self._pending = [row for row in self._pending if row[0] != trip.id]
+            self._pending.append((
+                trip.id, trip.start_cell, trip.end_cell, trip.start_time,
+                trip.mode, trip.distance_km, trip.duration_minutes
+            ))
+
+    def remove_trip(self, trip_id):
+        with self._lock:
+            if self._data is None:
+                return
+            self._pending = [row for row in self._pending if row[0] != trip_id]
+            keep = self._data['trip_id'] != trip_id
+            if not keep.all():
+                self._data = {name: values[keep] for name, values in self._data.items()}
+                self._cache.clear()
+
+    # -- queries -----------------------------------------------------------
+
+    def matrix(self, level=DEFAULT_ZONE_LEVEL, start=None, end=None, mode=None,
+               time_bin='total', min_trips=1, limit=1000):
+        """Sparse OD matrix for trips starting in [start, end] (datetimes)"""
+        self._ensure_fresh()
+        key = (level, start, end, mode, time_bin, min_trips, limit)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                return cached
+            data = self._data
+            modes = list(self._modes)
+            mode_id = self._mode_index.get(mode)
+
+        result = self._aggregate(data, modes, mode_id, level, start, end, mode, time_bin, min_trips, limit)
+        with self._lock:
+            if len(self._cache) >= MAX_CACHED_RESULTS:
+                self._cache.clear()
+            self._cache[key] = result
+        return result
+
+    @staticmethod
+    def _aggregate(data, modes, mode_id, level, start, end, mode, time_bin, min_trips, limit):
+        mask = np.ones(len(data['trip_id']), dtype=bool)
+        if start is not None:
+            mask &= data['hour_bin'] >= hour_bin(start)
+        if end is not None:
+            mask &= data['hour_bin'] <= hour_bin(end)
+        if mode is not None:
+            mask &= data['mode'] == (mode_id if mode_id is not None else -1)
+
+        shift = 2 * (geo.CELL_LEVEL - level)
+        origin = data['start_cell'][mask] >> shift
+        destination = data['end_cell'][mask] >> shift
+        hours = data['hour_bin'][mask]
+        trip_modes = data['mode'][mask]
+        distance = data['distance_km'][mask]
+        duration = data['duration_minutes'][mask]
+
+        if time_bin == 'hour':
+            bins = hours % 24
+        elif time_bin == 'day':
+            bins = hours // 24
+        else:
+            bins = np.zeros(len(hours), dtype=np.int64)
+
+        # One group per (origin, destination, bin)
+        keys = np.stack([origin, destination, bins], axis=1)
+        groups, inverse = np.unique(keys, axis=0, return_inverse=True) if len(keys) else \
+            (np.empty((0, 3), dtype=np.int64), np.empty(0, dtype=np.int64))
+        inverse = inverse.reshape(-1)
+        counts = np.bincount(inverse, minlength=len(groups))
+        distances = np.bincount(inverse, weights=distance, minlength=len(groups))
+        durations = np.bincount(inverse, weights=duration, minlength=len(groups))
+        mode_split = np.zeros((len(groups), max(len(modes), 1)), dtype=np.int64)
+        np.add.at(mode_split, (inverse, trip_modes), 1)
+
+        order = np.argsort(-counts, kind='stable')
+        order = order[counts[order] >= min_trips][:limit]
+
+        pairs = []
+        zones = {}
+        for i in order:
+            o, d, b = (int(v) for v in groups[i])
+            item = {
+                'origin': o,
+                'destination': d,
+                'trips': int(counts[i]),
+                'distance_km': round(float(distances[i]), 2),
+                'avg_duration_minutes': round(float(durations[i]) / counts[i], 1),
+                'modes': {modes[m]: int(n) for m, n in enumerate(mode_split[i]) if n}
+            }
+            if time_bin == 'hour':
+                item['hour'] = b
+            elif time_bin == 'day':
+                item['date'] = time.strftime('%Y-%m-%d', time.gmtime(b * 86400))
+            pairs.append(item)
+            for zone in (o, d):
+                if zone not in zones:
+                    lat, lng = geo.cell_center(zone, level)
+                    zones[zone] = {'lat': round(lat, 5), 'lng': round(lng, 5)}
+
+        return {
+            'level': level,
+            'time_bin': time_bin,
+            'total_trips': int(mask.sum()),
+            'pairs': pairs,
+            'zones': {str(zone): center for zone, center in zones.items()}
+        }
+
+
+od_engine = ODMatrixEngine()
@@ -0,0 +1,236 @@
+"""Per-user clustering of trip destinations into places.
+
+Trip end coordinates are grouped with a grid-accelerated DBSCAN: points are
+bucketed into eps-sized grid cells so each point is only compared against
+the 3x3 block of cells around it. Each cluster becomes a Place and its ID is
+stored on the member trips, so destination statistics are a group-by on the
+indexed trips.place_id column instead of on free-text addresses.
+
+New trips are placed incrementally as they close: joined to the nearest
+place within eps, or turned into a new place together with nearby
+unclustered trips once there are MIN_TRIPS of them. A full recluster keeps
+place IDs stable by matching new clusters to the nearest existing place,
+and deletes the places no cluster matched.
+"""
+
+import math
+import os
+from collections import Counter
+
+import numpy as np
+from sqlalchemy import bindparam, delete, func, update
+
+from extensions import db
+from models.place import Place
+from models.trip import Trip
+from services import geo, travel_profile
+
+EPS_M = float(os.getenv('PLACE_RADIUS_M', '150'))
+MIN_TRIPS = int(os.getenv('PLACE_MIN_TRIPS', '2'))
+
+
+def _nearby_filter(cell_column, lat, lng, radius_m):
+    ranges = geo.cover_ranges(*geo.radius_bbox(lat, lng, radius_m))
+    return db.or_(*[cell_column.between(low, high) for low, high in ranges])
+
+
+def _nearest_place(user_id, lat, lng):
+    candidates = Place.query.filter(
+        Place.user_id == user_id,
+        _nearby_filter(Place.cell, lat, lng, EPS_M)
+    ).all()
+    best, best_distance = None, None
+    for place in candidates:
+        distance = geo.haversine_m(lat, lng, place.lat, place.lng)
+        if distance <= EPS_M and (best_distance is None or distance < best_distance):
+            best, best_distance = place, distance
+    return best
+
+
+def _move_centroid(place, lat, lng):
+    """Fold one more member into the place's running mean position"""
+    members = db.session.query(func.count(Trip.id)).filter(
+        Trip.user_id == place.user_id, Trip.place_id == place.id
+    ).scalar() or 0
+    place.lat = (place.lat * members + lat) / (members + 1)
+    place.lng = (place.lng * members + lng) / (members + 1)
+    place.cell = geo.cell_id(place.lat, place.lng)
+
+
+def assign_trip(trip):
+    """Attach a closed trip to a place, creating one when enough trips cluster.
+
+    Returns the place id (or None while the trip is still noise). The caller
+    commits.
+    """
+    if trip.end_lat is None or trip.end_lng is None:
+        trip.place_id = None
+        return None
+    lat, lng = float(trip.end_lat), float(trip.end_lng)
+
+    if trip.place_id is not None:
+        current = Place.query.get(trip.place_id)
+        if current and geo.haversine_m(lat, lng, current.lat, current.lng) <= EPS_M:
+            return current.id
+        trip.place_id = None
+
+    place = _nearest_place(trip.user_id, lat, lng)
+    if place:
+        _move_centroid(place, lat, lng)
+        if not place.label and trip.end_address:
+            place.label = trip.end_address.strip()
+        trip.place_id = place.id
+        return place.id
+
+    # Not near a known place: look for enough unclustered neighbours
+    neighbours = [
+        t for t in Trip.query.filter(
+            Trip.user_id == trip.user_id,
+            Trip.place_id.is_(None),
+            Trip.id != trip.id,
+            _nearby_filter(Trip.end_cell, lat, lng, EPS_M)
+        ).all()
+        if t.end_lat is not None and geo.haversine_m(lat, lng, float(t.end_lat), float(t.end_lng)) <= EPS_M
+    ]
+    if len(neighbours) + 1 < MIN_TRIPS:
+        return None
+
+    members = neighbours + [trip]
+    center_lat = sum(float(t.end_lat) for t in members) / len(members)
+    center_lng = sum(float(t.end_lng) for t in members) / len(members)
+    addresses = Counter(t.end_address.strip() for t in members if t.end_address)
+    place = Place(
+        user_id=trip.user_id,
+        lat=center_lat,
+        lng=center_lng,
+        cell=geo.cell_id(center_lat, center_lng),
+        label=addresses.most_common(1)[0][0] if addresses else None
+    )
+    db.session.add(place)
+    db.session.flush()
+    for member in members:
+        member.place_id = place.id
+    # Trips counted as going nowhere in particular now have a destination
+    travel_profile.schedule_rebuild(trip.user_id)
+    return place.id
+
+
+def dbscan(lats, lngs, eps_m=EPS_M, min_samples=MIN_TRIPS):
+    """Grid-accelerated DBSCAN; returns a label per point (-1 for noise)"""
+    n = len(lats)
+    labels = np.full(n, -1, dtype=np.int64)
+    if n == 0:
+        return labels
+
+    # Local equirectangular projection in metres
+    lat0 = math.radians(float(np.mean(lats)))
+    ys = np.radians(lats) * geo.EARTH_RADIUS_M
+    xs = np.radians(lngs) * geo.EARTH_RADIUS_M * math.cos(lat0)
+    gx = np.floor(xs / eps_m).astype(np.int64)
+    gy = np.floor(ys / eps_m).astype(np.int64)
+
+    buckets = {}
+    for index, key in enumerate(zip(gx.tolist(), gy.tolist())):
+        buckets.setdefault(key, []).append(index)
+    buckets = {key: np.array(members) for key, members in buckets.items()}
+
+    eps_sq = eps_m * eps_m
+    neighbours = [None] * n
+    for (cx, cy), members in buckets.items():
+        block = [buckets[(cx + dx, cy + dy)] for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                 if (cx + dx, cy + dy) in buckets]
+        block = np.concatenate(block)
+        # Pairwise distances between this cell and its 3x3 block in one shot
+        dx = xs[members][:, None] - xs[block][None, :]
+        dy = ys[members][:, None] - ys[block][None, :]
+        within = (dx * dx + dy * dy) <= eps_sq
+        for row, index in enumerate(members):
+            neighbours[index] = block[within[row]]
+
+    core = np.array([len(neighbours[i]) >= min_samples for i in range(n)])
+
+    # Union-find over core-core links
+    parent = np.arange(n)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i in np.flatnonzero(core):
+        for j in neighbours[i]:
+            if core[j]:
+                ri, rj = find(i), find(j)
+                if ri != rj:
+                    parent[rj] = ri
+
+    roots = {}
+    for i in np.flatnonzero(core):
+        labels[i] = roots.setdefault(find(i), len(roots))
+    # Border points join the cluster of any core neighbour
+    for i in np.flatnonzero(~core):
+        for j in neighbours[i]:
+            if core[j]:
+                labels[i] = labels[j]
+                break
+    return labels
+
+
+def recluster_user(user_id):
+    """Full DBSCAN over a user's trip ends, keeping existing place IDs stable"""
+    rows = db.session.query(Trip.id, Trip.end_lat, Trip.end_lng, Trip.end_address).filter(
+        Trip.user_id == user_id,
+        Trip.end_lat.isnot(None),
+        Trip.end_lng.isnot(None)
+    ).all()
+    trip_ids = np.array([r[0] for r in rows])
+    lats = np.array([float(r[1]) for r in rows])
+    lngs = np.array([float(r[2]) for r in rows])
+    labels = dbscan(lats, lngs) if rows else np.array([], dtype=np.int64)
+
+    existing = Place.query.filter_by(user_id=user_id).all()
+    unused = {place.id: place for place in existing}
+    assignments = {}
+    for label in range(int(labels.max()) + 1 if len(labels) else 0):
+        members = labels == label
+        center_lat = float(lats[members].mean())
+        center_lng = float(lngs[members].mean())
+        addresses = Counter(rows[i][3].strip() for i in np.flatnonzero(members) if rows[i][3])
+
+        # Reuse the closest unclaimed existing place so IDs survive reclustering
+        match, match_distance = None, None
+        for place in unused.values():
+            distance = geo.haversine_m(center_lat, center_lng, place.lat, place.lng)
+            if distance <= EPS_M and (match_distance is None or distance < match_distance):
+                match, match_distance = place, distance
+        if match:
+            del unused[match.id]
+            place = match
+        else:
+            place = Place(user_id=user_id, lat=center_lat, lng=center_lng)
+            db.session.add(place)
+        place.lat, place.lng = center_lat, center_lng
+        place.cell = geo.cell_id(center_lat, center_lng)
+        if addresses:
+            place.label = addresses.most_common(1)[0][0]
+        db.session.flush()
+        for trip_id in trip_ids[members].tolist():
+            assignments[trip_id] = place.id
+
+    trips = Trip.__table__
+    if rows:
+        db.session.execute(
+            update(trips).where(trips.c.id == bindparam('trip_id')).values(place_id=bindparam('new_place_id')),
+            [{'trip_id': trip_id, 'new_place_id': assignments.get(trip_id)} for trip_id in trip_ids.tolist()]
+        )
+    if unused:
+        # No cluster is near these any more; trips without an end position may still point at them
+        db.session.execute(
+            update(trips).where(trips.c.user_id == user_id, trips.c.place_id.in_(list(unused))).values(place_id=None)
+        )
+        db.session.execute(delete(Place.__table__).where(Place.__table__.c.id.in_(list(unused))))
+    travel_profile.schedule_rebuild(user_id)
+    db.session.commit()
+    return {'user_id': user_id, 'trips': len(rows), 'places': len(set(assignments.values())),
+            'removed_places': len(unused)}
@@ -0,0 +1,347 @@
+"""Write-behind ingestion for single GPS points (POINT_WRITE_BEHIND=1).
+
+With it on, ``POST /api/trips/<id>/points`` appends the point to an
+append-only log file and answers 202 at once. A flusher thread in each
+process collects the log every POINT_FLUSH_MS milliseconds, or sooner
+once POINT_FLUSH_POINTS points are waiting. It groups the points by trip
+and stores them with one bulk insert and one commit per batch, instead of
+one commit per point.
+
+The log lives in POINT_LOG_DIR as segment files named ``<pid>-<seq>.log``,
+one JSON point per line. A segment is deleted only after its points are
+committed. Segments left by a process that is gone (a crash or restart) are
+claimed and replayed by the next process that starts. Points are unique
+per (trip_id, timestamp) (see point_store), so a segment that is replayed
+after a partial flush does not store anything twice. With POINT_LOG_FSYNC=1
+(default) every append is fsynced before the point is acknowledged.
+
+Points are validated before they are logged: latitude and longitude must
+be finite numbers in range, and the other measurements are coerced to
+float. A logged point the database still refuses, or a line from an older
+log that fails validation, is moved to ``dead-letter.jsonl`` in the log
+directory with the error. The rest of its segment is stored as usual.
+
+When POINT_BUFFER_MAX points are waiting, for example because the
+database is down, appends are refused and the route answers 429 with a
+Retry-After estimate.
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy.exc import DataError, IntegrityError
+
+from extensions import db
+from services import sharding
+
+ENABLED = os.getenv('POINT_WRITE_BEHIND', '0') == '1'
+LOG_DIR = os.getenv('POINT_LOG_DIR', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'point-log'))
+FLUSH_MS = int(os.getenv('POINT_FLUSH_MS', '200'))
+FLUSH_POINTS = int(os.getenv('POINT_FLUSH_POINTS', '1000'))
+BUFFER_MAX = int(os.getenv('POINT_BUFFER_MAX', '50000'))
+FSYNC = os.getenv('POINT_LOG_FSYNC', '1') == '1'
+
+# Seconds to wait before retrying a flush that failed, doubled up to the maximum
+RETRY_SECONDS = 1.0
+MAX_RETRY_SECONDS = 30.0
+
+FIELDS = ('trip_id', 'latitude', 'longitude', 'altitude', 'accuracy', 'speed', 'heading')
+MEASUREMENTS = FIELDS[1:]
+
+DEAD_LETTER = 'dead-letter.jsonl'
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class PointBuffer:
+    """Per-process append-only point log with a background flusher"""
+
+    def __init__(self, directory, flush_ms=200, flush_points=1000, max_pending=50000, fsync=True):
+        self.directory = directory
+        self.flush_seconds = flush_ms / 1000.0
+        self.flush_points = flush_points
+        self.max_pending = max_pending
+        self.fsync = fsync
+        self.app = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+        self._seq = 0
+        self._file = None
+        self._active = None
+        self._active_count = 0
+        self._sealed = []
+        self._pending = 0
+        self._rate = 0.0
+
+    # -- segments ----------------------------------------------------------
+
+    def _segment_path(self):
+        self._seq += 1
+        return os.path.join(self.directory, f'{self._pid}-{self._seq:08d}.log')
+
+    def _open_segment(self):
+        self._active = self._segment_path()
+        self._file = open(self._active, 'a', encoding='utf-8')
+        self._active_count = 0
+
+    def _claim_orphans(self):
+        """Take over segments of processes that are gone; returns how many points they hold"""
+        claimed = 0
+        for name in sorted(os.listdir(self.directory)):
+            owner, _, rest = name.partition('-')
+            if not rest.endswith('.log') or not owner.isdigit():
+                continue
+            # Files under our own pid predate this process (pids are reused after restarts)
+            if int(owner) != self._pid and _alive(int(owner)):
+                continue
+            path = self._segment_path()
+            try:
+                os.rename(os.path.join(self.directory, name), path)
+            except FileNotFoundError:
+                continue  # another process claimed it first
+            with open(path, encoding='utf-8') as f:
+                count = sum(1 for _ in f)
+            self._sealed.append((path, count))
+            claimed += count
+        return claimed
+
+    def _seal(self):
+        """Close the active segment so the flusher can take it (under the lock)"""
+        if self._active_count:
+            self._file.close()
+            self._sealed.append((self._active, self._active_count))
+            self._open_segment()
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def start(self):
+        """Open this process's log and start its flusher; safe to call again and after a fork"""
+        if self.app is None:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # A forked child inherits none of the parent's threads or segments
+            self._pid = os.getpid()
+            self._seq = 0
+            self._sealed = []
+            os.makedirs(self.directory, exist_ok=True)
+            replayed = self._claim_orphans()
+            self._open_segment()
+            self._pending = replayed
+        if replayed:
+            print(f"[point_buffer] replaying {replayed} logged point(s)")
+        threading.Thread(target=self._run, name='point-flusher', daemon=True).start()
+
+    # -- writes ------------------------------------------------------------
+
+    def append(self, point, user_id=None):
+        """Log a point of a user's trip for a later bulk insert; False when the buffer is full.
+
+        Raises ValueError for a point that could never be stored.
+        """
+        self.start()
+        if point.timestamp is None:
+            point.timestamp = datetime.utcnow()
+        record = {name: getattr(point, name) for name in FIELDS}
+        record['timestamp'] = point.timestamp.isoformat()
+        record['user_id'] = user_id
+        record = _clean(record)
+        for name in MEASUREMENTS:
+            setattr(point, name, record[name])
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._pending >= self.max_pending:
+                return False
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._active_count += 1
+            self._pending += 1
+            if self._active_count >= self.flush_points:
+                self._wake.set()
+        return True
+
+    def retry_after(self):
+        """Seconds until the backlog should have room again, from the recent flush rate"""
+        with self._lock:
+            overflow = self._pending - self.max_pending + self.flush_points
+            rate = self._rate
+        if rate <= 0:
+            return int(MAX_RETRY_SECONDS)
+        return max(1, min(int(MAX_RETRY_SECONDS), math.ceil(overflow / rate)))
+
+    def pending(self):
+        with self._lock:
+            return self._pending
+
+    # -- flushing ----------------------------------------------------------
+
+    def _run(self):
+        delay = RETRY_SECONDS
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+                delay = RETRY_SECONDS
+            except Exception as e:
+                print(f"[point_buffer] flush failed, retrying in {delay:.0f}s: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_SECONDS)
+
+    def flush(self):
+        """Store every sealed segment and the active one; returns the number of points stored"""
+        with self._flush_lock:
+            with self._lock:
+                if self._pid != os.getpid():
+                    return 0
+                self._seal()
+                segments = list(self._sealed)
+            stored = 0
+            for path, count in segments:
+                started = time.perf_counter()
+                stored += self._store(_read_segment(path))
+                os.remove(path)
+                with self._lock:
+                    self._sealed.remove((path, count))
+                    self._pending -= count
+                    self._rate = count / max(time.perf_counter() - started, 1e-6)
+            return stored
+
+    def _store(self, records):
+        stored = 0
+        with self.app.app_context():
+            try:
+                for start in range(0, len(records), self.flush_points):
+                    by_shard = {}
+                    for record in records[start:start + self.flush_points]:
+                        try:
+                            record = _clean(record)
+                        except (KeyError, ValueError) as e:
+                            self._quarantine(record, e)
+                            continue
+                        by_shard.setdefault(_shard_of(record), []).append(record)
+                    for name, chunk in by_shard.items():
+                        with sharding.on_shard(name):
+                            try:
+                                stored += self._store_chunk(chunk)
+                            except (DataError, IntegrityError):
+                                # One bad row fails the whole insert; store the points one by one to find it
+                                db.session.rollback()
+                                for record in chunk:
+                                    try:
+                                        stored += self._store_chunk([record])
+                                    except (DataError, IntegrityError) as e:
+                                        db.session.rollback()
+                                        self._quarantine(record, e)
+            except Exception:
+                db.session.rollback()
+                raise
+        return stored
+
+    def _store_chunk(self, records):
+        """Insert and commit points of one shard; returns how many were new"""
+        from models.trip import Trip
+        from models.trip_point import TripPoint
+        from services.point_store import point_store
+        from services.trip_lifecycle import points_added
+
+        # Points of trips deleted meanwhile are dropped
+        trips = {trip.id: trip for trip in Trip.query.filter(Trip.id.in_({r['trip_id'] for r in records})).all()}
+        points = [
+            TripPoint(timestamp=datetime.fromisoformat(r['timestamp']), **{n: r[n] for n in FIELDS})
+            for r in records if r['trip_id'] in trips
+        ]
+        by_trip = {}
+        for point in point_store.add_many(points):
+            by_trip.setdefault(point.trip_id, []).append(point)
+        for trip_id, trip_points in by_trip.items():
+            points_added(trips[trip_id], trip_points)
+        db.session.commit()
+        return sum(len(p) for p in by_trip.values())
+
+    def _quarantine(self, record, error):
+        """Set a point that cannot be stored aside, so it does not hold up its segment forever"""
+        line = json.dumps({'record': record, 'error': str(error).splitlines()[0][:500],
+                           'at': datetime.utcnow().isoformat()}, separators=(',', ':'), default=str)
+        with open(os.path.join(self.directory, DEAD_LETTER), 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+        print(f"[point_buffer] dead-lettered a point of trip {record.get('trip_id')}: {line}")
+
+
+def _shard_of(record):
+    """Shard of the user a logged point belongs to; ShardMoving holds the flush until a move is done"""
+    if not sharding.shards.enabled:
+        return sharding.PRIMARY
+    # Lines logged before sharding was on carry no user_id
+    user_id = record.get('user_id') or sharding.shards.owner('trips', record['trip_id'])
+    if user_id is None:
+        return sharding.PRIMARY
+    name, moving_to = sharding.shards.lookup(user_id)
+    if moving_to is not None:
+        raise sharding.ShardMoving(user_id)
+    return name
+
+
+def _clean(record):
+    """A logged point with its measurements as floats; ValueError when it could never be stored"""
+    try:
+        cleaned = {
+            'trip_id': int(record['trip_id']),
+            'timestamp': datetime.fromisoformat(record['timestamp']).isoformat(),
+            'user_id': record.get('user_id')
+        }
+        for name in MEASUREMENTS:
+            value = record.get(name)
+            cleaned[name] = None if value is None else float(value)
+            if cleaned[name] is not None and not math.isfinite(cleaned[name]):
+                raise ValueError(f'{name} must be a finite number')
+    except TypeError as e:
+        raise ValueError(str(e)) from e
+    if cleaned['latitude'] is None or cleaned['longitude'] is None:
+        raise ValueError('latitude and longitude are required')
+    if not -90 <= cleaned['latitude'] <= 90 or not -180 <= cleaned['longitude'] <= 180:
+        raise ValueError('latitude or longitude out of range')
+    return cleaned
+
+
+def _read_segment(path):
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # A line torn by a crash mid-append was never acknowledged
+                continue
+    return records
+
+
+point_buffer = PointBuffer(LOG_DIR, FLUSH_MS, FLUSH_POINTS, BUFFER_MAX, FSYNC)
+
+
+def init_app(app):
+    """Remember the app for the flusher; the log and thread start on first use in each process"""
+    if ENABLED:
+        point_buffer.app = app
+
+
+def start():
+    """Start this process's flusher now, replaying points logged before a restart"""
+    point_buffer.start()
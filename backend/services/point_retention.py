@@ -0,0 +1,269 @@
+"""Age-based retention for GPS points.
+
+Analytics read trip-level fields and maps draw simplified lines, so old
+points are rarely needed at full resolution. A retention pass applies three
+tiers by trip age:
+
+* trips that ended within RETENTION_FULL_DAYS keep every point;
+* older trips are thinned: a point is dropped when the simplified line
+  (Douglas-Peucker) stays within RETENTION_TOLERANCE_M of it, unless that
+  would leave a gap of more than RETENTION_MAX_GAP_SECONDS between kept
+  points;
+* with RETENTION_DROP_DAYS set, trips that started longer ago than that lose
+  their points entirely. Whole partitions that old are dropped with
+  point_store.drop_before, and the rest is deleted in batches.
+
+Trip rows and their distance, duration, CO2 and cost stay as they are;
+``trips.point_detail`` records whether a trip's points were thinned or
+dropped, so each trip is handled once. Passes work through
+RETENTION_TRIP_BATCH trips per short transaction and pause
+RETENTION_PAUSE_SECONDS between batches. A dry run walks the same trips
+without writing and reports how many points and bytes a pass would
+reclaim.
+"""
+
+import math
+import os
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import func, select, text, update
+
+from extensions import db
+from models.trip import Trip
+from services import geo, heatmap_tiles, jobs, sharding
+from services.deletion import BATCH_SIZE as DELETE_BATCH_SIZE
+from services.point_store import point_store
+
+FULL_DAYS = float(os.getenv('RETENTION_FULL_DAYS', '90'))
+TOLERANCE_M = float(os.getenv('RETENTION_TOLERANCE_M', '10'))
+MAX_GAP_SECONDS = float(os.getenv('RETENTION_MAX_GAP_SECONDS', '60'))
+DROP_DAYS = float(os.getenv('RETENTION_DROP_DAYS', '0'))  # 0 keeps thinned points forever
+TRIP_BATCH = int(os.getenv('RETENTION_TRIP_BATCH', '200'))
+PAUSE_SECONDS = float(os.getenv('RETENTION_PAUSE_SECONDS', '0.1'))
+
+THINNED = 'thinned'
+DROPPED = 'dropped'
+
+# Bytes per point row and its index entries when the database cannot tell
+DEFAULT_POINT_BYTES = 100
+
+_M_PER_DEG = math.pi * geo.EARTH_RADIUS_M / 180.0
+
+
+def thin(lats, lngs, seconds, tolerance_m=TOLERANCE_M, max_gap_seconds=MAX_GAP_SECONDS):
+    """Mask of the points to keep from one time-ordered track"""
+    n = len(lats)
+    keep = np.zeros(n, dtype=bool)
+    if n <= 2:
+        keep[:] = True
+        return keep
+
+    # Local equirectangular metres are accurate enough at trip scale
+    y = (lats - lats[0]) * _M_PER_DEG
+    x = (lngs - lngs[0]) * _M_PER_DEG * math.cos(math.radians(float(np.mean(lats))))
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        px, py = x[first + 1:last] - x[first], y[first + 1:last] - y[first]
+        length2 = dx * dx + dy * dy
+        if length2 > 0:
+            t = np.clip((px * dx + py * dy) / length2, 0.0, 1.0)
+            px, py = px - t * dx, py - t * dy
+        distances = np.hypot(px, py)
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance_m:
+            middle = first + 1 + farthest
+            keep[middle] = True
+            stack.append((first, middle))
+            stack.append((middle, last))
+
+    if max_gap_seconds:
+        # Keep the last point before a gap would grow too long; points
+        # without a timestamp (NaN) never force a keep
+        last_kept, last_index = seconds[0], 0
+        for i in range(1, n):
+            if seconds[i] - last_kept > max_gap_seconds and last_index < i - 1:
+                keep[i - 1] = True
+                last_kept, last_index = seconds[i - 1], i - 1
+            if keep[i]:
+                last_kept, last_index = seconds[i], i
+    return keep
+
+
+def bytes_per_point():
+    """Average bytes a stored point takes, indexes included"""
+    dialect = db.engine.dialect.name
+    # trip_points, its period tables and (for dbstat) their indexes
+    pattern = '%trip_points%'
+    try:
+        if dialect == 'sqlite':
+            size = db.session.execute(text(
+                'SELECT SUM(pgsize) FROM dbstat WHERE name LIKE :pattern'), {'pattern': pattern}).scalar()
+        elif dialect == 'postgresql':
+            size = db.session.execute(text(
+                "SELECT SUM(pg_total_relation_size(oid)) FROM pg_class WHERE relkind = 'r' AND relname LIKE :pattern"
+            ), {'pattern': pattern}).scalar()
+        elif dialect == 'mysql':
+            size = db.session.execute(text(
+                'SELECT SUM(data_length + index_length) FROM information_schema.tables '
+                'WHERE table_schema = DATABASE() AND table_name LIKE :pattern'), {'pattern': pattern}).scalar()
+        else:
+            size = None
+    except Exception:
+        # e.g. SQLite builds without the dbstat table
+        db.session.rollback()
+        size = None
+    count = point_store.count()
+    if not size or not count:
+        return DEFAULT_POINT_BYTES
+    return float(size) / count
+
+
+def _pause():
+    if PAUSE_SECONDS:
+        time.sleep(PAUSE_SECONDS)
+
+
+def _invalidate_heatmaps(user_ids):
+    for user_id in user_ids:
+        heatmap_tiles.trips_changed(db.session, user_id, deleted=True)
+
+
+def _mark(trip_ids, detail):
+    db.session.execute(update(Trip), [{'id': trip_id, 'point_detail': detail} for trip_id in trip_ids])
+
+
+def _not_dropped():
+    return db.or_(Trip.point_detail.is_(None), Trip.point_detail != DROPPED)
+
+
+def _drop_pass(cutoff, dry_run, report, job=None):
+    """Remove every point of trips that started before cutoff"""
+    if point_store.mode != 'off':
+        # Whole periods before the cutoff only hold points of such trips
+        report['partitions'] = point_store.drop_before(cutoff, dry_run=True)
+        if not dry_run:
+            for name in report['partitions']:
+                report['points'] += db.session.execute(text(f'SELECT COUNT(*) FROM {name}')).scalar()
+            point_store.drop_before(cutoff)
+
+    where = [Trip.start_time < cutoff, _not_dropped()]
+    total = db.session.query(func.count(Trip.id)).filter(*where).scalar() or 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(Trip.id, Trip.user_id).where(*where, Trip.id > last_id).order_by(Trip.id).limit(TRIP_BATCH)
+        ).all()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        trip_ids = [row.id for row in rows]
+        report['trips'] += len(rows)
+        if dry_run:
+            points = point_store.source()
+            report['points'] += db.session.query(func.count(points.id)).filter(points.trip_id.in_(trip_ids)).scalar()
+            continue
+        while True:
+            deleted = point_store.delete_trips(trip_ids, limit=DELETE_BATCH_SIZE)
+            if not deleted:
+                break
+            db.session.commit()
+            report['points'] += deleted
+            _pause()
+        _mark(trip_ids, DROPPED)
+        _invalidate_heatmaps({row.user_id for row in rows})
+        if job is not None:
+            job.progress(0.5 * report['trips'] / max(total, 1), f"{report['trips']} of {total} trips cleared")
+        db.session.commit()
+        _pause()
+
+
+def _thin_pass(cutoff, floor, dry_run, report, job=None):
+    """Thin the points of trips that ended before cutoff (and started at or after floor)"""
+    where = [Trip.end_time < cutoff, Trip.point_detail.is_(None)]
+    if floor is not None:
+        where.append(Trip.start_time >= floor)
+    total = db.session.query(func.count(Trip.id)).filter(*where).scalar() or 0
+    last_id = 0
+    while True:
+        trips = db.session.execute(
+            select(Trip.id, Trip.user_id, Trip.start_time, Trip.end_time)
+            .where(*where, Trip.id > last_id).order_by(Trip.id).limit(TRIP_BATCH)
+        ).all()
+        if not trips:
+            return
+        last_id = trips[-1].id
+        points = point_store.source_for_trips([t.id for t in trips])
+        rows = db.session.query(points.id, points.trip_id, points.latitude, points.longitude, points.timestamp).filter(
+            points.trip_id.in_([t.id for t in trips])
+        ).order_by(points.trip_id, points.timestamp, points.id).all()
+
+        user_ids = {t.id: t.user_id for t in trips}
+        doomed, users = [], set()
+        start = 0
+        while start < len(rows):
+            end = start
+            while end < len(rows) and rows[end].trip_id == rows[start].trip_id:
+                end += 1
+            track = rows[start:end]
+            keep = thin(
+                np.array([float(r.latitude) for r in track]),
+                np.array([float(r.longitude) for r in track]),
+                np.array([r.timestamp.timestamp() if r.timestamp else np.nan for r in track])
+            )
+            dropped = [r.id for r, kept in zip(track, keep) if not kept]
+            if dropped:
+                doomed.extend(dropped)
+                users.add(user_ids[track[0].trip_id])
+            start = end
+
+        report['trips'] += len(trips)
+        report['points_before'] += len(rows)
+        report['points'] += len(doomed)
+        if not dry_run:
+            point_store.delete_ids(doomed)
+            _mark([t.id for t in trips], THINNED)
+            _invalidate_heatmaps(users)
+            if job is not None:
+                job.progress(0.5 + 0.5 * min(1.0, report['trips'] / max(total, 1)),
+                             f"{report['trips']} of {total} trips thinned")
+            db.session.commit()
+            _pause()
+
+
+def run(dry_run=False, job=None, now=None):
+    """One retention pass; returns a report of what was (or would be) reclaimed"""
+    started = time.time()
+    now = now or datetime.utcnow()
+    drop_cutoff = now - timedelta(days=DROP_DAYS) if DROP_DAYS else None
+    thin_cutoff = now - timedelta(days=FULL_DAYS)
+    point_bytes = bytes_per_point()
+
+    report = {'dry_run': dry_run, 'full_before': thin_cutoff.isoformat()}
+    if drop_cutoff is not None:
+        report['drop'] = {'before': drop_cutoff.isoformat(), 'trips': 0, 'points': 0, 'partitions': []}
+        _drop_pass(drop_cutoff, dry_run, report['drop'], job)
+    thinned = {'tolerance_m': TOLERANCE_M, 'max_gap_seconds': MAX_GAP_SECONDS,
+               'trips': 0, 'points_before': 0, 'points': 0}
+    _thin_pass(thin_cutoff, drop_cutoff, dry_run, thinned, job)
+    report['thin'] = thinned
+
+    removed = thinned['points'] + report.get('drop', {}).get('points', 0)
+    report['points_removed'] = removed
+    report['bytes_reclaimed'] = int(removed * point_bytes)
+    report['seconds'] = round(time.time() - started, 1)
+    verb = 'would remove' if dry_run else 'removed'
+    print(f"[retention] {verb} {removed} points (~{report['bytes_reclaimed'] / 1e6:.1f} MB) "
+          f"in {report['seconds']}s")
+    return report
+
+
+@jobs.handler('point_retention')
+def _retention_job(payload, job):
+    return sharding.per_shard(lambda: run(dry_run=payload.get('dry_run', False), job=job))
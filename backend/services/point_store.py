@@ -0,0 +1,470 @@
+"""Time-partitioned storage for GPS points.
+
+POINT_PARTITIONING selects how trip_points is stored:
+
+* ``off`` (default): the single trip_points table.
+* ``native``: Postgres declarative partitioning. trip_points becomes a
+  parent table partitioned by RANGE (timestamp) with one partition per
+  period, created on demand; Postgres prunes partitions for time-bounded
+  queries. Convert an existing table with ``tools/point_partitions.py convert``.
+* ``tables``: a portable emulation for SQLite/MySQL. Each period gets its
+  own trip_points_p<period> table; writes are routed by timestamp and
+  reads are a UNION ALL over just the period tables overlapping the
+  requested window (plus the legacy trip_points table). Point ids exposed
+  to clients are ``(period ordinal << 32) + local id`` so they stay unique.
+
+POINT_PARTITION_PERIOD is ``month`` (default), ``week`` or ``day``; it must
+not change once partitions exist. Dropping a whole period is a DROP TABLE
+in both partitioned modes instead of a large DELETE.
+
+In every mode a trip has at most one point per timestamp. Writes insert
+with ON CONFLICT DO NOTHING (INSERT IGNORE on MySQL), so a retried upload
+is dropped by the unique index rather than stored twice.
+"""
+
+import os
+import re
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import (Column, Index, MetaData, Table, and_, event, exists, func, inspect, literal, select, text,
+                        union_all)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, aliased
+
+from extensions import db
+from models.trip_point import TripPoint
+from services import sharding
+
+MODES = ('off', 'native', 'tables')
+PERIODS = ('month', 'week', 'day')
+
+PARTITION_PREFIX = 'trip_points_p'
+ID_SHIFT = 32
+
+# Weeks start on Mondays, counted from this one
+WEEK_EPOCH = date(2000, 1, 3)
+
+# Period tables probed per query when looking for the ones holding a trip's points
+PROBE_CHUNK = 100
+
+# Minimum seconds between catalogue refreshes when a partition seems missing
+REFRESH_SECONDS = 1.0
+
+base = TripPoint.__table__
+
+_name_pattern = re.compile(r'^' + PARTITION_PREFIX + r'(\d{4})_(\d{2})(?:_(\d{2}))?$')
+
+# Dialects with INSERT ... ON CONFLICT DO NOTHING
+_INSERT_IGNORE = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def _naive_utc(value):
+    """Timestamps are stored as naive UTC, so equal instants compare equal"""
+    if value is None:
+        return datetime.utcnow()
+    if value.tzinfo is not None:
+        return datetime.utcfromtimestamp(value.timestamp())
+    return value
+
+
+class PointStore:
+    """Routes point writes, reads and deletes to the right partitions"""
+
+    def __init__(self, mode='off', period='month'):
+        if mode not in MODES:
+            raise ValueError(f"POINT_PARTITIONING must be one of {', '.join(MODES)}")
+        if period not in PERIODS:
+            raise ValueError(f"POINT_PARTITION_PERIOD must be one of {', '.join(PERIODS)}")
+        self.mode = mode
+        self.period = period
+        self._lock = threading.Lock()
+        self._metadata = MetaData()
+        # {shard: ({ordinal: table name}, loaded at)}; each shard has its own partitions
+        self._catalogues = {}
+        self._checked_dialect = False
+
+    # -- periods -----------------------------------------------------------
+
+    def ordinal(self, ts):
+        """Period number for a timestamp; consecutive periods differ by one"""
+        if self.period == 'month':
+            return (ts.year - 2000) * 12 + ts.month
+        days = ((ts.date() if isinstance(ts, datetime) else ts) - WEEK_EPOCH).days
+        return days // 7 + 1 if self.period == 'week' else days + 1
+
+    def bounds(self, ordinal):
+        """[start, end) datetimes of a period"""
+        if self.period == 'month':
+            year, month = divmod(ordinal - 1, 12)
+            start = datetime(2000 + year, month + 1, 1)
+            year, month = divmod(ordinal, 12)
+            return start, datetime(2000 + year, month + 1, 1)
+        length = 7 if self.period == 'week' else 1
+        start = datetime.combine(WEEK_EPOCH + timedelta(days=(ordinal - 1) * length), datetime.min.time())
+        return start, start + timedelta(days=length)
+
+    def partition_name(self, ordinal):
+        start, _ = self.bounds(ordinal)
+        return PARTITION_PREFIX + start.strftime('%Y_%m' if self.period == 'month' else '%Y_%m_%d')
+
+    def _ordinal_from_name(self, name):
+        match = _name_pattern.match(name)
+        if not match:
+            return None
+        year, month, day = match.groups()
+        return self.ordinal(datetime(int(year), int(month), int(day or 1)))
+
+    # -- catalogue ---------------------------------------------------------
+
+    def _check_dialect(self):
+        if not self._checked_dialect:
+            self._checked_dialect = True
+            if self.mode == 'native' and db.engine.dialect.name != 'postgresql':
+                print(f"[point_store] native partitioning needs Postgres, using per-period tables on "
+                      f"{db.engine.dialect.name}")
+                self.mode = 'tables'
+
+    def _period_table(self, name):
+        table = self._metadata.tables.get(name)
+        if table is None:
+            columns = [Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable)
+                       for c in base.columns]
+            table = Table(
+                name, self._metadata, *columns,
+                Index(f'ix_{name}_trip_id', 'trip_id'),
+                Index(f'ix_{name}_cell', 'cell'),
+                Index(f'ix_{name}_timestamp', 'timestamp'),
+                Index(f'uq_{name}_trip_timestamp', 'trip_id', 'timestamp', unique=True)
+            )
+        return table
+
+    def _list_partitions(self):
+        if self.mode == 'native':
+            names = db.session.execute(text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent "
+                "WHERE p.relname = :parent"
+            ), {'parent': base.name}).scalars().all()
+        else:
+            names = inspect(sharding.shards.engine()).get_table_names()
+        return {ordinal: name for ordinal, name in ((self._ordinal_from_name(n), n) for n in names)
+                if ordinal is not None}
+
+    def _partitions(self, refresh=False):
+        """{ordinal: table name}, reloaded from the database when asked"""
+        self._check_dialect()
+        shard = sharding.current()
+        with self._lock:
+            tables, loaded_at = self._catalogues.get(shard, (None, 0.0))
+            if tables is None or (refresh and time.time() - loaded_at > REFRESH_SECONDS):
+                tables = self._list_partitions()
+                self._catalogues[shard] = (tables, time.time())
+            return dict(tables)
+
+    def _forget_partition(self, shard, ordinal):
+        with self._lock:
+            tables, _ = self._catalogues.get(shard, (None, 0.0))
+            if tables:
+                tables.pop(ordinal, None)
+
+    def _ensure(self, ordinal):
+        """Create the partition for a period if it does not exist yet"""
+        if ordinal in self._partitions():
+            return
+        if ordinal in self._partitions(refresh=True):
+            return
+
+        name = self.partition_name(ordinal)
+        engine = sharding.shards.engine()
+        if engine.dialect.name == 'sqlite':
+            # SQLite has a single writer, so a second connection would wait on
+            # the caller's open transaction; create the table inside it instead
+            session = db.session()
+            self._period_table(name).create(session.connection(), checkfirst=True)
+            session.info.setdefault('created_partitions', []).append((sharding.current(), ordinal))
+        else:
+            # DDL runs on its own connection so it is not tied to the caller's transaction
+            with engine.begin() as conn:
+                if self.mode == 'native':
+                    start, end = self.bounds(ordinal)
+                    conn.execute(text(
+                        f'CREATE TABLE IF NOT EXISTS {name} PARTITION OF {base.name} '
+                        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                    ))
+                else:
+                    self._period_table(name).create(conn, checkfirst=True)
+        with self._lock:
+            self._catalogues[sharding.current()][0][ordinal] = name
+        print(f"[point_store] created partition {name}")
+
+    def create_ahead(self, periods=2, now=None):
+        """Pre-create the current and next few partitions"""
+        if self.mode == 'off':
+            return []
+        current = self.ordinal(now or datetime.utcnow())
+        for ordinal in range(current, current + periods + 1):
+            self._ensure(ordinal)
+        return [self.partition_name(o) for o in range(current, current + periods + 1)]
+
+    def partitions(self):
+        """Partitions with their time bounds, oldest first"""
+        if self.mode == 'off':
+            return []
+        result = []
+        for ordinal, name in sorted(self._partitions(refresh=True).items()):
+            start, end = self.bounds(ordinal)
+            result.append({'name': name, 'start': start.isoformat(), 'end': end.isoformat()})
+        return result
+
+    # -- writes ------------------------------------------------------------
+
+    def add(self, point):
+        """Store a new point (the caller commits).
+
+        Returns the point with its id set, or None when the trip already has a
+        point at that timestamp.
+        """
+        stored = self.add_many([point])
+        return stored[0] if stored else None
+
+    def add_many(self, points):
+        """Store points with one insert per target table (the caller commits).
+
+        Points whose (trip_id, timestamp) is already stored, or repeated in
+        the batch, are skipped by the unique index instead of failing the
+        transaction. Returns the points that were stored, with ids set.
+        """
+        self._check_dialect()
+        batch = {}
+        for point in points:
+            point.timestamp = _naive_utc(point.timestamp)
+            batch.setdefault((point.trip_id, point.timestamp), point)
+
+        groups = {}
+        for point in batch.values():
+            ordinal = self.ordinal(point.timestamp)
+            if self.mode != 'off':
+                self._ensure(ordinal)
+            if self.mode == 'tables':
+                key = (self.partition_name(ordinal), ordinal << ID_SHIFT)
+            else:
+                key = (base.name, 0)
+            groups.setdefault(key, []).append(point)
+
+        stored = []
+        for (name, id_offset), group in groups.items():
+            table = base if name == base.name else self._period_table(name)
+            for point, local_id in self._insert_ignoring_duplicates(table, group):
+                point.id = id_offset + local_id
+                stored.append(point)
+        return stored
+
+    def _insert_ignoring_duplicates(self, table, points):
+        """Insert points into one table; yields (point, id) for the rows actually inserted"""
+        columns = [c.name for c in base.columns if c.name != 'id']
+        values = [{name: getattr(point, name) for name in columns} for point in points]
+        dialect = sharding.shards.engine().dialect
+        if dialect.name in _INSERT_IGNORE and dialect.insert_executemany_returning:
+            # INSERT ... ON CONFLICT DO NOTHING RETURNING: skipped rows return nothing
+            statement = _INSERT_IGNORE[dialect.name](table).on_conflict_do_nothing().returning(
+                table.c.id, table.c.trip_id, table.c.timestamp
+            )
+            by_key = {(point.trip_id, point.timestamp): point for point in points}
+            for row in db.session.execute(statement, values):
+                yield by_key[(row.trip_id, row.timestamp)], row.id
+            return
+
+        # No multi-row RETURNING (MySQL): one INSERT IGNORE per point
+        statement = table.insert().prefix_with('IGNORE', dialect='mysql').prefix_with('OR IGNORE', dialect='sqlite')
+        for point, row in zip(points, values):
+            result = db.session.execute(statement, row)
+            if result.rowcount:
+                yield point, result.inserted_primary_key[0]
+
+    def find(self, trip_id, timestamp):
+        """The stored point of a trip at a timestamp, or None"""
+        timestamp = _naive_utc(timestamp)
+        points = self.source(timestamp, timestamp)
+        return db.session.query(points).filter(
+            points.trip_id == trip_id, points.timestamp == timestamp
+        ).first()
+
+    def dedupe(self, limit=10000):
+        """Delete up to limit repeated (trip_id, timestamp) points per table, keeping the oldest row.
+
+        Call until it returns no trip ids; each call fits in a short
+        transaction (the caller commits). Returns the ids of trips that lost
+        points.
+        """
+        self._check_dialect()
+        tables = [base]
+        if self.mode == 'tables':
+            tables += [self._period_table(name) for name in self._partitions(refresh=True).values()]
+        trip_ids = set()
+        for table in tables:
+            kept = table.alias('kept')
+            rows = db.session.execute(
+                select(table.c.id, table.c.trip_id).distinct().join(kept, and_(
+                    kept.c.trip_id == table.c.trip_id,
+                    kept.c.timestamp == table.c.timestamp,
+                    kept.c.id < table.c.id
+                )).limit(limit)
+            ).all()
+            if rows:
+                db.session.execute(table.delete().where(table.c.id.in_([row.id for row in rows])))
+                trip_ids.update(row.trip_id for row in rows)
+        return trip_ids
+
+    def delete_trips(self, trip_ids, limit=None):
+        """Delete points of trips (a list or an id subquery) with set-based DELETEs.
+
+        With a limit, at most that many rows go per table so callers can work
+        in short transactions. Returns the number of rows deleted.
+        """
+        self._check_dialect()
+        tables = [base]
+        if self.mode == 'tables':
+            tables += [self._period_table(name) for name in self._partitions(refresh=True).values()]
+        deleted = 0
+        for table in tables:
+            where = table.c.trip_id.in_(trip_ids)
+            if limit is not None:
+                # Ids first: MySQL rejects LIMIT inside an IN subquery
+                ids = db.session.execute(select(table.c.id).where(where).limit(limit)).scalars().all()
+                if not ids:
+                    continue
+                where = table.c.id.in_(ids)
+            deleted += db.session.execute(table.delete().where(where)).rowcount
+        return deleted
+
+    def delete_ids(self, point_ids, chunk=1000):
+        """Delete points by the ids clients see (the caller commits); returns the number deleted"""
+        self._check_dialect()
+        by_ordinal = {}
+        for point_id in point_ids:
+            ordinal = point_id >> ID_SHIFT if self.mode == 'tables' else 0
+            by_ordinal.setdefault(ordinal, []).append(point_id - (ordinal << ID_SHIFT))
+        deleted = 0
+        for ordinal, ids in by_ordinal.items():
+            # Legacy rows in tables mode keep plain ids (ordinal 0)
+            table = base if ordinal == 0 else self._period_table(self.partition_name(ordinal))
+            for start in range(0, len(ids), chunk):
+                deleted += db.session.execute(table.delete().where(table.c.id.in_(ids[start:start + chunk]))).rowcount
+        return deleted
+
+    def drop_before(self, cutoff, dry_run=False):
+        """Drop every partition that ends on or before cutoff; O(1) per partition"""
+        if self.mode == 'off':
+            return []
+        dropped = []
+        for ordinal, name in sorted(self._partitions(refresh=True).items()):
+            if self.bounds(ordinal)[1] > cutoff:
+                continue
+            dropped.append(name)
+            if dry_run:
+                continue
+            with sharding.shards.engine().begin() as conn:
+                if self.mode == 'native':
+                    conn.execute(text(f'ALTER TABLE {base.name} DETACH PARTITION {name}'))
+                conn.execute(text(f'DROP TABLE {name}'))
+            self._forget_partition(sharding.current(), ordinal)
+            self._metadata.remove(self._period_table(name))
+            print(f"[point_store] dropped partition {name}")
+        return dropped
+
+    # -- reads -------------------------------------------------------------
+
+    def _overlapping(self, start, end):
+        partitions = self._partitions()
+        if end is None or self.ordinal(end) not in partitions:
+            # The newest period may have been created by another worker
+            partitions = self._partitions(refresh=True)
+        low = self.ordinal(start) if start else None
+        high = self.ordinal(end) if end else None
+        return [(ordinal, name) for ordinal, name in sorted(partitions.items())
+                if (low is None or ordinal >= low) and (high is None or ordinal <= high)]
+
+    def source(self, start=None, end=None):
+        """TripPoint, or an alias of it over only the partitions overlapping [start, end].
+
+        Callers still filter on the timestamp column themselves; the window
+        only decides which period tables are read.
+        """
+        self._check_dialect()
+        if self.mode != 'tables':
+            return TripPoint
+        return self._union(self._overlapping(start, end))
+
+    def _union(self, partitions):
+        selects = [select(*base.columns)]
+        for ordinal, name in partitions:
+            table = self._period_table(name)
+            selects.append(select(
+                *[(table.c.id + (ordinal << ID_SHIFT)).label('id') if c.name == 'id' else table.c[c.name]
+                  for c in base.columns]
+            ))
+        return aliased(TripPoint, union_all(*selects).subquery(base.name), name='trip_points')
+
+    def _holding(self, trip_ids):
+        """(ordinal, name) of the period tables holding any point of these trips"""
+        partitions = sorted(self._partitions(refresh=True).items())
+        found = set()
+        for i in range(0, len(partitions), PROBE_CHUNK):
+            probes = []
+            for ordinal, name in partitions[i:i + PROBE_CHUNK]:
+                table = self._period_table(name)
+                probes.append(select(literal(ordinal)).where(exists().where(table.c.trip_id.in_(trip_ids))))
+            found.update(db.session.execute(union_all(*probes)).scalars())
+        return [(ordinal, name) for ordinal, name in partitions if ordinal in found]
+
+    def source_for_trips(self, trip_ids):
+        """TripPoint, or an alias of it over the partitions that hold these trips' points.
+
+        Points are stored by their own timestamps, which a skewed device clock
+        or a long open trip can put far outside the trip's start and end, so
+        the partitions are found with one trip_id index probe per table
+        rather than from the trip's time span. Callers filter on trip_id.
+        """
+        self._check_dialect()
+        if self.mode != 'tables':
+            return TripPoint
+        return self._union(self._holding(list(trip_ids)))
+
+    def _trip_points_query(self, trip):
+        points = self.source_for_trips([trip.id])
+        return points, db.session.query(points).filter(points.trip_id == trip.id).order_by(points.timestamp)
+
+    def trip_points(self, trip):
+        """A trip's points in time order, read from the partitions that hold them"""
+        return self._trip_points_query(trip)[1].all()
+
+    def trip_point_rows(self, trip, columns):
+        """Like trip_points, but only the named columns as plain tuples"""
+        points, query = self._trip_points_query(trip)
+        return query.with_entities(*[getattr(points, name) for name in columns]).all()
+
+    def count(self):
+        points = self.source()
+        return db.session.query(func.count(points.id)).scalar()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_rolled_back(session, previous_transaction):
+    # Tables created inside a transaction that rolled back no longer exist
+    if previous_transaction.parent is None:
+        for shard, ordinal in session.info.pop('created_partitions', []):
+            point_store._forget_partition(shard, ordinal)
+
+
+@event.listens_for(Session, 'after_commit')
+def _keep_committed(session):
+    session.info.pop('created_partitions', None)
+
+
+point_store = PointStore(
+    os.getenv('POINT_PARTITIONING', 'off'),
+    os.getenv('POINT_PARTITION_PERIOD', 'month')
+)
@@ -0,0 +1,179 @@
+"""Query budgets for expensive read endpoints.
+
+A view decorated with ``@budget(seconds=..., rows=...)`` runs its queries
+under one deadline, set when the view starts: each statement's timeout is
+the time left until it, so many short statements cannot add up past the
+budget. The timeout is ``statement_timeout`` on
+Postgres and ``max_execution_time`` on MySQL. On SQLite a progress handler
+interrupts a statement that runs past it. Results fetched with
+``fetch_all()`` are capped at the row budget. A view that goes over either
+limit answers 422 with ``"code": "query_budget_exceeded"``, telling the
+client to narrow its range, and the breach is logged.
+
+Budgeted views share QUERY_BUDGET_SLOTS slots per host. The slots are a
+semaphore in each process, so every gunicorn worker (WEB_CONCURRENCY) gets
+an equal share, at least one. When every
+slot is busy for QUERY_BUDGET_SLOT_WAIT_SECONDS, the request gets 503 with
+Retry-After. A burst of dashboard queries can then never hold every worker
+thread and connection that point ingest needs.
+"""
+
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import g, has_app_context, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.pool import Pool
+
+from extensions import db
+
+DEFAULT_SECONDS = float(os.getenv('QUERY_BUDGET_SECONDS', '10'))
+DEFAULT_ROWS = int(os.getenv('QUERY_BUDGET_ROWS', '200000'))
+# Per process: the host-wide QUERY_BUDGET_SLOTS split across the gunicorn workers
+SLOTS = max(1, int(os.getenv('QUERY_BUDGET_SLOTS', '8')) // int(os.getenv('WEB_CONCURRENCY', '2')))
+SLOT_WAIT_SECONDS = float(os.getenv('QUERY_BUDGET_SLOT_WAIT_SECONDS', '1'))
+
+# SQLite VM instructions between deadline checks
+SQLITE_CHECK_EVERY = 10000
+
+# MySQL ER_QUERY_TIMEOUT, Postgres query_canceled
+MYSQL_TIMEOUT_ERRORS = (3024,)
+POSTGRES_TIMEOUT_CODE = '57014'
+
+_slots = threading.BoundedSemaphore(SLOTS)
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, kind, limit):
+        super().__init__(f'{kind} budget of {limit} exceeded')
+        self.kind = kind
+        self.limit = limit
+
+
+class Budget:
+    def __init__(self, seconds, rows):
+        self.seconds = seconds
+        self.rows = rows
+        self.deadline = None
+
+
+def _current():
+    return g.get('query_budget') if has_app_context() else None
+
+
+def _is_timeout(error):
+    orig = getattr(error, 'orig', None)
+    if getattr(orig, 'pgcode', None) == POSTGRES_TIMEOUT_CODE:
+        return True
+    args = getattr(orig, 'args', ())
+    if args and args[0] in MYSQL_TIMEOUT_ERRORS:
+        return True
+    return type(orig).__module__.startswith('sqlite3') and 'interrupted' in str(orig)
+
+
+def _too_expensive(error):
+    print(f"[query_budget] {request.endpoint} exceeded its {error.kind} budget ({error.limit}); "
+          f"args={request.args.to_dict()}")
+    response = jsonify({
+        'error': 'Query too expensive; narrow the date range or filters',
+        'code': 'query_budget_exceeded',
+        'exceeded': error.kind,
+        'limit': error.limit
+    })
+    return response, 422
+
+
+def budget(seconds=None, rows=None):
+    """Decorator: run a view under a statement timeout and row limit (defaults from the environment)"""
+    def decorate(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not _slots.acquire(timeout=SLOT_WAIT_SECONDS):
+                response = jsonify({'error': 'Too many expensive queries running, retry shortly'})
+                response.headers['Retry-After'] = str(max(1, int(seconds or DEFAULT_SECONDS)))
+                return response, 503
+            g.query_budget = Budget(seconds or DEFAULT_SECONDS, rows or DEFAULT_ROWS)
+            g.query_budget.deadline = time.monotonic() + g.query_budget.seconds
+            try:
+                return view(*args, **kwargs)
+            except BudgetExceeded as e:
+                db.session.rollback()
+                return _too_expensive(e)
+            except DBAPIError as e:
+                if not _is_timeout(e):
+                    raise
+                db.session.rollback()
+                return _too_expensive(BudgetExceeded('time', g.query_budget.seconds))
+            finally:
+                g.pop('query_budget', None)
+                _slots.release()
+        return wrapper
+    return decorate
+
+
+def fetch_all(query):
+    """query.all(), refusing results larger than the request's row budget"""
+    current = _current()
+    if current is None or not current.rows:
+        return query.all()
+    rows = query.limit(current.rows + 1).all()
+    if len(rows) > current.rows:
+        raise BudgetExceeded('rows', current.rows)
+    return rows
+
+
+def _expired():
+    current = _current()
+    return 1 if current is not None and current.deadline and time.monotonic() > current.deadline else 0
+
+
+def _apply_timeout(dbapi_connection, dialect, milliseconds):
+    if dialect == 'sqlite':
+        dbapi_connection.set_progress_handler(_expired, SQLITE_CHECK_EVERY)
+        return
+    cursor = dbapi_connection.cursor()
+    if dialect == 'postgresql':
+        cursor.execute(f'SET statement_timeout = {milliseconds}')
+    elif dialect == 'mysql':
+        cursor.execute(f'SET SESSION max_execution_time = {milliseconds}')
+    cursor.close()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    current = _current()
+    if current is None:
+        return
+    remaining = current.deadline - time.monotonic()
+    if remaining <= 0:
+        raise BudgetExceeded('time', current.seconds)
+    # Applied per connection, not per transaction: the request may already
+    # hold an open transaction (e.g. from the auth lookup) when the view starts
+    dialect = conn.dialect.name
+    milliseconds = max(1, int(remaining * 1000))
+    info = conn.connection.info
+    if dialect in ('postgresql', 'mysql', 'sqlite') and info.get('query_budget') != (dialect, milliseconds):
+        info['query_budget'] = (dialect, milliseconds)
+        _apply_timeout(conn.connection.dbapi_connection, dialect, milliseconds)
+
+
+@event.listens_for(Pool, 'checkin')
+def _reset_connection(dbapi_connection, connection_record):
+    # Pooled connections outlive the request; clear what _apply_timeout set
+    applied = connection_record.info.pop('query_budget', None) if connection_record else None
+    if applied is None:
+        return
+    dialect = applied[0]
+    if dialect == 'sqlite':
+        dbapi_connection.set_progress_handler(None, 0)
+        return
+    cursor = dbapi_connection.cursor()
+    if dialect == 'postgresql':
+        cursor.execute('RESET statement_timeout')
+    elif dialect == 'mysql':
+        cursor.execute('SET SESSION max_execution_time = 0')
+    cursor.close()
@@ -0,0 +1,181 @@
+"""Fast JSON for list endpoints.
+
+List endpoints used to hydrate ORM objects, call ``to_dict()`` per row and
+re-encode the result with the stdlib encoder. Here they select only the
+needed columns as plain tuples and turn each tuple into a dict with a row
+encoder compiled once per model. The encoder is generated Python source, so
+there are no per-field lookups or branches beyond the conversions
+themselves. The result is encoded to bytes with orjson when it is installed,
+else with the stdlib json module.
+
+Encoders mirror the models' ``to_dict()`` output exactly, including
+``float(x) if x else None`` turning zero into null, so clients see no
+difference.
+"""
+
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import Response
+
+try:
+    import orjson
+except ImportError:  # optional; stdlib json is used instead
+    orjson = None
+
+# Converters: source templates where {v} is the column value
+RAW = None
+FLOAT = 'float({v})'
+OPT_FLOAT = '(float({v}) if {v} else None)'
+ISO = '({v}.isoformat() if {v} else None)'
+POINT_DETAIL = "({v} or 'full')"
+
+
+class RowEncoder:
+    """Turns column tuples into dicts shaped like a model's to_dict().
+
+    ``spec`` maps output keys to ``attribute`` or ``(attribute, converter)``,
+    or to a nested spec dict for nested objects.
+    """
+
+    def __init__(self, spec, name='row'):
+        self.attributes = []
+        body = self._compile(spec)
+        source = f'def encode_{name}(row):\n    return {body}\n'
+        namespace = {}
+        exec(compile(source, f'<encoder {name}>', 'exec'), namespace)
+        self.encode = namespace[f'encode_{name}']
+        self.source = source
+
+    def _compile(self, spec):
+        items = []
+        for key, field in spec.items():
+            if isinstance(field, dict):
+                items.append(f'{key!r}: {self._compile(field)}')
+                continue
+            attribute, converter = field if isinstance(field, tuple) else (field, RAW)
+            index = len(self.attributes)
+            self.attributes.append(attribute)
+            value = f'row[{index}]'
+            if converter is not None:
+                value = converter.format(v=value)
+            items.append(f'{key!r}: {value}')
+        return '{' + ', '.join(items) + '}'
+
+    def columns(self, entity):
+        """The columns to select from a model (or an alias of it), in encoder order"""
+        return [getattr(entity, attribute) for attribute in self.attributes]
+
+    def encode_all(self, rows):
+        encode = self.encode
+        return [encode(row) for row in rows]
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def dumps(payload):
+    """JSON bytes for a payload"""
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, default=_default, separators=(',', ':')).encode()
+
+
+def json_response(payload, status=200):
+    """A JSON response encoded with the fast backend"""
+    return Response(dumps(payload), status=status, mimetype='application/json')
+
+
+TRIP = RowEncoder({
+    'id': 'id',
+    'user_id': 'user_id',
+    'start_time': ('start_time', ISO),
+    'end_time': ('end_time', ISO),
+    'start_location': {
+        'lat': ('start_lat', OPT_FLOAT),
+        'lng': ('start_lng', OPT_FLOAT),
+        'address': 'start_address'
+    },
+    'end_location': {
+        'lat': ('end_lat', OPT_FLOAT),
+        'lng': ('end_lng', OPT_FLOAT),
+        'address': 'end_address',
+        'place_id': 'place_id'
+    },
+    'distance_km': ('distance_km', OPT_FLOAT),
+    'duration_minutes': 'duration_minutes',
+    'mode': 'mode',
+    'mode_confidence': ('mode_confidence', OPT_FLOAT),
+    'co2_kg': ('co2_kg', OPT_FLOAT),
+    'cost_usd': ('cost_usd', OPT_FLOAT),
+    'is_manual': 'is_manual',
+    'notes': 'notes',
+    'point_detail': ('point_detail', POINT_DETAIL),
+    'created_at': ('created_at', ISO),
+    'updated_at': ('updated_at', ISO)
+}, name='trip')
+
+TRIP_POINT = RowEncoder({
+    'id': 'id',
+    'trip_id': 'trip_id',
+    'latitude': ('latitude', FLOAT),
+    'longitude': ('longitude', FLOAT),
+    'altitude': ('altitude', OPT_FLOAT),
+    'accuracy': ('accuracy', OPT_FLOAT),
+    'speed': ('speed', OPT_FLOAT),
+    'heading': ('heading', OPT_FLOAT),
+    'timestamp': ('timestamp', ISO)
+}, name='trip_point')
+
+MANUAL_TRIP = RowEncoder({
+    'id': 'id',
+    'user_id': 'user_id',
+    'start_time': ('start_time', ISO),
+    'end_time': ('end_time', ISO),
+    'start_address': 'start_address',
+    'end_address': 'end_address',
+    'distance_km': ('distance_km', OPT_FLOAT),
+    'duration_minutes': 'duration_minutes',
+    'mode': 'mode',
+    'co2_kg': ('co2_kg', OPT_FLOAT),
+    'cost_usd': ('cost_usd', OPT_FLOAT),
+    'notes': 'notes'
+}, name='manual_trip')
+
+USER = RowEncoder({
+    'id': 'id',
+    'username': 'username',
+    'email': 'email',
+    'first_name': 'first_name',
+    'last_name': 'last_name',
+    'phone': 'phone',
+    'is_active': 'is_active',
+    'deleting': ('deleted_at', '({v} is not None)'),
+    'created_at': ('created_at', ISO),
+    'updated_at': ('updated_at', ISO)
+}, name='user')
+
+ML_PREDICTION = RowEncoder({
+    'id': 'id',
+    'start_time': ('start_time', ISO),
+    'end_time': ('end_time', ISO),
+    'date': ('date', ISO),
+    'start_hour': 'start_hour',
+    'mode': 'mode',
+    'place_id': 'place_id',
+    'dest_lat_approx': 'dest_lat_approx',
+    'dest_lon_approx': 'dest_lon_approx',
+    'peak_by_mode_visit': 'peak_by_mode_visit',
+    'uniq_users': 'uniq_users',
+    'avg_starthour': 'avg_starthour',
+    'dow': 'dow',
+    'rank_value': 'rank_value',
+    'source_area': 'source_area',
+    'created_at': ('created_at', ISO)
+}, name='ml_prediction')
@@ -0,0 +1,165 @@
+"""Moving users between shards (see services/sharding.py) and rebalancing.
+
+``move_user`` moves one user's rows in three steps:
+
+1. ``user_shards.moving_to`` is set. After one map cache period
+   (SHARD_MAP_CACHE_SECONDS) every process has seen it. From then on,
+   writes for the user get 503, and their jobs and buffered points wait.
+   Reads still use the source.
+2. The rows are copied to the target, SHARD_MOVE_BATCH trips and their
+   points per transaction. Trips, places and manual trips keep their ids;
+   points get new ids on the target.
+3. The map is switched to the target. After another cache period no
+   process reads the source any more, and the source rows are deleted in
+   batches.
+
+A move that stopped part way can simply be run again; whatever an earlier
+attempt left on the target is cleared first.
+
+``plan_rebalance`` picks the moves that even out trip counts across the
+open shards.
+"""
+
+import os
+import time
+
+from sqlalchemy import func, insert, select
+
+from extensions import db
+from models.trip import Trip
+from models.trip_point import TripPoint
+from models.user_shard import UserShard
+from services import deletion, sharding
+from services.point_store import point_store
+from services.sharding import shards
+
+BATCH = int(os.getenv('SHARD_MOVE_BATCH', '200'))
+
+# Small per-user tables copied in one go; places first, trips.place_id refers to them
+BEFORE_TRIPS = ('places',)
+AFTER_TRIPS = ('manual_trip', 'user_live_state', 'user_travel_profiles')
+
+POINT_FIELDS = ('trip_id', 'latitude', 'longitude', 'altitude', 'accuracy', 'speed', 'heading', 'timestamp')
+
+
+def _copy_table(name, user_id, source, target):
+    table = db.metadata.tables[name]
+    with sharding.on_shard(source):
+        rows = [dict(row._mapping) for row in db.session.execute(select(table).where(table.c.user_id == user_id))]
+    if rows:
+        with sharding.on_shard(target):
+            db.session.execute(insert(table), rows)
+    db.session.commit()
+    return len(rows)
+
+
+def _copy_trips(user_id, source, target, report):
+    trips = Trip.__table__
+    last_id = 0
+    while True:
+        with sharding.on_shard(source):
+            rows = [dict(row._mapping) for row in db.session.execute(
+                select(trips).where(trips.c.user_id == user_id, trips.c.id > last_id).order_by(trips.c.id).limit(BATCH)
+            )]
+            if not rows:
+                return
+            points = point_store.source()
+            point_rows = db.session.query(*[getattr(points, name) for name in POINT_FIELDS]).filter(
+                points.trip_id.in_([row['id'] for row in rows])
+            ).all()
+        last_id = rows[-1]['id']
+        with sharding.on_shard(target):
+            db.session.execute(insert(trips), rows)
+            stored = point_store.add_many(
+                [TripPoint(**{name: getattr(row, name) for name in POINT_FIELDS}) for row in point_rows]
+            )
+            db.session.commit()
+        report['trips'] += len(rows)
+        report['points'] += len(stored)
+        print(f"[shards] user {user_id}: {report['trips']} trips, {report['points']} points copied")
+
+
+def move_user(user_id, target, wait=None):
+    """Move a user's rows to another shard; returns what was copied"""
+    wait = sharding.MAP_CACHE_SECONDS if wait is None else wait
+    if target not in shards.names:
+        raise ValueError(f"unknown shard {target!r}; shards are {', '.join(shards.names)}")
+    shards.forget(user_id)
+    source = shards.shard_for(user_id)
+    report = {'user_id': user_id, 'from': source, 'to': target, 'trips': 0, 'points': 0}
+    if source == target:
+        return report
+    started = time.time()
+
+    entry = db.session.get(UserShard, user_id)
+    if entry is None:
+        entry = UserShard(user_id=user_id, shard=source)
+        db.session.add(entry)
+    entry.moving_to = target
+    shards.copy_user(user_id, target)
+    db.session.commit()
+    time.sleep(wait)
+
+    with sharding.on_shard(target):
+        deletion.purge_rows(user_id)
+        db.session.commit()
+    for name in BEFORE_TRIPS:
+        _copy_table(name, user_id, source, target)
+    _copy_trips(user_id, source, target, report)
+    for name in AFTER_TRIPS:
+        _copy_table(name, user_id, source, target)
+
+    entry = db.session.get(UserShard, user_id)
+    entry.shard, entry.moving_to = target, None
+    db.session.commit()
+    shards.forget(user_id)
+    time.sleep(wait)
+
+    with sharding.on_shard(source):
+        deletion.purge_rows(user_id)
+        shards.drop_user_copy(user_id, source)
+        db.session.commit()
+    report['seconds'] = round(time.time() - started, 1)
+    print(f"[shards] moved user {user_id} from {source} to {target}: {report['trips']} trips, "
+          f"{report['points']} points in {report['seconds']}s")
+    return report
+
+
+def shard_sizes():
+    """{shard: {'users', 'trips', 'points'}}"""
+    users = shards.users_per_shard()
+    sizes = {}
+    for name in sharding.each_shard():
+        sizes[name] = {
+            'users': users.get(name, 0),
+            'trips': db.session.query(func.count(Trip.id)).scalar(),
+            'points': point_store.count()
+        }
+    return sizes
+
+
+def plan_rebalance(max_moves=10):
+    """Moves ({'user_id', 'from', 'to', 'trips'}) that bring the open shards' trip counts closer together"""
+    trips_by_user, loads = {}, {}
+    for name in sharding.each_shard():
+        rows = db.session.query(Trip.user_id, func.count(Trip.id)).group_by(Trip.user_id).all()
+        # Rows a half-finished move left behind belong to another shard
+        trips_by_user[name] = {user_id: count for user_id, count in rows if shards.shard_for(user_id) == name}
+        loads[name] = sum(trips_by_user[name].values())
+
+    targets = shards.open_shards()
+    moves = []
+    while len(moves) < max_moves:
+        source = max(loads, key=loads.get)
+        target = min(targets, key=loads.get)
+        gap = loads[source] - loads[target]
+        # Any user with fewer trips than the gap narrows it; the largest narrows it most
+        fits = [(count, user_id) for user_id, count in trips_by_user[source].items() if 0 < count < gap]
+        if not fits:
+            break
+        count, user_id = max(fits)
+        moves.append({'user_id': user_id, 'from': source, 'to': target, 'trips': count})
+        trips_by_user[target][user_id] = trips_by_user[source].pop(user_id)
+        loads[source] -= count
+        loads[target] += count
+    return moves
@@ -0,0 +1,367 @@
+"""User-keyed horizontal sharding.
+
+DATABASE_SHARD_URLS (comma separated) adds shard databases. They are
+registered as binds named ``shard_<n>``, and the primary database is the
+shard named ``primary``. Every shard has the full schema
+(``tools/shards.py migrate``).
+
+Tables that are not about a single user live on the primary only. These
+are GLOBAL_TABLES: users, name tokens, jobs, ML predictions and the shard
+map. Every other table holds per-user rows, stored on the user's shard.
+Each shard also keeps a copy of the ``users`` rows it serves so that
+foreign keys hold there.
+
+The shard map is the ``user_shards`` table on the primary. A user without
+a row is on the primary, so turning sharding on moves nothing. New users
+are placed on the open shard (SHARDS_OPEN, default all) with the fewest
+users. Lookups are cached for SHARD_MAP_CACHE_SECONDS.
+
+ShardedSession sends statements on per-user tables to the current shard.
+The current shard is set:
+
+* per request, from the user the request is about: ``user_id`` in the
+  URL, query or body; else the token holder; else the owner of the trip
+  in the URL;
+* per job, from the ``user_id`` in the payload;
+* explicitly, with ``on_shard()`` or ``for_user()``. Fleet-wide reads go
+  through ``each_shard()``, ``gather()`` or ``per_shard()``.
+
+With no current shard, per-user tables are read on the primary.
+
+Trips, places and manual trips take their ids from one allocator on the
+primary (``id_blocks``, ID_BLOCK ids at a time per process). Their ids are
+therefore unique across shards, and they keep them when a user moves (see
+services/shard_moves.py). While a move copies a user's rows, requests that
+write for that user get 503 with Retry-After, and their jobs wait.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_app_context, jsonify, request
+from sqlalchemy import event, func, insert, inspect, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql.selectable import Join
+
+from services.db_routing import RoutingSession, SAFE_METHODS, request_user_id
+
+BIND_PREFIX = 'shard_'
+PRIMARY = 'primary'
+
+GLOBAL_TABLES = frozenset((
+    'users', 'user_name_tokens', 'jobs', 'ml_predictions', 'user_shards', 'id_blocks', 'alembic_version'
+))
+# Blueprints whose URLs name a row by id ({'blueprint': (table, view arg)}); its owner picks the shard
+OWNED_BY_URL = {'trips': ('trips', 'trip_id'), 'manual_trip': ('manual_trip', 'trip_id')}
+
+MAP_CACHE_SECONDS = float(os.getenv('SHARD_MAP_CACHE_SECONDS', '5'))
+ID_BLOCK = int(os.getenv('SHARD_ID_BLOCK', '100'))
+OPEN_SHARDS = [name.strip() for name in os.getenv('SHARDS_OPEN', '').split(',') if name.strip()]
+MOVING_RETRY_SECONDS = 30
+
+MAX_CACHED = 100000
+
+
+def shard_binds(urls):
+    """SQLALCHEMY_BINDS entries for a list of shard URLs"""
+    return {f'{BIND_PREFIX}{i + 1}': url for i, url in enumerate(urls)}
+
+
+class ShardMoving(Exception):
+    """The user's rows are being copied to another shard; retry the write later"""
+
+    def __init__(self, user_id):
+        super().__init__(f'user {user_id} is moving to another shard')
+        self.user_id = user_id
+
+
+def _table_name(mapper, clause):
+    if mapper is not None:
+        return mapper.local_table.name
+    table = getattr(clause, 'table', None)  # INSERT, UPDATE, DELETE
+    if table is None and hasattr(clause, 'get_final_froms'):
+        froms = clause.get_final_froms()
+        table = froms[0] if froms else None
+    while isinstance(table, Join):
+        table = table.left
+    return getattr(table, 'name', None)
+
+
+def current():
+    """Name of the shard per-user tables are routed to in this context"""
+    return (g.get('db_shard') if has_app_context() else None) or PRIMARY
+
+
+class ShardSet:
+    """The shard map, its cache and the cross-shard id allocator"""
+
+    def __init__(self):
+        self.db = None
+        self.names = [PRIMARY]
+        self._lock = threading.Lock()
+        self._map = {}
+        self._owners = {}
+        self._blocks = {}
+
+    @property
+    def enabled(self):
+        return len(self.names) > 1
+
+    def configure(self, db, keys):
+        self.db = db
+        self.names = [PRIMARY] + list(keys)
+
+    def engine(self, name=None):
+        name = name or current()
+        return self.db.engine if name == PRIMARY else self.db.engines[name]
+
+    def open_shards(self):
+        return [name for name in self.names if not OPEN_SHARDS or name in OPEN_SHARDS]
+
+    # -- shard map -----------------------------------------------------------
+
+    def _remember(self, cache, key, value):
+        with self._lock:
+            if len(cache) >= MAX_CACHED:
+                cache.clear()
+            cache[key] = value
+
+    def lookup(self, user_id):
+        """(shard, moving_to) of a user"""
+        if not self.enabled:
+            return PRIMARY, None
+        now = time.time()
+        cached = self._map.get(user_id)
+        if cached and cached[0] > now:
+            return cached[1]
+        from models.user_shard import UserShard
+        row = self.db.session.execute(
+            select(UserShard.shard, UserShard.moving_to).where(UserShard.user_id == user_id)
+        ).first()
+        found = (row.shard, row.moving_to) if row else (PRIMARY, None)
+        self._remember(self._map, user_id, (now + MAP_CACHE_SECONDS, found))
+        return found
+
+    def shard_for(self, user_id):
+        return self.lookup(user_id)[0]
+
+    def forget(self, user_id):
+        """Drop the cached map entry of a user (this process only)"""
+        with self._lock:
+            self._map.pop(user_id, None)
+
+    def users_per_shard(self):
+        """{shard: number of users}, counting unmapped users on the primary"""
+        from models.user import User
+        from models.user_shard import UserShard
+        counts = dict.fromkeys(self.names, 0)
+        counts.update(self.db.session.execute(
+            select(UserShard.shard, func.count()).group_by(UserShard.shard)
+        ).all())
+        counts[PRIMARY] += self.db.session.execute(
+            select(func.count(User.id)).where(User.id.not_in(select(UserShard.user_id)))
+        ).scalar() or 0
+        return counts
+
+    def assign(self, user):
+        """Place a new user on the open shard with the fewest users (the caller commits)"""
+        if not self.enabled:
+            return PRIMARY
+        from models.user_shard import UserShard
+        self.db.session.flush()
+        counts = self.users_per_shard()
+        name = min(self.open_shards(), key=lambda shard: (counts.get(shard, 0), self.names.index(shard)))
+        self.db.session.add(UserShard(user_id=user.id, shard=name))
+        if name != PRIMARY:
+            self.copy_user(user.id, name)
+        self._remember(self._map, user.id, (time.time() + MAP_CACHE_SECONDS, (name, None)))
+        return name
+
+    def copy_user(self, user_id, name):
+        """Insert the user's row on a shard unless it is there already (the caller commits)"""
+        from models.user import User
+        users = User.__table__
+        target = {'bind': self.engine(name)}
+        if self.db.session.execute(select(users.c.id).where(users.c.id == user_id),
+                                   bind_arguments=target).first():
+            return
+        user = self.db.session.get(User, user_id)
+        values = {attr.columns[0].name: getattr(user, attr.key) for attr in inspect(User).column_attrs}
+        self.db.session.execute(insert(users), values, bind_arguments=target)
+
+    def drop_user_copy(self, user_id, name):
+        """Delete the user's row on a shard other than the primary (the caller commits)"""
+        from models.user import User
+        if name != PRIMARY:
+            self.db.session.execute(User.__table__.delete().where(User.__table__.c.id == user_id),
+                                    bind_arguments={'bind': self.engine(name)})
+
+    def forget_user(self, user_id):
+        """Remove a purged user's map row and shard copy (the caller commits)"""
+        from models.user_shard import UserShard
+        self.drop_user_copy(user_id, self.shard_for(user_id))
+        self.db.session.execute(UserShard.__table__.delete().where(UserShard.user_id == user_id))
+        self.forget(user_id)
+
+    def owner(self, table_name, row_id):
+        """user_id of the row with an id in a per-user table, searched on every shard"""
+        key = (table_name, row_id)
+        if key in self._owners:
+            return self._owners[key]
+        table = self.db.metadata.tables[table_name]
+        for name in self.names:
+            user_id = self.db.session.execute(select(table.c.user_id).where(table.c.id == row_id),
+                                              bind_arguments={'bind': self.engine(name)}).scalar()
+            if user_id is not None:
+                # Rows never change owner, so this can be kept for good
+                self._remember(self._owners, key, user_id)
+                return user_id
+        return None
+
+    # -- ids -----------------------------------------------------------------
+
+    def next_id(self, table_name):
+        with self._lock:
+            block = self._blocks.get(table_name)
+            if block is None or block[0] >= block[1]:
+                block = self._blocks[table_name] = self._reserve(table_name)
+            value = block[0]
+            block[0] += 1
+            return value
+
+    def _reserve(self, table_name):
+        """Take the next ID_BLOCK ids of a table from id_blocks, seeding it from every shard's maximum"""
+        from models.id_block import IdBlock
+        blocks = IdBlock.__table__
+        # Its own transaction, so ids handed out stay taken whatever the caller does
+        for _ in range(2):
+            with self.db.engine.begin() as conn:
+                taken = conn.execute(update(blocks).where(blocks.c.name == table_name).values(
+                    next_id=blocks.c.next_id + ID_BLOCK)).rowcount
+                if taken:
+                    end = conn.execute(select(blocks.c.next_id).where(blocks.c.name == table_name)).scalar()
+                    return [end - ID_BLOCK, end]
+            start = self._max_id(table_name) + 1
+            try:
+                with self.db.engine.begin() as conn:
+                    conn.execute(insert(blocks).values(name=table_name, next_id=start))
+            except IntegrityError:
+                pass  # another process seeded it first
+        raise RuntimeError(f'could not reserve ids for {table_name}')
+
+    def _max_id(self, table_name):
+        table = self.db.metadata.tables[table_name]
+        highest = 0
+        for name in self.names:
+            with self.engine(name).connect() as conn:
+                highest = max(highest, conn.execute(select(func.max(table.c.id))).scalar() or 0)
+        return highest
+
+
+shards = ShardSet()
+
+
+class ShardedSession(RoutingSession):
+    """RoutingSession that sends statements on per-user tables to the current shard"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and shards.enabled and has_app_context():
+            name = g.get('db_shard')
+            if name is not None and name != PRIMARY and _table_name(mapper, clause) not in GLOBAL_TABLES:
+                return self._db.engines[name]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+# -- context ------------------------------------------------------------------
+
+@contextmanager
+def on_shard(name):
+    """Route per-user tables to a shard inside the block"""
+    previous = g.get('db_shard')
+    g.db_shard = name
+    try:
+        yield name
+    finally:
+        g.db_shard = previous
+
+
+@contextmanager
+def for_user(user_id, writing=False):
+    """Route per-user tables to a user's shard; ShardMoving when writing during a move"""
+    if user_id is None or not shards.enabled:
+        yield None
+        return
+    name, moving_to = shards.lookup(int(user_id))
+    if writing and moving_to is not None:
+        raise ShardMoving(user_id)
+    with on_shard(name):
+        yield name
+
+
+def each_shard():
+    """Iterate over the shard names with each one current in turn"""
+    for name in shards.names:
+        with on_shard(name):
+            yield name
+
+
+def gather(fn):
+    """fn() run on every shard, as a list"""
+    return [fn() for _ in each_shard()]
+
+
+def per_shard(fn):
+    """fn() when there is one database, else {shard: fn()} over every shard"""
+    if not shards.enabled:
+        return fn()
+    return {name: fn() for name in each_shard()}
+
+
+# -- wiring -------------------------------------------------------------------
+
+def _assign_id(mapper, connection, target):
+    if target.id is None:
+        target.id = shards.next_id(mapper.local_table.name)
+
+
+def _request_owner():
+    user_id = request_user_id() or g.get('auth_user_id')
+    if user_id is None and request.blueprint in OWNED_BY_URL:
+        table_name, arg = OWNED_BY_URL[request.blueprint]
+        row_id = (request.view_args or {}).get(arg)
+        if row_id is not None:
+            user_id = shards.owner(table_name, row_id)
+    return user_id
+
+
+def init_app(app, db):
+    keys = sorted(key for key in (app.config.get('SQLALCHEMY_BINDS') or {}) if key.startswith(BIND_PREFIX))
+    shards.configure(db, keys)
+    if not keys:
+        return
+    print(f"[sharding] routing per-user data across {len(shards.names)} shards")
+
+    from models.manual_trip import ManualTrip
+    from models.place import Place
+    from models.trip import Trip
+    # Ids of these must not depend on the shard a row is on
+    for model in (Trip, Place, ManualTrip):
+        event.listen(model, 'before_insert', _assign_id)
+
+    @app.before_request
+    def _route_shard():
+        g.db_shard = None
+        if request.method == 'OPTIONS':
+            return None
+        user_id = _request_owner()
+        if user_id is None:
+            return None
+        name, moving_to = shards.lookup(user_id)
+        g.db_shard = name
+        if moving_to is not None and request.method not in SAFE_METHODS:
+            response = jsonify({'error': "This user's data is being moved, retry shortly"})
+            response.headers['Retry-After'] = str(MOVING_RETRY_SECONDS)
+            return response, 503
+        return None
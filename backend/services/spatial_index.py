@@ -0,0 +1,156 @@
+"""In-memory grid over recently touched trip endpoints.
+
+The database cell index answers arbitrary history; this grid keeps the hot
+tail (trips created or updated in the last HOT_WINDOW seconds) in memory so
+"what started or ended near here recently" queries are answered without a
+spatial scan.
+
+Every process has its own grid, so before it answers, ``sync()`` folds in
+what any process committed since the last sync. That is one range scan on
+the trips.updated_at index per shard. The scan starts SYNC_OVERLAP seconds
+before the newest updated_at already seen, which picks up transactions that
+committed late with an earlier timestamp. A trip deleted by another process
+stays in the grid until it expires, but the route loads the matched trips
+from the database and drops the missing ones.
+"""
+
+import calendar
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from extensions import db
+from models.trip import Trip
+from services import geo, sharding
+
+# Grid buckets are ~1.2 km (level 15) so a radius query touches a few cells
+GRID_LEVEL = 15
+
+HOT_WINDOW = int(os.getenv('SPATIAL_HOT_WINDOW_SECONDS', '3600'))
+MAX_ENTRIES = int(os.getenv('SPATIAL_HOT_MAX_ENTRIES', '200000'))
+SYNC_OVERLAP = float(os.getenv('SPATIAL_HOT_SYNC_OVERLAP_SECONDS', '30'))
+
+
+def _epoch(moment):
+    """Seconds since the epoch for a naive UTC datetime"""
+    return calendar.timegm(moment.utctimetuple()) + moment.microsecond / 1e6
+
+
+class EndpointGrid:
+    """Bucketed (trip_id, kind) -> (lat, lng, user_id, touched_at) entries"""
+
+    def __init__(self, window=HOT_WINDOW, max_entries=MAX_ENTRIES, overlap=SYNC_OVERLAP):
+        self.window = window
+        self.max_entries = max_entries
+        self.overlap = overlap
+        self._buckets = {}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._watermarks = {}  # shard -> newest trips.updated_at seen
+        # Entries touched after this are all present; None before the first sync
+        self._complete_since = None
+
+    def covers(self, since_seconds):
+        """True when the grid holds every endpoint touched in the window asked for"""
+        with self._lock:
+            complete_since = self._complete_since
+        return complete_since is not None and since_seconds <= self.window and \
+            time.time() - since_seconds > complete_since
+
+    def sync(self):
+        """Fold in the trips changed in the database since the last sync, on every shard"""
+        with self._sync_lock:
+            horizon = datetime.utcnow() - timedelta(seconds=self.window)
+            for name in sharding.each_shard():
+                seen = self._watermarks.get(name)
+                since = max(horizon, seen - timedelta(seconds=self.overlap)) if seen else horizon
+                rows = db.session.query(
+                    Trip.id, Trip.user_id, Trip.start_lat, Trip.start_lng, Trip.end_lat, Trip.end_lng, Trip.updated_at
+                ).filter(Trip.updated_at >= since).order_by(Trip.updated_at).all()
+                for trip_id, user_id, start_lat, start_lng, end_lat, end_lng, updated_at in rows:
+                    touched = _epoch(updated_at)
+                    self.add(trip_id, 'start', start_lat, start_lng, user_id, touched)
+                    self.add(trip_id, 'end', end_lat, end_lng, user_id, touched)
+                if rows:
+                    self._watermarks[name] = max(rows[-1][-1], seen or rows[-1][-1])
+            with self._lock:
+                if self._complete_since is None:
+                    self._complete_since = _epoch(horizon)
+
+    def add(self, trip_id, kind, lat, lng, user_id, touched=None):
+        key = (trip_id, kind)
+        with self._lock:
+            if lat is None or lng is None:
+                self._discard(key)
+                return
+            current = self._entries.get(key)
+            if touched is not None and current is not None and current[4] >= touched:
+                return  # already have this or a newer version
+            lat, lng = float(lat), float(lng)
+            bucket = geo.cell_id(lat, lng, GRID_LEVEL)
+            self._discard(key)
+            self._entries[key] = (bucket, lat, lng, user_id, touched if touched is not None else time.time())
+            self._buckets.setdefault(bucket, set()).add(key)
+            self._expire()
+
+    def remove_trip(self, trip_id):
+        with self._lock:
+            for kind in ('start', 'end'):
+                self._discard((trip_id, kind))
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        members = self._buckets.get(entry[0])
+        if members is not None:
+            members.discard(key)
+            if not members:
+                del self._buckets[entry[0]]
+
+    def _expire(self):
+        cutoff = time.time() - self.window
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry[4] >= cutoff and len(self._entries) <= self.max_entries:
+                break
+            if entry[4] >= cutoff and self._complete_since is not None:
+                # Dropped for room: the grid no longer holds everything after this
+                self._complete_since = max(self._complete_since, entry[4])
+            self._discard(key)
+
+    def nearby(self, lat, lng, radius_m, since_seconds, kinds=('start', 'end'), user_id=None):
+        """Entries within radius_m touched in the last since_seconds, nearest first"""
+        min_lat, min_lng, max_lat, max_lng = geo.radius_bbox(lat, lng, radius_m)
+        x0, y0 = geo.quantize(min_lat, min_lng, GRID_LEVEL)
+        x1, y1 = geo.quantize(max_lat, max_lng, GRID_LEVEL)
+        cutoff = time.time() - since_seconds
+
+        results = []
+        with self._lock:
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    for key in self._buckets.get(geo.interleave(x, y), ()):
+                        _, p_lat, p_lng, p_user, touched = self._entries[key]
+                        if touched < cutoff or key[1] not in kinds:
+                            continue
+                        if user_id is not None and p_user != user_id:
+                            continue
+                        distance = geo.haversine_m(lat, lng, p_lat, p_lng)
+                        if distance <= radius_m:
+                            results.append((distance, key[0], key[1]))
+        results.sort()
+        return results
+
+
+endpoint_grid = EndpointGrid()
+
+
+def index_trip(trip):
+    """Record a trip's endpoints in this process's grid at once; other processes pick them up on sync"""
+    touched = _epoch(trip.updated_at) if trip.updated_at else None
+    endpoint_grid.add(trip.id, 'start', trip.start_lat, trip.start_lng, trip.user_id, touched)
+    endpoint_grid.add(trip.id, 'end', trip.end_lat, trip.end_lng, trip.user_id, touched)
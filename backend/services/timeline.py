@@ -0,0 +1,151 @@
+"""One timeline over automatic trips and manual entries.
+
+``entries()`` is the query layer: a UNION ALL of ``trips`` and
+``manual_trip`` under common column names plus a ``source`` column
+('trip' or 'manual'). Each caller's filters are built per table and pushed
+into both branches, so each side uses its own indexes. Analytics group and
+sum over the union in one statement.
+
+``page()`` serves the timeline API. Each source is read with its own
+keyset query on (user_id, start_time, id). ``heapq.merge`` interleaves the
+two result cursors lazily and stops after ``limit + 1`` entries. The
+cursor is the (start_time, source, id) key of the last entry, so a page
+costs the same at any depth.
+"""
+
+import base64
+import heapq
+import json
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy import and_, literal_column, null, or_, select, type_coerce, union_all
+
+from extensions import db
+from models.manual_trip import ManualTrip
+from models.trip import Trip
+from services import serialization
+
+SOURCES = {
+    'trip': (Trip, serialization.TRIP),
+    'manual': (ManualTrip, serialization.MANUAL_TRIP)
+}
+
+# Columns of the unified view; ones a table lacks read as NULL
+COLUMNS = (
+    'source', 'id', 'user_id', 'start_time', 'end_time',
+    'start_lat', 'start_lng', 'end_lat', 'end_lng', 'start_address', 'end_address',
+    'start_cell', 'end_cell', 'place_id',
+    'distance_km', 'duration_minutes', 'mode', 'co2_kg', 'cost_usd'
+)
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def entries(where=None, columns=COLUMNS, name='entries'):
+    """Trips and manual trips as one subquery.
+
+    ``where(table)`` returns the filter clauses for one source table and is
+    called once per branch.
+    """
+    branches = []
+    for source, (model, _) in SOURCES.items():
+        table = model.__table__
+        selected = []
+        for column in columns:
+            if column == 'source':
+                selected.append(literal_column(f"'{source}'").label('source'))
+            elif column in table.c:
+                selected.append(table.c[column])
+            else:
+                selected.append(type_coerce(null(), Trip.__table__.c[column].type).label(column))
+        branch = select(*selected)
+        if where is not None:
+            branch = branch.where(*where(table))
+        branches.append(branch)
+    return union_all(*branches).subquery(name)
+
+
+def range_filter(user_id=None, start=None, end=None, modes=None):
+    """where() for the usual user / start_time window / mode filters"""
+    def where(table):
+        clauses = []
+        if user_id is not None:
+            clauses.append(table.c.user_id == user_id)
+        if start is not None:
+            clauses.append(table.c.start_time >= start)
+        if end is not None:
+            clauses.append(table.c.start_time <= end)
+        if modes:
+            clauses.append(table.c.mode.in_(modes))
+        return clauses
+    return where
+
+
+def encode_cursor(start_time, source, entry_id):
+    raw = json.dumps([start_time.isoformat(), source, entry_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        start_time, source, entry_id = json.loads(raw)
+        if source not in SOURCES:
+            raise ValueError(source)
+        return datetime.fromisoformat(start_time), source, int(entry_id)
+    except (ValueError, TypeError):
+        raise InvalidCursor('Invalid cursor')
+
+
+def _after(table, source, after, descending):
+    """Keyset clause: rows of this source that sort after the cursor key"""
+    start_time, cursor_source, cursor_id = after
+    beyond = table.c.start_time < start_time if descending else table.c.start_time > start_time
+    if source == cursor_source:
+        next_id = table.c.id < cursor_id if descending else table.c.id > cursor_id
+        return or_(beyond, and_(table.c.start_time == start_time, next_id))
+    # Ties on start_time are ordered by source name, then id
+    if (source < cursor_source) == descending:
+        return or_(beyond, table.c.start_time == start_time)
+    return beyond
+
+
+def _stream(source, where, after, descending, limit):
+    """(key, row) pairs for one source, in timeline order"""
+    model, encoder = SOURCES[source]
+    table = model.__table__
+    clauses = where(table)
+    if after is not None:
+        clauses.append(_after(table, source, after, descending))
+    order = (table.c.start_time.desc(), table.c.id.desc()) if descending else \
+        (table.c.start_time.asc(), table.c.id.asc())
+    query = select(table.c.start_time, table.c.id, *encoder.columns(model)).where(*clauses).\
+        order_by(*order).limit(limit)
+    for start_time, entry_id, *row in db.session.execute(query):
+        yield (start_time, source, entry_id), row
+
+
+def page(user_id, limit=DEFAULT_LIMIT, cursor=None, order='desc', start=None, end=None, modes=None,
+         sources=None):
+    """One timeline page: {'entries', 'next_cursor', 'limit', 'order'}"""
+    descending = order != 'asc'
+    limit = max(1, min(limit, MAX_LIMIT))
+    after = decode_cursor(cursor) if cursor else None
+    where = range_filter(user_id, start, end, modes)
+
+    streams = [_stream(source, where, after, descending, limit + 1)
+               for source in SOURCES if not sources or source in sources]
+    merged = list(islice(heapq.merge(*streams, key=lambda item: item[0], reverse=descending), limit + 1))
+
+    results = []
+    for (_, source, _), row in merged[:limit]:
+        results.append({'source': source, **SOURCES[source][1].encode(row)})
+    next_cursor = encode_cursor(*merged[limit - 1][0]) if len(merged) > limit else None
+    return {'entries': results, 'next_cursor': next_cursor, 'limit': limit,
+            'order': 'desc' if descending else 'asc'}
@@ -0,0 +1,203 @@
+"""Incremental per-user travel pattern profiles.
+
+Each closed trip bumps a fixed number of counters on the user's profile
+row: its hour-of-week slot, its destination place, its mode and the
+(time-of-day slot, previous place) -> place transition. Predictions then
+read one row instead of re-scanning the user's trips. Manual trips count
+towards hours and modes; they have no clustered place.
+
+Transitions only make sense in start_time order, so only a trip that starts
+after everything counted so far is folded in directly. Anything else, such
+as a back-dated manual trip, a deleted trip, an edited mode or start time,
+or trips moved between places, queues a ``travel_profile_rebuild`` job that
+recounts the user's history. A user without a profile yet (one who signed
+up before profiles existed) gets one built from their history on the first
+read; ``backfill()`` queues those builds for everyone ahead of time.
+"""
+
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models.job import Job
+from models.user import User
+from models.user_travel_profile import UserTravelProfile
+from services import jobs, sharding, timeline
+
+REBUILD_PRIORITY = 5
+
+# Time-of-day slots used to condition place transitions
+DAY_SLOTS = (
+    (0, 6, 'night'),
+    (6, 10, 'morning'),
+    (10, 16, 'midday'),
+    (16, 20, 'evening'),
+    (20, 24, 'late')
+)
+
+
+def day_slot(hour):
+    for start, end, name in DAY_SLOTS:
+        if start <= hour < end:
+            return name
+    return DAY_SLOTS[-1][2]
+
+
+def _bump(counts, key, amount=1):
+    """Copy-and-increment so SQLAlchemy sees the JSON column change"""
+    counts = dict(counts)
+    counts[key] = counts.get(key, 0) + amount
+    return counts
+
+
+def _apply(profile, start_time, mode, place_id):
+    """Fold one trip into the profile counters"""
+    hour_of_week = list(profile.hour_of_week)
+    hour_of_week[start_time.weekday() * 24 + start_time.hour] += 1
+    profile.hour_of_week = hour_of_week
+    profile.modes = _bump(profile.modes, mode)
+    profile.trip_count = (profile.trip_count or 0) + 1
+
+    if place_id is not None:
+        key = str(place_id)
+        profile.destinations = _bump(profile.destinations, key)
+        if profile.last_place_id is not None:
+            transition = f'{day_slot(start_time.hour)}:{profile.last_place_id}'
+            transitions = dict(profile.transitions)
+            transitions[transition] = _bump(transitions.get(transition, {}), key)
+            profile.transitions = transitions
+        profile.last_place_id = place_id
+    profile.last_trip_at = start_time
+
+
+def rebuild_profile(user_id):
+    """Recompute a user's profile from their full trip history"""
+    profile = UserTravelProfile.query.get(user_id)
+    if profile is None:
+        try:
+            with db.session.begin_nested():
+                profile = UserTravelProfile(user_id)
+                db.session.add(profile)
+        except IntegrityError:
+            # A concurrent rebuild created the row first
+            profile = UserTravelProfile.query.get(user_id)
+    profile.reset()
+
+    def closed(table):
+        # Manual trips are complete when entered; recorded ones once they end
+        clauses = [table.c.user_id == user_id]
+        if table.name == 'trips':
+            clauses.append(table.c.end_time.isnot(None))
+        return clauses
+
+    trips = timeline.entries(closed, columns=('start_time', 'mode', 'place_id'))
+    rows = db.session.query(trips.c.start_time, trips.c.mode, trips.c.place_id).\
+        order_by(trips.c.start_time).yield_per(1000)
+    for start_time, mode, place_id in rows:
+        _apply(profile, start_time, mode, place_id)
+
+    db.session.commit()
+    return profile
+
+
+def get_profile(user_id):
+    """Single-row profile fetch, built from history when missing; None for unknown users"""
+    profile = UserTravelProfile.query.get(user_id)
+    if profile is not None:
+        return profile
+    user = db.session.get(User, user_id)
+    if user is None or user.deleted_at is not None:
+        return None
+    return rebuild_profile(user_id)
+
+
+def backfill(batch_size=1000):
+    """Queue a rebuild for every user without a profile; returns how many were queued"""
+    have = set()
+    for rows in sharding.gather(lambda: db.session.query(UserTravelProfile.user_id).all()):
+        have.update(user_id for user_id, in rows)
+
+    queued, last_id = 0, 0
+    while True:
+        user_ids = [user_id for user_id, in db.session.query(User.id).filter(
+            User.id > last_id, User.deleted_at.is_(None)
+        ).order_by(User.id).limit(batch_size)]
+        if not user_ids:
+            return queued
+        last_id = user_ids[-1]
+        for user_id in user_ids:
+            if user_id not in have:
+                schedule_rebuild(user_id)
+                queued += 1
+        db.session.commit()
+
+
+def schedule_rebuild(user_id):
+    """Queue a recount of the user's profile (the caller commits); returns the job.
+
+    A rebuild that is already running may have read the history before this
+    change, so only a queued one is reused.
+    """
+    queued = Job.query.filter_by(kind='travel_profile_rebuild', user_id=user_id, status='queued').first()
+    return queued or jobs.enqueue('travel_profile_rebuild', {'user_id': user_id}, priority=REBUILD_PRIORITY)
+
+
+@jobs.handler('travel_profile_rebuild')
+def _rebuild_job(payload, job):
+    user = db.session.get(User, payload['user_id'])
+    if user is None or user.deleted_at is not None:
+        return {'skipped': 'user deleted'}
+    return {'trip_count': rebuild_profile(user.id).trip_count}
+
+
+def record_trip(trip):
+    """O(1) update for a trip that just closed or a new manual trip; the lifecycle hook commits"""
+    profile = UserTravelProfile.query.get(trip.user_id)
+    if profile is None or (profile.last_trip_at is not None and trip.start_time < profile.last_trip_at):
+        # The transitions after this trip would change too
+        schedule_rebuild(trip.user_id)
+        return
+    _apply(profile, trip.start_time, trip.mode, getattr(trip, 'place_id', None))
+
+
+def predict_next(profile, places, at=None, from_place_id=None, limit=3):
+    """Most likely next destinations given the time and the current place"""
+    at = at or datetime.utcnow()
+    slot = day_slot(at.hour)
+    from_place_id = from_place_id if from_place_id is not None else profile.last_place_id
+
+    source = 'transitions'
+    counts = profile.transitions.get(f'{slot}:{from_place_id}', {}) if from_place_id is not None else {}
+    if not counts:
+        # Fall back to where the user goes from anywhere at this time of day
+        counts = {}
+        for key, targets in profile.transitions.items():
+            if key.split(':', 1)[0] == slot:
+                for place_id, count in targets.items():
+                    counts[place_id] = counts.get(place_id, 0) + count
+        source = 'time_of_day'
+    if not counts:
+        counts = profile.destinations
+        source = 'frequency'
+
+    total = sum(counts.values())
+    ranked = sorted(counts.items(), key=lambda item: item[1], reverse=True)[:limit]
+    predictions = []
+    for place_id, count in ranked:
+        place = places.get(int(place_id))
+        predictions.append({
+            'place_id': int(place_id),
+            'label': (place.label or f'{place.lat:.4f}, {place.lng:.4f}') if place else None,
+            'lat': place.lat if place else None,
+            'lng': place.lng if place else None,
+            'probability': round(count / total, 3) if total else 0.0
+        })
+
+    return {
+        'at': at.isoformat(),
+        'time_slot': slot,
+        'from_place_id': from_place_id,
+        'basis': source,
+        'predictions': predictions
+    }
@@ -0,0 +1,120 @@
+"""Hooks run as trips and their points change.
+
+Routes call these instead of poking each derived structure directly, so
+every index, aggregate and live view stays in step with the trips table.
+"""
+
+from extensions import db
+from services import geocoder, heatmap_tiles, live_state, travel_profile
+from services.events import publish_after_commit, region_topic
+from services.od_matrix import od_engine
+from services.place_clustering import assign_trip
+from services.spatial_index import endpoint_grid, index_trip
+
+
+def _publish(trip, event_type, data, lat=None, lng=None):
+    publish_after_commit(db.session, f'user:{trip.user_id}', event_type, data)
+    if lat is not None and lng is not None:
+        publish_after_commit(db.session, region_topic(lat, lng), event_type, data)
+
+
+def _float(value):
+    return float(value) if value is not None else None
+
+
+def trip_saved(trip, closed=False, created=False, recount=False):
+    """A trip was created or updated; closed is True when it just got an end_time.
+
+    recount is True when an edit changed what the travel profile counted
+    for an already closed trip: its start time or mode, or reopening it.
+    """
+    index_trip(trip)
+    live_state.record_trip(trip)
+    if not created:
+        # CO2 (and so the co2 heatmap weight of its points) can change on update
+        heatmap_tiles.trips_changed(db.session, trip.user_id)
+    if trip.end_time is not None:
+        place_id = trip.place_id
+        # Addresses first, so a new place is labelled from them
+        geocoder.fill_addresses(trip)
+        assign_trip(trip)
+        if closed:
+            travel_profile.record_trip(trip)
+        elif trip.place_id != place_id:
+            recount = True
+    if recount:
+        travel_profile.schedule_rebuild(trip.user_id)
+
+    if created:
+        publish_after_commit(db.session, 'dashboard', 'counters', {'total_trip_logs': 1})
+        _publish(trip, 'trip_started', {
+            'user_id': trip.user_id,
+            'trip_id': trip.id,
+            'mode': trip.mode,
+            'lat': _float(trip.start_lat),
+            'lng': _float(trip.start_lng),
+            'start_time': trip.start_time.isoformat()
+        }, trip.start_lat, trip.start_lng)
+    if closed:
+        _publish(trip, 'trip_closed', {
+            'user_id': trip.user_id,
+            'trip_id': trip.id,
+            'mode': trip.mode,
+            'lat': _float(trip.end_lat),
+            'lng': _float(trip.end_lng),
+            'place_id': trip.place_id,
+            'distance_km': _float(trip.distance_km),
+            'duration_minutes': trip.duration_minutes,
+            'end_time': trip.end_time.isoformat()
+        }, trip.end_lat, trip.end_lng)
+    db.session.commit()
+
+    if trip.end_time is not None:
+        od_engine.record_trip(trip)
+
+
+def point_added(trip, point):
+    """A GPS point was added to a trip (before the caller commits)"""
+    points_added(trip, [point])
+
+
+def points_added(trip, points):
+    """GPS points were stored for a trip in one batch (before the caller commits)"""
+    live_state.record_trip_point(trip, max(points, key=lambda point: point.timestamp))
+    heatmap_tiles.points_changed(db.session, trip.user_id, [(point.latitude, point.longitude) for point in points])
+    publish_after_commit(db.session, 'dashboard', 'counters', {'total_data_points': len(points)})
+    for point in points:
+        _publish(trip, 'point', {
+            'user_id': trip.user_id,
+            'trip_id': trip.id,
+            'lat': _float(point.latitude),
+            'lng': _float(point.longitude),
+            'speed': _float(point.speed),
+            'heading': _float(point.heading),
+            'timestamp': point.timestamp.isoformat() if point.timestamp else None
+        }, point.latitude, point.longitude)
+
+
+def manual_trip_saved(trip):
+    """A manual trip was entered; it counts in profiles and dashboard totals like a closed trip"""
+    travel_profile.record_trip(trip)
+    publish_after_commit(db.session, 'dashboard', 'counters', {'total_trip_logs': 1})
+    db.session.commit()
+
+
+def manual_trip_deleted(trip):
+    travel_profile.schedule_rebuild(trip.user_id)
+    publish_after_commit(db.session, 'dashboard', 'counters', {'total_trip_logs': -1})
+    db.session.commit()
+
+
+def trip_deleted(trip_id, user_id, points=0):
+    """A trip and its points (how many were deleted) are gone"""
+    endpoint_grid.remove_trip(trip_id)
+    od_engine.remove_trip(trip_id)
+    live_state.clear_trip(user_id, trip_id)
+    heatmap_tiles.trips_changed(db.session, user_id, deleted=True)
+    travel_profile.schedule_rebuild(user_id)
+    publish_after_commit(db.session, 'dashboard', 'counters', {'total_trip_logs': -1, 'total_data_points': -points})
+    publish_after_commit(db.session, f'user:{user_id}', 'trip_deleted', {'user_id': user_id, 'trip_id': trip_id})
+    db.session.commit()
@@ -0,0 +1,123 @@
+"""Lightweight user directory for dashboard dropdowns.
+
+Entries are just (id, display name). Prefix search goes through the
+user_name_tokens table, whose primary key index on token turns a prefix
+into a range scan, and results are keyset-paginated by user id.
+
+Pages are cached for CACHE_SECONDS. Every user create, update and delete
+bumps a version number that is part of the cache key, so this process
+never serves a stale page after a change; other workers see it once their
+TTL lapses.
+"""
+
+import os
+import re
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models.user import User
+from models.user_name_token import UserNameToken
+
+CACHE_SECONDS = float(os.getenv('USER_DIRECTORY_CACHE_SECONDS', '30'))
+MAX_CACHED_PAGES = 512
+TOKEN_LENGTH = 50
+
+_version = 0
+_cache = {}
+_lock = threading.Lock()
+
+_word = re.compile(r'[^\W_]+', re.UNICODE)
+
+
+def display_name(username, first_name, last_name):
+    full_name = ' '.join(part for part in (first_name, last_name) if part)
+    return username or full_name
+
+
+def name_tokens(user):
+    """Lower-cased username, first/last name and the words inside them"""
+    tokens = set()
+    for value in (user.username, user.first_name, user.last_name):
+        if not value:
+            continue
+        value = value.strip().lower()
+        tokens.add(value[:TOKEN_LENGTH])
+        tokens.update(word[:TOKEN_LENGTH] for word in _word.findall(value))
+    tokens.discard('')
+    return tokens
+
+
+def invalidate():
+    global _version
+    with _lock:
+        _version += 1
+        _cache.clear()
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    # Bumping before the commit could let a concurrent reader cache the old rows
+    if session.info.pop('user_directory_changed', False):
+        invalidate()
+
+
+def index_user(user):
+    """Refresh a user's search tokens (the caller commits)"""
+    if user.id is None:
+        db.session.flush()
+    wanted = name_tokens(user)
+    existing = {t.token: t for t in UserNameToken.query.filter_by(user_id=user.id).all()}
+    for token, row in existing.items():
+        if token not in wanted:
+            db.session.delete(row)
+    for token in wanted - existing.keys():
+        db.session.add(UserNameToken(token=token, user_id=user.id))
+    db.session.info['user_directory_changed'] = True
+
+
+def remove_user(user_id):
+    """Drop a user's search tokens (the caller commits)"""
+    UserNameToken.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    db.session.info['user_directory_changed'] = True
+
+
+def _prefix_range(prefix):
+    # token >= prefix AND token < prefix + U+FFFF is an index range scan on any backend
+    return UserNameToken.token >= prefix, UserNameToken.token < prefix + '\uffff'
+
+
+def _load_page(prefix, after_id, limit):
+    query = db.session.query(User.id, User.username, User.first_name, User.last_name).\
+        filter(User.id > after_id)
+    if prefix:
+        matches = db.session.query(UserNameToken.user_id).filter(*_prefix_range(prefix))
+        query = query.filter(User.id.in_(matches))
+    rows = query.filter(User.is_active.isnot(False)).order_by(User.id).limit(limit + 1).all()
+
+    users = [{'id': row.id, 'name': display_name(row.username, row.first_name, row.last_name)}
+             for row in rows[:limit]]
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    return {'users': users, 'next_cursor': next_cursor}
+
+
+def directory_page(prefix='', after_id=0, limit=50):
+    """One page of {'users': [{'id', 'name'}], 'next_cursor'}"""
+    prefix = prefix.strip().lower()[:TOKEN_LENGTH]
+    key = (_version, prefix, after_id, limit)
+    now = time.time()
+    with _lock:
+        cached = _cache.get(key)
+        if cached and cached[0] > now:
+            return cached[1]
+
+    page = _load_page(prefix, after_id, limit)
+    with _lock:
+        if key[0] == _version:
+            if len(_cache) >= MAX_CACHED_PAGES:
+                _cache.clear()
+            _cache[key] = (now + CACHE_SECONDS, page)
+    return page
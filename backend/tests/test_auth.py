@@ -0,0 +1,28 @@
+import threading
+
+from models import user as user_model
+from models.user import User
+from services import auth
+
+SIGN_UP = {'username': 'newcomer', 'email': 'newcomer@example.com', 'password': 'secret'}
+
+
+def test_sign_up_hashes_on_the_pool(client, monkeypatch):
+    def on_request_thread(password):
+        raise AssertionError('hashed on the request thread')
+    monkeypatch.setattr(user_model, 'generate_password_hash', on_request_thread)
+
+    assert client.post('/api/users', json=SIGN_UP).status_code == 201
+    login = client.post('/api/users/login', json={'username': 'newcomer', 'password': 'secret'})
+    assert login.status_code == 200
+
+
+def test_sign_up_is_refused_while_the_pool_is_full(client, monkeypatch):
+    monkeypatch.setattr(auth, '_hash_slots', threading.BoundedSemaphore(1))
+    auth._hash_slots.acquire()
+
+    response = client.post('/api/users', json=SIGN_UP)
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert User.query.count() == 0
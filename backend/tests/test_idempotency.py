@@ -0,0 +1,72 @@
+from datetime import datetime
+
+from models.trip import Trip
+from models.trip_point import TripPoint
+from routes import trip_routes
+
+
+def _trip_body(user_id):
+    return {'user_id': user_id, 'start_time': '2026-01-01T10:00:00', 'mode': 'car',
+            'start_location': {'lat': 19.07, 'lng': 72.87}}
+
+
+def test_retry_with_same_key_returns_first_trip(client, make_user):
+    user_id = make_user()
+    headers = {'Idempotency-Key': 'offline-1'}
+
+    first = client.post('/api/trips', json=_trip_body(user_id), headers=headers)
+    retry = client.post('/api/trips', json=_trip_body(user_id), headers=headers)
+
+    assert first.status_code == 201
+    assert retry.status_code == 200
+    assert retry.json['trip']['id'] == first.json['trip']['id']
+    assert Trip.query.count() == 1
+
+
+def test_same_key_for_another_user_is_a_new_trip(client, make_user):
+    first, second = make_user(), make_user()
+    headers = {'Idempotency-Key': 'offline-1'}
+
+    a = client.post('/api/trips', json=_trip_body(first), headers=headers)
+    b = client.post('/api/trips', json=_trip_body(second), headers=headers)
+
+    assert a.status_code == b.status_code == 201
+    assert a.json['trip']['id'] != b.json['trip']['id']
+
+
+def test_racing_retry_gets_the_winner(client, make_user, database, monkeypatch):
+    user_id = make_user()
+    # The other request commits between our lookup and our insert
+    winner = Trip(user_id=user_id, start_time=datetime(2026, 1, 1, 10), mode='car')
+    winner.idempotency_key = 'offline-1'
+    database.session.add(winner)
+    database.session.commit()
+    winner_id = winner.id
+
+    lookup = trip_routes._existing_trip
+    calls = []
+
+    def not_yet_committed(user, key):
+        calls.append(key)
+        return None if len(calls) == 1 else lookup(user, key)
+    monkeypatch.setattr(trip_routes, '_existing_trip', not_yet_committed)
+
+    response = client.post('/api/trips', json=_trip_body(user_id), headers={'Idempotency-Key': 'offline-1'})
+
+    assert len(calls) == 2
+    assert response.status_code == 200
+    assert response.json['trip']['id'] == winner_id
+    assert Trip.query.filter_by(user_id=user_id).count() == 1
+
+
+def test_repeated_point_is_stored_once(client, make_user):
+    user_id = make_user()
+    trip_id = client.post('/api/trips', json=_trip_body(user_id)).json['trip']['id']
+    point = {'latitude': 19.07, 'longitude': 72.87, 'timestamp': '2026-01-01T10:00:05Z'}
+
+    first = client.post(f'/api/trips/{trip_id}/points', json=point)
+    again = client.post(f'/api/trips/{trip_id}/points', json=point)
+
+    assert first.status_code == 201
+    assert again.status_code == 200
+    assert TripPoint.query.filter_by(trip_id=trip_id).count() == 1
@@ -0,0 +1,148 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from models.job import Job
+from services import jobs
+
+calls = []
+
+
+@jobs.handler('test_ok')
+def _ok(payload, job):
+    calls.append(('ok', payload))
+    job.progress(0.5, 'half way')
+    return {'echo': payload.get('value')}
+
+
+@jobs.handler('test_flaky')
+def _flaky(payload, job):
+    calls.append(('flaky', payload))
+    raise RuntimeError('boom')
+
+
+@pytest.fixture(autouse=True)
+def reset_calls():
+    calls.clear()
+
+
+def _due(job_id, database):
+    """Make a retried job due now instead of after its backoff"""
+    database.session.query(Job).filter_by(id=job_id).update({'run_at': datetime.utcnow()})
+    database.session.commit()
+
+
+def test_claim_runs_highest_priority_first(app, database):
+    low = jobs.enqueue('test_ok', {'value': 'low'}, priority=0)
+    high = jobs.enqueue('test_ok', {'value': 'high'}, priority=5)
+    database.session.commit()
+    low_id, high_id = low.id, high.id
+
+    worker = jobs.Worker(app, name='w1')
+    assert worker.run_once()
+    assert calls == [('ok', {'value': 'high'})]
+
+    database.session.expire_all()
+    done = database.session.get(Job, high_id)
+    assert (done.status, done.progress, done.result, done.locked_by) == ('succeeded', 1.0, {'echo': 'high'}, None)
+    assert database.session.get(Job, low_id).status == 'queued'
+
+
+def test_a_job_is_claimed_by_one_worker(app, database):
+    job_id = jobs.enqueue('test_ok', {}).id
+    database.session.commit()
+
+    first = jobs.Worker(app, name='w1').claim()
+    second = jobs.Worker(app, name='w2').claim()
+
+    assert first.id == job_id
+    assert second is None
+    assert database.session.get(Job, job_id).locked_by == 'w1'
+
+
+def test_delayed_job_waits(app, database):
+    jobs.enqueue('test_ok', {}, delay=60)
+    database.session.commit()
+
+    assert not jobs.Worker(app, name='w1').run_once()
+    assert calls == []
+
+
+def test_failures_retry_with_backoff_then_fail(app, database):
+    job_id = jobs.enqueue('test_flaky', {}, max_attempts=2).id
+    database.session.commit()
+    worker = jobs.Worker(app, name='w1')
+
+    assert worker.run_once()
+    job = database.session.get(Job, job_id)
+    assert (job.status, job.attempts) == ('queued', 1)
+    assert 'boom' in job.error
+    assert job.run_at > datetime.utcnow() + timedelta(seconds=jobs.BACKOFF_SECONDS / 2)
+
+    # Not due yet
+    assert not worker.run_once()
+    _due(job_id, database)
+    assert worker.run_once()
+
+    database.session.expire_all()
+    job = database.session.get(Job, job_id)
+    assert (job.status, job.attempts) == ('failed', 2)
+    assert job.finished_at is not None
+    assert len(calls) == 2
+
+
+def test_stale_lease_is_requeued_and_taken_over(app, database, monkeypatch):
+    job_id = jobs.enqueue('test_ok', {'value': 1}).id
+    database.session.commit()
+    lost = jobs.Worker(app, name='lost')
+    assert lost.claim().id == job_id
+
+    # The worker stopped heartbeating longer than a lease ago
+    database.session.query(Job).filter_by(id=job_id).update(
+        {'locked_at': datetime.utcnow() - timedelta(seconds=jobs.LEASE_SECONDS + 1)})
+    database.session.commit()
+
+    assert jobs.Worker(app, name='w2').run_once()
+    database.session.expire_all()
+    job = database.session.get(Job, job_id)
+    assert (job.status, job.attempts) == ('succeeded', 2)
+
+    # The old worker's heartbeat now fails instead of overwriting the new result
+    with pytest.raises(jobs.JobCancelled):
+        jobs.JobContext(job_id, 'lost').progress(0.9)
+
+
+def test_stale_lease_out_of_attempts_fails(app, database):
+    job_id = jobs.enqueue('test_ok', {}, max_attempts=1).id
+    database.session.commit()
+    jobs.Worker(app, name='lost').claim()
+    database.session.query(Job).filter_by(id=job_id).update(
+        {'locked_at': datetime.utcnow() - timedelta(seconds=jobs.LEASE_SECONDS + 1)})
+    database.session.commit()
+
+    assert not jobs.Worker(app, name='w2').run_once()
+    database.session.expire_all()
+    job = database.session.get(Job, job_id)
+    assert (job.status, job.error) == ('failed', 'worker lost')
+
+
+def test_cancel_stops_a_running_job_but_not_a_purge(app, database):
+    running = jobs.enqueue('test_ok', {}).id
+    purge = jobs.enqueue('user_purge', {'user_id': 1}).id
+    database.session.commit()
+    jobs.Worker(app, name='w1').claim()
+
+    assert jobs.cancel(running)
+    with pytest.raises(jobs.JobCancelled):
+        jobs.JobContext(running, 'w1').progress(0.5)
+    assert not jobs.cancel(purge)
+    assert database.session.get(Job, purge).status == 'queued'
+
+
+def test_enqueue_with_key_reuses_unfinished_job(database):
+    first = jobs.enqueue('test_ok', {}, key='rebuild:1')
+    again = jobs.enqueue('test_ok', {}, key='rebuild:1')
+
+    assert first.id == again.id
+    assert first.user_id is None
+    assert jobs.enqueue('test_ok', {'user_id': 7}).user_id == 7
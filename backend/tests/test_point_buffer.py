@@ -0,0 +1,96 @@
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+from models.trip import Trip
+from models.trip_point import TripPoint
+from services.point_buffer import DEAD_LETTER, PointBuffer
+
+# Far above any pid the kernel hands out, so the segment's writer is gone
+GONE_PID = 4194304 + 1
+
+
+@pytest.fixture
+def trip_id(make_user, database):
+    trip = Trip(user_id=make_user(), start_time=datetime(2026, 1, 1, 10), mode='car')
+    database.session.add(trip)
+    database.session.commit()
+    return trip.id
+
+
+@pytest.fixture
+def buffer(app, tmp_path):
+    log = PointBuffer(str(tmp_path), flush_ms=3600 * 1000, fsync=False)
+    log.app = app
+    return log
+
+
+def _point(trip_id, second, **fields):
+    return {'trip_id': trip_id, 'latitude': 19.07, 'longitude': 72.87 + second * 1e-4,
+            'timestamp': f'2026-01-01T10:00:{second:02d}', 'user_id': None, **fields}
+
+
+def _write_segment(directory, records, tail=''):
+    path = os.path.join(directory, f'{GONE_PID}-00000001.log')
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+        f.write(tail)
+    return path
+
+
+def test_orphan_segment_is_replayed_once(buffer, trip_id, tmp_path):
+    records = [_point(trip_id, s) for s in range(3)]
+    # The crashed writer had already flushed the first point, and died mid-append
+    path = _write_segment(str(tmp_path), records + [records[0]], tail='{"trip_id": ')
+
+    buffer.start()
+    assert buffer.pending() == 5
+    stored = buffer.flush()
+
+    assert stored == 3
+    assert TripPoint.query.filter_by(trip_id=trip_id).count() == 3
+    assert buffer.pending() == 0
+    assert not os.path.exists(path)
+    assert not os.path.exists(tmp_path / DEAD_LETTER)
+
+
+def test_poison_records_are_dead_lettered(buffer, trip_id, tmp_path):
+    records = [
+        _point(trip_id, 1),
+        _point(trip_id, 2, latitude='abc'),
+        _point(trip_id, 3, longitude=200.0),
+        {'latitude': 19.0, 'longitude': 72.0, 'timestamp': '2026-01-01T10:00:04'},
+        _point(trip_id, 5),
+    ]
+    _write_segment(str(tmp_path), records)
+
+    buffer.start()
+    stored = buffer.flush()
+
+    assert stored == 2
+    assert TripPoint.query.filter_by(trip_id=trip_id).count() == 2
+    with open(tmp_path / DEAD_LETTER, encoding='utf-8') as f:
+        dead = [json.loads(line) for line in f]
+    assert len(dead) == 3
+    assert all(entry['error'] for entry in dead)
+    # Nothing is left to hold up later flushes
+    assert buffer.flush() == 0
+
+
+def test_append_rejects_invalid_points(buffer, trip_id):
+    with pytest.raises(ValueError):
+        buffer.append(TripPoint(trip_id, 95.0, 72.87))
+    assert buffer.append(TripPoint(trip_id, 19.07, 72.87))
+    assert buffer.flush() == 1
+
+
+def test_points_of_deleted_trips_are_dropped(buffer, trip_id, tmp_path):
+    _write_segment(str(tmp_path), [_point(trip_id, 1), _point(trip_id + 1000, 2)])
+
+    buffer.start()
+
+    assert buffer.flush() == 1
+    assert not os.path.exists(tmp_path / DEAD_LETTER)
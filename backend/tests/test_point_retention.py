@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from models.trip import Trip
+from models.trip_point import TripPoint
+from services import point_retention
+
+NOW = datetime(2026, 6, 1)
+OLD = NOW - timedelta(days=point_retention.FULL_DAYS + 10)
+
+# About 11 m of latitude
+STEP = 1e-4
+
+
+def _track(n, seconds_apart=5, bend_at=None):
+    lats = np.full(n, 19.07)
+    lngs = 72.87 + np.arange(n) * STEP
+    if bend_at is not None:
+        # Turn north after point bend_at - 1
+        lats[bend_at:] += (np.arange(n - bend_at) + 1) * STEP
+        lngs[bend_at:] = lngs[bend_at - 1]
+    return lats, lngs, np.arange(n, dtype=float) * seconds_apart
+
+
+def test_straight_line_keeps_only_its_ends():
+    keep = point_retention.thin(*_track(20), tolerance_m=10, max_gap_seconds=0)
+
+    assert keep.tolist() == [True] + [False] * 18 + [True]
+
+
+def test_corner_is_kept():
+    keep = point_retention.thin(*_track(20, bend_at=10), tolerance_m=10, max_gap_seconds=0)
+
+    assert keep[0] and keep[9] and keep[-1]
+    assert keep.sum() == 3
+
+
+def test_max_gap_forces_points_back_in():
+    keep = point_retention.thin(*_track(20, seconds_apart=10), tolerance_m=10, max_gap_seconds=30)
+
+    kept_seconds = np.flatnonzero(keep) * 10
+    assert np.diff(kept_seconds).max() <= 30
+    assert keep[0] and keep[-1]
+    assert not keep.all()
+
+
+def test_gaps_in_the_recording_are_not_filled():
+    lats, lngs, seconds = _track(5, seconds_apart=100)
+    keep = point_retention.thin(lats, lngs, seconds, tolerance_m=10, max_gap_seconds=30)
+
+    assert keep.all()
+
+
+def test_short_tracks_are_kept_whole():
+    assert point_retention.thin(*_track(2)).all()
+
+
+@pytest.fixture
+def trips(make_user, database):
+    """An old closed trip and a recent one, each with a straight 20-point track"""
+    user_id = make_user()
+    made = {}
+    for name, start in (('old', OLD), ('recent', NOW - timedelta(days=1))):
+        trip = Trip(user_id=user_id, start_time=start, mode='car', end_time=start + timedelta(minutes=2))
+        database.session.add(trip)
+        database.session.commit()
+        lats, lngs, seconds = _track(20)
+        database.session.add_all([
+            TripPoint(trip.id, float(lat), float(lng), timestamp=start + timedelta(seconds=float(s)))
+            for lat, lng, s in zip(lats, lngs, seconds)
+        ])
+        database.session.commit()
+        made[name] = trip.id
+    return made
+
+
+def _points(trip_id):
+    return TripPoint.query.filter_by(trip_id=trip_id).count()
+
+
+def test_run_thins_old_trips_only(trips, database):
+    report = point_retention.run(now=NOW)
+
+    assert report['thin']['trips'] == 1
+    assert report['thin']['points_before'] == 20
+    database.session.expire_all()
+    old = database.session.get(Trip, trips['old'])
+    assert old.point_detail == point_retention.THINNED
+    assert _points(trips['old']) == 20 - report['thin']['points'] < 20
+    assert database.session.get(Trip, trips['recent']).point_detail is None
+    assert _points(trips['recent']) == 20
+
+    # Each trip is thinned once
+    assert point_retention.run(now=NOW)['thin']['trips'] == 0
+
+
+def test_dry_run_changes_nothing(trips, database):
+    report = point_retention.run(dry_run=True, now=NOW)
+
+    assert report['thin']['points'] > 0
+    assert report['points_removed'] == report['thin']['points']
+    database.session.expire_all()
+    assert database.session.get(Trip, trips['old']).point_detail is None
+    assert _points(trips['old']) == 20
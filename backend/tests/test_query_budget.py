@@ -0,0 +1,34 @@
+import pytest
+
+from services import query_budget
+
+WITHIN = '/api/trips/within?min_lat=19&min_lng=72.8&max_lat=19.2&max_lng=73'
+
+
+@pytest.fixture
+def trips(client, make_user):
+    user_id = make_user()
+    for minute in range(3):
+        response = client.post('/api/trips', json={
+            'user_id': user_id, 'mode': 'car',
+            'start_time': f'2026-01-01T10:{minute:02d}:00', 'start_location': {'lat': 19.07, 'lng': 72.87}
+        })
+        assert response.status_code == 201
+    return user_id
+
+
+@pytest.mark.parametrize('path', [WITHIN, '/api/trips/nearby?lat=19.07&lng=72.87&radius_m=500'])
+def test_spatial_search_over_the_row_budget_is_refused(client, trips, monkeypatch, path):
+    monkeypatch.setattr(query_budget, 'DEFAULT_ROWS', 2)
+
+    response = client.get(path)
+
+    assert response.status_code == 422
+    assert response.json['code'] == 'query_budget_exceeded'
+
+
+def test_spatial_search_within_the_row_budget(client, trips, monkeypatch):
+    monkeypatch.setattr(query_budget, 'DEFAULT_ROWS', 3)
+
+    assert client.get(WITHIN).json['count'] == 3
+    assert client.get(f'{WITHIN}&user_id={trips}').json['count'] == 3
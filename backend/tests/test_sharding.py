@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from models.trip import Trip
+from models.user import User
+from services import live_state, sharding
+from services.od_matrix import od_engine
+from services.sharding import shards
+
+SHARD = 'shard_1'
+
+
+@pytest.fixture
+def open_shard(monkeypatch):
+    """New users land on shard_1"""
+    monkeypatch.setattr(sharding, 'OPEN_SHARDS', [SHARD])
+
+
+def _create_user(client, name):
+    response = client.post('/api/users', json={'username': name, 'email': f'{name}@example.com',
+                                               'password': 'secret'})
+    assert response.status_code == 201
+    return response.json['user']['id']
+
+
+def _create_trip(client, user_id):
+    response = client.post('/api/trips', json={
+        'user_id': user_id, 'mode': 'car',
+        'start_time': '2026-01-01T10:00:00', 'end_time': '2026-01-01T10:20:00',
+        'start_location': {'lat': 19.07, 'lng': 72.87}, 'end_location': {'lat': 19.10, 'lng': 72.90},
+        'distance_km': 5.0
+    })
+    assert response.status_code == 201
+    return response.json['trip']['id']
+
+
+def _trip_ids_on(name):
+    with shards.engine(name).connect() as conn:
+        return set(conn.execute(select(Trip.__table__.c.id)).scalars())
+
+
+def test_new_user_is_placed_on_an_open_shard(client, open_shard):
+    user_id = _create_user(client, 'sharded')
+
+    assert shards.shard_for(user_id) == SHARD
+    # Global tables stay on the primary; the shard holds a copy of the user row
+    with shards.engine(SHARD).connect() as conn:
+        assert conn.execute(select(User.__table__.c.id).where(User.__table__.c.id == user_id)).scalar() == user_id
+
+
+def test_trips_are_written_to_and_read_from_the_users_shard(client, open_shard):
+    user_id = _create_user(client, 'sharded')
+    trip_id = _create_trip(client, user_id)
+
+    assert _trip_ids_on(SHARD) == {trip_id}
+    assert _trip_ids_on(sharding.PRIMARY) == set()
+
+    response = client.get(f'/api/trips/{trip_id}?user_id={user_id}')
+    assert response.status_code == 200
+    assert response.json['id'] == trip_id
+    listed = client.get(f'/api/trips?user_id={user_id}').json['trips']
+    assert [trip['id'] for trip in listed] == [trip_id]
+
+
+def test_ids_are_unique_across_shards(client, make_user, open_shard):
+    on_primary = _create_trip(client, make_user())
+    on_shard = _create_trip(client, _create_user(client, 'sharded'))
+
+    assert on_primary != on_shard
+    assert _trip_ids_on(sharding.PRIMARY) == {on_primary}
+    assert _trip_ids_on(SHARD) == {on_shard}
+
+
+def test_cross_user_reads_gather_every_shard(app, client, make_user, open_shard):
+    trip_ids = {_create_trip(client, make_user()), _create_trip(client, _create_user(client, 'sharded'))}
+
+    within = client.get('/api/trips/within?min_lat=19&min_lng=72.8&max_lat=19.2&max_lng=73')
+    assert within.status_code == 200
+    assert {trip['id'] for trip in within.json['trips']} == trip_ids
+
+    with app.app_context():
+        od_engine.rebuild()
+        assert od_engine.matrix()['total_trips'] == 2
+
+
+def test_moving_users_come_from_every_shard(client, make_user, database, open_shard):
+    on_primary, on_shard = make_user(), _create_user(client, 'sharded')
+    now = datetime.utcnow()
+    for user_id, seconds_ago in ((on_primary, 60), (on_shard, 10)):
+        with sharding.for_user(user_id):
+            live_state.record_fix(user_id, 19.07, 72.87, fix_time=now - timedelta(seconds=seconds_ago), speed=5.0)
+            database.session.commit()
+
+    everyone = client.get('/api/context/moving').json['users']
+    assert [user['user_id'] for user in everyone] == [on_shard, on_primary]
+    latest = client.get('/api/context/moving?limit=1').json['users']
+    assert [user['user_id'] for user in latest] == [on_shard]
@@ -0,0 +1,61 @@
+from datetime import datetime
+
+import pytest
+
+from models.manual_trip import ManualTrip
+from models.trip import Trip
+from services import timeline
+
+TIE = datetime(2026, 1, 1, 10)
+
+
+@pytest.fixture
+def user_entries(make_user, database):
+    """A user with three trips and two manual trips at the same start_time,
+    plus one entry on either side of the tie"""
+    user_id = make_user()
+    other = make_user()
+    # One table per commit: on SQLite the id allocator's own transaction
+    # would wait on a flush that has already written to another table
+    database.session.add_all([Trip(user_id=user_id, start_time=TIE, mode='car') for _ in range(3)])
+    database.session.add(Trip(user_id=user_id, start_time=datetime(2026, 1, 1, 9), mode='bus'))
+    database.session.add(Trip(user_id=other, start_time=TIE, mode='car'))
+    database.session.commit()
+    database.session.add_all([ManualTrip(user_id=user_id, start_time=TIE, mode='walk') for _ in range(2)])
+    database.session.add(ManualTrip(user_id=user_id, start_time=datetime(2026, 1, 1, 11), mode='bike'))
+    database.session.commit()
+    return user_id
+
+
+def _walk(user_id, order, limit):
+    keys, cursor, pages = [], None, 0
+    while True:
+        result = timeline.page(user_id, limit=limit, cursor=cursor, order=order)
+        keys += [(datetime.fromisoformat(e['start_time']), e['source'], e['id']) for e in result['entries']]
+        pages += 1
+        cursor = result['next_cursor']
+        if cursor is None:
+            return keys, pages
+
+
+@pytest.mark.parametrize('limit', [1, 2, 3])
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+def test_pages_over_ties_return_each_entry_once(user_entries, order, limit):
+    keys, pages = _walk(user_entries, order, limit)
+
+    assert len(keys) == len(set(keys)) == 7
+    assert keys == sorted(keys, reverse=order == 'desc')
+    assert pages == -(-7 // limit)
+
+
+def test_ties_are_ordered_by_source_then_id(user_entries):
+    keys, _ = _walk(user_entries, 'asc', 2)
+    tied = [(source, entry_id) for start_time, source, entry_id in keys if start_time == TIE]
+
+    assert [source for source, _ in tied] == ['manual'] * 2 + ['trip'] * 3
+    assert tied == sorted(tied)
+
+
+def test_invalid_cursor_is_rejected(user_entries):
+    with pytest.raises(timeline.InvalidCursor):
+        timeline.page(user_entries, cursor='not-a-cursor')
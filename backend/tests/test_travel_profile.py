@@ -0,0 +1,41 @@
+from datetime import datetime
+
+from models.job import Job
+from models.trip import Trip
+from models.user_travel_profile import UserTravelProfile
+from services import travel_profile
+
+
+def _closed_trip(user_id, hour):
+    return Trip(user_id=user_id, start_time=datetime(2026, 1, 5, hour), mode='bus',
+                end_time=datetime(2026, 1, 5, hour, 30))
+
+
+def test_predictions_build_a_missing_profile_from_history(client, make_user, database):
+    # Trips recorded before the user had a profile
+    user_id = make_user()
+    database.session.add_all([_closed_trip(user_id, 8), _closed_trip(user_id, 18)])
+    database.session.commit()
+
+    response = client.get(f'/api/analytics/predictions?user_id={user_id}')
+
+    assert response.status_code == 200
+    assert response.json['mode_recommendations'][0]['mode'] == 'bus'
+    assert database.session.get(UserTravelProfile, user_id).trip_count == 2
+
+
+def test_unknown_user_has_no_profile(client):
+    assert client.get('/api/analytics/predictions?user_id=999').status_code == 404
+    assert client.get('/api/analytics/predict-next?user_id=999').status_code == 404
+
+
+def test_backfill_queues_users_without_a_profile(make_user, database):
+    built, missing = make_user(), make_user()
+    travel_profile.rebuild_profile(built)
+
+    assert travel_profile.backfill() == 1
+    queued = Job.query.filter_by(kind='travel_profile_rebuild').all()
+    assert [job.user_id for job in queued] == [missing]
+    # A second run reuses the queued job
+    travel_profile.backfill()
+    assert Job.query.filter_by(kind='travel_profile_rebuild').count() == 1
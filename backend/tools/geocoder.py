@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Build the offline reverse-geocoding index and fill addresses from it
+(see services/geocoder.py). Run from backend/:
+
+    python tools/geocoder.py build IN.txt data/gazetteer.idx
+    python tools/geocoder.py build pois.csv data/gazetteer.idx
+    python tools/geocoder.py bench --lookups 100000
+    python tools/geocoder.py backfill           # queue a background job
+    python tools/geocoder.py backfill --now     # run it here
+
+`build` reads a GeoNames dump (for example a country file or
+cities500.txt from https://download.geonames.org/export/dump/) or a CSV
+with name, lat/latitude and lng/lon/longitude columns. GeoNames rows are
+filtered by feature class; by default populated places, spots and areas
+(P, S, L) are kept.
+"""
+
+import argparse
+import csv
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+GEONAMES_COLUMNS = 19
+
+
+def read_geonames(path, classes):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < GEONAMES_COLUMNS or fields[6] not in classes:
+                continue
+            yield fields[1], float(fields[4]), float(fields[5])
+
+
+def read_csv(path):
+    with open(path, encoding='utf-8', newline='') as f:
+        reader = csv.DictReader(f)
+        fields = {name.lower(): name for name in reader.fieldnames or []}
+        lat = next((fields[k] for k in ('lat', 'latitude') if k in fields), None)
+        lng = next((fields[k] for k in ('lng', 'lon', 'longitude') if k in fields), None)
+        if 'name' not in fields or lat is None or lng is None:
+            raise SystemExit('CSV needs name, lat/latitude and lng/lon/longitude columns')
+        for row in reader:
+            try:
+                yield row[fields['name']].strip(), float(row[lat]), float(row[lng])
+            except (TypeError, ValueError):
+                continue
+
+
+def is_geonames(path):
+    with open(path, encoding='utf-8') as f:
+        first = f.readline()
+    return first.count('\t') >= GEONAMES_COLUMNS - 1
+
+
+def build(options):
+    from services import geocoder
+
+    started = time.time()
+    if is_geonames(options.source):
+        entries = read_geonames(options.source, set(options.classes.split(',')))
+    else:
+        entries = read_csv(options.source)
+    os.makedirs(os.path.dirname(os.path.abspath(options.output)), exist_ok=True)
+    count = geocoder.write_index(options.output, entries)
+    size = os.path.getsize(options.output)
+    print(f"Wrote {count} places to {options.output} ({size / 1e6:.1f} MB) in {time.time() - started:.1f}s")
+
+
+def bench(options):
+    from services import geocoder
+
+    index = geocoder.gazetteer()
+    if index is None:
+        raise SystemExit(f'No index at {geocoder.INDEX_PATH}; build one first or set GEOCODER_INDEX')
+
+    # Sample around indexed places so most lookups have a match within range
+    rng = random.Random(7)
+    picks = [rng.randrange(index.size) for _ in range(options.lookups)]
+    coordinates = [(float(index.lats[i]) + rng.uniform(-0.02, 0.02), float(index.lngs[i]) + rng.uniform(-0.02, 0.02))
+                   for i in picks]
+
+    started = time.perf_counter()
+    names = [index.nearest(lat, lng) for lat, lng in coordinates]
+    uncached = time.perf_counter() - started
+    started = time.perf_counter()
+    geocoder.reverse_many(coordinates)
+    geocoder.reverse_many(coordinates)
+    cached = (time.perf_counter() - started) / 2
+
+    found = sum(1 for name in names if name)
+    print(f"{index.size} places, {options.lookups} lookups, {found} matched within {geocoder.MAX_DISTANCE_M:.0f} m")
+    print(f"index:      {options.lookups / uncached:>10.0f} lookups/s")
+    print(f"with cache: {options.lookups / cached:>10.0f} lookups/s (second pass)")
+
+
+def backfill(options):
+    from app import app
+    from extensions import db
+    from services import geocoder, jobs, sharding
+
+    with app.app_context():
+        if options.now:
+            print(sharding.per_shard(lambda: geocoder.backfill(batch_size=options.batch_size)))
+            return
+        job = jobs.enqueue('geocode_backfill', {'batch_size': options.batch_size}, key='geocode_backfill')
+        db.session.commit()
+        print(f"Queued job {job.id}; follow it at /api/jobs/{job.id}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_cmd = commands.add_parser('build', help='build an index from a GeoNames dump or a CSV')
+    build_cmd.add_argument('source')
+    build_cmd.add_argument('output')
+    build_cmd.add_argument('--classes', default='P,S,L', help='GeoNames feature classes to keep')
+    bench_cmd = commands.add_parser('bench', help='measure lookup throughput on the configured index')
+    bench_cmd.add_argument('--lookups', type=int, default=100000)
+    backfill_cmd = commands.add_parser('backfill', help='fill missing trip addresses and place labels')
+    backfill_cmd.add_argument('--now', action='store_true', help='run in this process instead of as a job')
+    backfill_cmd.add_argument('--batch-size', type=int, default=1000)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    {'build': build, 'bench': bench, 'backfill': backfill}[options.command](options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Run background job workers (see services/jobs.py).
+
+    python tools/job_worker.py --processes 2
+
+Each process claims and runs jobs from the jobs table. The supervisor
+restarts processes that exit and stops them all on SIGTERM/SIGINT.
+gunicorn.conf.py starts this next to the web workers (JOBS_WORKERS).
+"""
+
+import argparse
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+def run_worker(index):
+    import threading
+
+    from app import app
+    from services.jobs import Worker
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    Worker(app, name=f'{os.uname().nodename}:{os.getpid()}:jobs-{index}').run_forever(stop)
+
+
+def supervise(processes):
+    # Spawned, not forked, so each worker starts with its own connections and threads
+    context = multiprocessing.get_context('spawn')
+    running = {}
+    stopping = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while not stopping:
+        for index in range(processes):
+            process = running.get(index)
+            if process is None or not process.is_alive():
+                if process is not None:
+                    print(f"[jobs] worker process {process.pid} exited ({process.exitcode}), restarting")
+                process = context.Process(target=run_worker, args=(index,), name=f'jobs-{index}')
+                process.start()
+                running[index] = process
+        time.sleep(1)
+
+    for process in running.values():
+        process.terminate()
+    for process in running.values():
+        process.join(30)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=int(os.getenv('JOBS_WORKERS', '1')))
+    return parser.parse_args(argv)
+
+
+def check_schema():
+    from app import app
+    from extensions import db
+    from models import fixed_point
+
+    with app.app_context():
+        fixed_point.check_schema(db.engines.values())
+
+
+if __name__ == '__main__':
+    options = parse_args()
+    # A storage mismatch would only make the workers crash and restart in a loop
+    check_schema()
+    supervise(max(1, options.processes))
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Compare NUMERIC_STORAGE=decimal against NUMERIC_STORAGE=compact.
+
+Seeds the same trips and points into a throwaway SQLite database per mode
+(each in its own process, since the mode is read at import), then reports
+table and index sizes and times the aggregates the analytics endpoints
+run:
+
+    python tools/numeric_storage_bench.py --trips 20000 --points 200000 --repeat 5
+
+Sizes come from SQLite's dbstat table; on builds without it only the
+timings are shown.
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+MODES = ('decimal', 'compact')
+
+
+def seed(db, trips, points):
+    from models.trip import Trip
+    from models.trip_point import TripPoint
+    from models.user import User
+
+    rng = random.Random(42)
+    user = User(username='bench', email='bench@example.com', password='bench')
+    db.session.add(user)
+    db.session.flush()
+    start = datetime(2026, 1, 1, 8)
+    modes = ('walking', 'cycling', 'bus', 'car', 'train')
+    db.session.execute(Trip.__table__.insert(), [{
+        'user_id': user.id, 'start_time': start + timedelta(minutes=30 * i), 'mode': modes[i % 5],
+        'start_lat': round(28.4 + rng.random() * 0.5, 8), 'start_lng': round(76.9 + rng.random() * 0.5, 8),
+        'end_lat': round(28.4 + rng.random() * 0.5, 8), 'end_lng': round(76.9 + rng.random() * 0.5, 8),
+        'distance_km': round(rng.uniform(0.5, 40), 2), 'duration_minutes': rng.randint(5, 90),
+        'mode_confidence': round(rng.random(), 2), 'co2_kg': round(rng.uniform(0, 8), 2),
+        'cost_usd': round(rng.uniform(0, 15), 2), 'is_manual': False, 'created_at': start, 'updated_at': start
+    } for i in range(trips)])
+    trip_ids = [row[0] for row in db.session.query(Trip.id).order_by(Trip.id)]
+    per_trip = max(1, points // len(trip_ids))
+    rows = [{
+        'trip_id': trip_ids[i // per_trip % len(trip_ids)],
+        'latitude': round(28.4 + rng.random() * 0.5, 8), 'longitude': round(76.9 + rng.random() * 0.5, 8),
+        'altitude': round(rng.uniform(200, 260), 2), 'accuracy': round(rng.uniform(3, 30), 2),
+        'speed': round(rng.uniform(0, 25), 2), 'heading': round(rng.uniform(0, 359), 2),
+        'timestamp': start + timedelta(seconds=i)
+    } for i in range(points)]
+    for offset in range(0, len(rows), 20000):
+        db.session.execute(TripPoint.__table__.insert(), rows[offset:offset + 20000])
+    db.session.commit()
+    return user.id
+
+
+def sizes(db):
+    """Bytes per table and index, from dbstat"""
+    from sqlalchemy import text
+    try:
+        result = db.session.execute(text('SELECT name, SUM(pgsize) FROM dbstat GROUP BY name'))
+    except Exception:
+        db.session.rollback()
+        return {}
+    return {name: int(size) for name, size in result}
+
+
+def run_mode(options):
+    """Child process: seed, measure, print one JSON line"""
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    try:
+        from sqlalchemy import func, text
+        from app import app
+        from extensions import db
+        from models.trip import Trip
+        from models.trip_point import TripPoint
+
+        with app.app_context():
+            db.create_all()
+            db.session.execute(text('CREATE INDEX ix_bench_points_lat_lng ON trip_points (latitude, longitude)'))
+            user_id = seed(db, options.trips, options.points)
+            db.session.execute(text('VACUUM'))
+
+            queries = {
+                'summary': lambda: db.session.query(
+                    func.sum(Trip.distance_km), func.sum(Trip.co2_kg), func.sum(Trip.cost_usd)
+                ).filter(Trip.user_id == user_id).one(),
+                'by mode': lambda: db.session.query(
+                    Trip.mode, func.count(Trip.id), func.sum(Trip.distance_km), func.avg(Trip.mode_confidence)
+                ).group_by(Trip.mode).all(),
+                'point speed': lambda: db.session.query(
+                    func.avg(TripPoint.speed), func.max(TripPoint.altitude)
+                ).one(),
+                'bbox count': lambda: db.session.query(func.count(TripPoint.id)).filter(
+                    TripPoint.latitude.between(28.5, 28.6), TripPoint.longitude.between(77.0, 77.1)
+                ).scalar()
+            }
+            timings, answers = {}, {}
+            for name, query in queries.items():
+                samples = []
+                for _ in range(options.repeat):
+                    started = time.perf_counter()
+                    answers[name] = query()
+                    samples.append(time.perf_counter() - started)
+                timings[name] = statistics.median(samples) * 1000
+            print(json.dumps({'sizes': sizes(db), 'timings': timings,
+                              'bbox': answers['bbox count']}))
+    finally:
+        os.remove(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trips', type=int, default=20000)
+    parser.add_argument('--points', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    options = parser.parse_args(argv)
+    if options.child:
+        return run_mode(options)
+
+    results = {}
+    for mode in MODES:
+        env = dict(os.environ, NUMERIC_STORAGE=mode)
+        output = subprocess.run(
+            [sys.executable, __file__, '--child', '--trips', str(options.trips),
+             '--points', str(options.points), '--repeat', str(options.repeat)],
+            env=env, check=True, capture_output=True, text=True
+        ).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+
+    decimal, compact = results['decimal'], results['compact']
+    if decimal['sizes']:
+        print(f"{'table / index':<28}{'decimal KB':>12}{'compact KB':>12}{'saved':>8}")
+        for name in sorted(decimal['sizes']):
+            if not name.startswith(('trips', 'trip_points', 'ix_bench')):
+                continue
+            old, new = decimal['sizes'][name], compact['sizes'].get(name, 0)
+            print(f"{name:<28}{old / 1024:>12.0f}{new / 1024:>12.0f}{1 - new / old:>8.0%}")
+        print()
+    print(f"{'aggregate':<28}{'decimal ms':>12}{'compact ms':>12}{'speedup':>8}")
+    for name, old in decimal['timings'].items():
+        new = compact['timings'][name]
+        print(f"{name:<28}{old:>12.1f}{new:>12.1f}{old / new:>7.1f}x")
+    if decimal['bbox'] != compact['bbox']:
+        print(f"note: bbox counts differ ({decimal['bbox']} vs {compact['bbox']}) at the rounding boundary")
+
+
+if __name__ == '__main__':
+    main()
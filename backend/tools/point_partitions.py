@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Manage time partitions of trip_points (see services/point_store.py).
+
+Run from backend/ with POINT_PARTITIONING set to the mode in use:
+
+    POINT_PARTITIONING=native python tools/point_partitions.py convert
+    POINT_PARTITIONING=tables python tools/point_partitions.py migrate
+    python tools/point_partitions.py list
+    python tools/point_partitions.py create --ahead 3
+    python tools/point_partitions.py drop --before 2025-01-01 --dry-run
+    python tools/point_partitions.py dedupe --batch-size 5000
+
+`convert` turns a plain Postgres trip_points table into a partitioned one.
+`migrate` moves rows from the legacy trip_points table into the per-period
+tables; migrated points get new ids. `dedupe` deletes repeated
+(trip_id, timestamp) points left by retried uploads, one short
+transaction per batch; it works in every mode, including off.
+"""
+
+import argparse
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import func, select, text  # noqa: E402
+
+
+def convert_native(db, store):
+    """Rebuild trip_points as a Postgres table partitioned by timestamp"""
+    parent = 'trip_points'
+    with db.engine.begin() as conn:
+        partitioned = conn.execute(text(
+            "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+            "WHERE c.relname = :parent"
+        ), {'parent': parent}).first()
+        if partitioned:
+            print("trip_points is already partitioned")
+            return
+
+        conn.execute(text(f'UPDATE {parent} SET "timestamp" = now() WHERE "timestamp" IS NULL'))
+        first, last = conn.execute(text(f'SELECT min("timestamp"), max("timestamp") FROM {parent}')).one()
+
+        conn.execute(text(f'ALTER TABLE {parent} RENAME TO {parent}_legacy'))
+        # Keep the id sequence alive when the legacy table is dropped
+        conn.execute(text(f'ALTER SEQUENCE {parent}_id_seq OWNED BY NONE'))
+        conn.execute(text(
+            f'CREATE TABLE {parent} (LIKE {parent}_legacy INCLUDING DEFAULTS) PARTITION BY RANGE ("timestamp")'
+        ))
+        conn.execute(text(f'ALTER TABLE {parent} ALTER COLUMN "timestamp" SET NOT NULL'))
+
+        low = store.ordinal(first or datetime.utcnow())
+        high = store.ordinal(max(last or datetime.utcnow(), datetime.utcnow()))
+        for ordinal in range(low, high + 2):
+            start, end = store.bounds(ordinal)
+            conn.execute(text(
+                f'CREATE TABLE {store.partition_name(ordinal)} PARTITION OF {parent} '
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            ))
+
+        conn.execute(text(f'INSERT INTO {parent} SELECT * FROM {parent}_legacy'))
+        conn.execute(text(f'DROP TABLE {parent}_legacy'))
+        conn.execute(text(f'ALTER SEQUENCE {parent}_id_seq OWNED BY {parent}.id'))
+
+        # The partition key has to be part of the primary key
+        conn.execute(text(f'ALTER TABLE {parent} ADD PRIMARY KEY (id, "timestamp")'))
+        conn.execute(text(f'ALTER TABLE {parent} ADD FOREIGN KEY (trip_id) REFERENCES trips (id)'))
+        conn.execute(text(f'CREATE INDEX ix_trip_points_trip_id ON {parent} (trip_id)'))
+        conn.execute(text(f'CREATE INDEX ix_trip_points_cell ON {parent} (cell)'))
+        conn.execute(text(f'CREATE INDEX ix_trip_points_timestamp ON {parent} ("timestamp")'))
+        conn.execute(text(f'CREATE UNIQUE INDEX uq_trip_points_trip_timestamp ON {parent} (trip_id, "timestamp")'))
+    print(f"Converted {parent} into {high + 2 - low} partitions ({store.period})")
+
+
+def migrate_tables(db, store, batch_size):
+    """Move legacy trip_points rows into their period tables"""
+    from services.point_store import base
+
+    columns = [c for c in base.columns if c.name != 'id']
+    moved = 0
+    while True:
+        rows = db.session.execute(
+            select(base.c.id, *columns).where(base.c.timestamp.isnot(None)).order_by(base.c.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        by_period = {}
+        for row in rows:
+            by_period.setdefault(store.ordinal(row.timestamp), []).append(
+                {c.name: getattr(row, c.name) for c in columns}
+            )
+        for ordinal, values in by_period.items():
+            store._ensure(ordinal)
+            db.session.execute(store._period_table(store.partition_name(ordinal)).insert(), values)
+        db.session.execute(base.delete().where(base.c.id.in_([row.id for row in rows])))
+        db.session.commit()
+        moved += len(rows)
+        print(f"  moved {moved} points")
+    left = db.session.execute(select(func.count()).select_from(base)).scalar()
+    print(f"Moved {moved} points; {left} without a timestamp stay in trip_points")
+
+
+def dedupe(db, store, batch_size):
+    """Delete repeated points batch by batch and refresh the heatmaps they inflated"""
+    from models.trip import Trip
+    from services import heatmap_tiles
+
+    users = set()
+    while True:
+        trip_ids = store.dedupe(batch_size)
+        if not trip_ids:
+            break
+        user_ids = db.session.execute(select(Trip.user_id).where(Trip.id.in_(trip_ids)).distinct()).scalars().all()
+        for user_id in user_ids:
+            heatmap_tiles.trips_changed(db.session, user_id, deleted=True)
+            users.add(user_id)
+        db.session.commit()
+        print(f"  cleaned {len(trip_ids)} trip(s)")
+    print(f"Removed duplicate points of {len(users)} user(s)")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='show partitions and their time ranges')
+    create = commands.add_parser('create', help='pre-create the current and upcoming partitions')
+    create.add_argument('--ahead', type=int, default=2, help='periods to create beyond the current one')
+    drop = commands.add_parser('drop', help='drop partitions that end on or before a date')
+    drop.add_argument('--before', required=True, help='ISO date, e.g. 2025-01-01')
+    drop.add_argument('--dry-run', action='store_true', help='only list what would be dropped')
+    commands.add_parser('convert', help='partition an existing Postgres trip_points table')
+    migrate = commands.add_parser('migrate', help='move legacy rows into per-period tables')
+    migrate.add_argument('--batch-size', type=int, default=10000)
+    dedupe_cmd = commands.add_parser('dedupe', help='delete repeated (trip_id, timestamp) points')
+    dedupe_cmd.add_argument('--batch-size', type=int, default=10000)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+
+    from app import app
+    from extensions import db
+    from services.point_store import point_store
+
+    with app.app_context():
+        if options.command == 'convert':
+            if db.engine.dialect.name != 'postgresql':
+                raise SystemExit('convert needs Postgres; use POINT_PARTITIONING=tables and migrate instead')
+            convert_native(db, point_store)
+            return
+        if options.command == 'dedupe':
+            dedupe(db, point_store, options.batch_size)
+            return
+        if point_store.mode == 'off':
+            raise SystemExit('Set POINT_PARTITIONING to native or tables first')
+
+        if options.command == 'list':
+            partitions = point_store.partitions()
+            for partition in partitions:
+                print(f"{partition['name']:<28} {partition['start']} -> {partition['end']}")
+            print(f"{len(partitions)} partition(s), mode={point_store.mode}, period={point_store.period}")
+        elif options.command == 'create':
+            for name in point_store.create_ahead(options.ahead):
+                print(name)
+        elif options.command == 'drop':
+            cutoff = datetime.fromisoformat(options.before)
+            dropped = point_store.drop_before(cutoff, dry_run=options.dry_run)
+            verb = 'Would drop' if options.dry_run else 'Dropped'
+            print(f"{verb} {len(dropped)} partition(s): {', '.join(dropped) or '-'}")
+        elif options.command == 'migrate':
+            if point_store.mode != 'tables':
+                raise SystemExit('migrate is for POINT_PARTITIONING=tables; use convert on Postgres')
+            migrate_tables(db, point_store, options.batch_size)
+
+
+if __name__ == '__main__':
+    main()
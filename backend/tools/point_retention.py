@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Apply the GPS point retention policy (see services/point_retention.py).
+Run from backend/ with the same RETENTION_* settings as the app:
+
+    python tools/point_retention.py report        # dry run: what a pass would reclaim
+    python tools/point_retention.py run           # queue a background pass
+    python tools/point_retention.py run --now     # run the pass here
+
+Schedule `run` (e.g. daily from cron); each pass only touches trips that
+aged into a new tier since the last one.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('report', help='dry run: count the points and bytes a pass would reclaim')
+    run = commands.add_parser('run', help='thin and drop old points')
+    run.add_argument('--now', action='store_true', help='run in this process instead of as a job')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+
+    from app import app
+    from extensions import db
+    from services import jobs, point_retention, sharding
+
+    with app.app_context():
+        if options.command == 'report' or options.now:
+            report = sharding.per_shard(lambda: point_retention.run(dry_run=options.command == 'report'))
+            print(json.dumps(report, indent=2))
+            return
+        job = jobs.enqueue('point_retention', {}, key='point_retention')
+        db.session.commit()
+        print(f"Queued job {job.id}; follow it at /api/jobs/{job.id}")
+
+
+if __name__ == '__main__':
+    main()
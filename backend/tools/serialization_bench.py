@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Benchmark list endpoints: ORM hydration + to_dict() + jsonify against the
+column-tuple encoders in services/serialization.py.
+
+Seeds a throwaway SQLite database, checks that both paths return the same
+JSON, and times each one inside a request context:
+
+    python tools/serialization_bench.py --trips 2000 --points 5000 --repeat 20
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+def seed(db, trips, points, manual):
+    from models.manual_trip import ManualTrip
+    from models.trip import Trip
+    from models.trip_point import TripPoint
+    from models.user import User
+
+    user = User(username='bench', email='bench@example.com', password='bench')
+    db.session.add(user)
+    db.session.flush()
+    start = datetime(2026, 1, 1, 8)
+    modes = ('walking', 'cycling', 'bus', 'car', 'train')
+    trip_rows = [{
+        'user_id': user.id, 'start_time': start + timedelta(hours=i), 'end_time': start + timedelta(hours=i, minutes=30),
+        'start_lat': Decimal('28.61390000') + i % 100 / Decimal(1000), 'start_lng': Decimal('77.20900000'),
+        'end_lat': Decimal('28.70410000'), 'end_lng': Decimal('77.10250000') + i % 50 / Decimal(1000),
+        'start_address': 'Connaught Place', 'end_address': 'Rohini', 'distance_km': Decimal('12.40'),
+        'duration_minutes': 30, 'mode': modes[i % 5], 'mode_confidence': Decimal('0.85'),
+        'co2_kg': Decimal('1.49'), 'cost_usd': Decimal('4.20'), 'is_manual': False,
+        'created_at': start, 'updated_at': start
+    } for i in range(trips)]
+    db.session.execute(Trip.__table__.insert(), trip_rows)
+    trip_id = db.session.query(Trip.id).order_by(Trip.id).first()[0]
+    db.session.execute(TripPoint.__table__.insert(), [{
+        'trip_id': trip_id, 'latitude': Decimal('28.61390000') + i / Decimal(100000),
+        'longitude': Decimal('77.20900000'), 'altitude': Decimal('216.00'), 'accuracy': Decimal('5.00'),
+        'speed': Decimal('8.30') if i % 7 else None, 'heading': Decimal('90.00'),
+        'timestamp': start + timedelta(seconds=i)
+    } for i in range(points)])
+    db.session.execute(ManualTrip.__table__.insert(), [{
+        'user_id': user.id, 'start_time': start + timedelta(hours=i), 'end_time': start + timedelta(hours=i, minutes=20),
+        'start_address': 'Home', 'end_address': 'Office', 'distance_km': Decimal('5.10'),
+        'duration_minutes': 20, 'mode': modes[i % 5], 'co2_kg': Decimal('0.61'), 'cost_usd': Decimal('1.00'),
+        'created_at': start
+    } for i in range(manual)])
+    db.session.commit()
+    return user.id, trip_id
+
+
+def legacy_paths(user_id, trip_id, limit):
+    """The pre-serialization implementations of the benchmarked endpoints"""
+    from flask import jsonify
+    from extensions import db
+    from models.manual_trip import ManualTrip
+    from models.trip import Trip
+    from services.point_store import point_store
+
+    def trips():
+        query = Trip.query.filter_by(user_id=user_id).order_by(Trip.start_time.desc())
+        rows = query.offset(0).limit(limit).all()
+        return jsonify({'trips': [t.to_dict() for t in rows], 'total': query.count(), 'limit': limit, 'offset': 0})
+
+    def manual_trips():
+        rows = ManualTrip.query.filter_by(user_id=user_id).order_by(ManualTrip.start_time.desc()).all()
+        return jsonify([t.to_dict() for t in rows])
+
+    def points():
+        trip = db.session.get(Trip, trip_id)
+        return jsonify({'trip_id': trip_id, 'points': [p.to_dict() for p in point_store.trip_points(trip)]})
+
+    return {'/trips': trips, '/manual-trips': manual_trips, '/trips/<id>/points': points}
+
+
+def timed(app, db, path, fn, repeat):
+    samples = []
+    body = None
+    for _ in range(repeat):
+        with app.test_request_context(path):
+            started = time.perf_counter()
+            response = fn()
+            body = response.get_data()
+            samples.append(time.perf_counter() - started)
+            db.session.remove()
+    return statistics.median(samples) * 1000, body
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trips', type=int, default=2000)
+    parser.add_argument('--points', type=int, default=5000)
+    parser.add_argument('--manual', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=15)
+    options = parser.parse_args(argv)
+
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    try:
+        from app import app
+        from extensions import db
+        from services import serialization
+
+        with app.app_context():
+            db.create_all()
+            user_id, trip_id = seed(db, options.trips, options.points, options.manual)
+
+        legacy = legacy_paths(user_id, trip_id, options.trips)
+        views = {
+            '/trips': (f'/api/trips?user_id={user_id}&limit={options.trips}', app.view_functions['trips.get_trips'], {}),
+            '/manual-trips': (f'/api/manual-trips?user_id={user_id}',
+                              app.view_functions['manual_trip.get_manual_trips'], {}),
+            '/trips/<id>/points': (f'/api/trips/{trip_id}/points', app.view_functions['trips.get_trip_points'],
+                                   {'trip_id': trip_id})
+        }
+
+        backend = 'orjson' if serialization.orjson is not None else 'stdlib json'
+        print(f"{'endpoint':<22}{'rows':>7}{'to_dict ms':>13}{'encoder ms':>13}{'speedup':>10}   ({backend})")
+        with app.app_context():
+            for name, (url, view, kwargs) in views.items():
+                old_ms, old_body = timed(app, db, url, legacy[name], options.repeat)
+                new_ms, new_body = timed(app, db, url, lambda: view(**kwargs), options.repeat)
+                old, new = json.loads(old_body), json.loads(new_body)
+                if old != new:
+                    raise SystemExit(f'{name}: encoder output differs from to_dict()')
+                rows = len(old) if isinstance(old, list) else len(old.get('trips') or old.get('points'))
+                print(f"{name:<22}{rows:>7}{old_ms:>13.1f}{new_ms:>13.1f}{old_ms / new_ms:>9.1f}x")
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Manage user-keyed shards (see services/sharding.py and services/shard_moves.py).
+
+Run from backend/ with the app's DATABASE_URL and DATABASE_SHARD_URLS:
+
+    python tools/shards.py status
+    python tools/shards.py migrate               # alembic upgrade on the primary and every shard
+    python tools/shards.py move 42 shard_2
+    python tools/shards.py rebalance             # show the moves that would even out trip counts
+    python tools/shards.py rebalance --apply --max-moves 20
+
+A new shard starts empty: add its URL, run `migrate`, then `rebalance
+--apply` (or let new sign-ups fill it). To drain a shard, leave it out of
+SHARDS_OPEN and rebalance.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def migrate(app):
+    from services.sharding import BIND_PREFIX, PRIMARY
+
+    urls = {PRIMARY: app.config['SQLALCHEMY_DATABASE_URI']}
+    urls.update((key, url) for key, url in sorted(app.config['SQLALCHEMY_BINDS'].items())
+                if key.startswith(BIND_PREFIX))
+    for name, url in urls.items():
+        print(f"== {name}")
+        # The migrations run against DATABASE_URL, so each shard gets its own run
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'db', 'upgrade'],
+                       cwd=BACKEND_DIR, env={**os.environ, 'DATABASE_URL': url}, check=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('status', help='users, trips and points per shard')
+    commands.add_parser('migrate', help='run the database migrations on every shard')
+    move = commands.add_parser('move', help="move one user's data to another shard")
+    move.add_argument('user_id', type=int)
+    move.add_argument('shard')
+    rebalance = commands.add_parser('rebalance', help='even out trip counts across the open shards')
+    rebalance.add_argument('--max-moves', type=int, default=10)
+    rebalance.add_argument('--apply', action='store_true', help='make the moves instead of listing them')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+
+    from app import app
+    from services import shard_moves
+    from services.sharding import shards
+
+    if options.command == 'migrate':
+        migrate(app)
+        return
+
+    with app.app_context():
+        if not shards.enabled:
+            raise SystemExit('No shards configured; set DATABASE_SHARD_URLS')
+        if options.command == 'status':
+            open_shards = shards.open_shards()
+            for name, size in shard_moves.shard_sizes().items():
+                state = 'open' if name in open_shards else 'closed'
+                print(f"{name:<12} {state:<7} {size['users']:>8} users {size['trips']:>10} trips "
+                      f"{size['points']:>12} points")
+        elif options.command == 'move':
+            print(shard_moves.move_user(options.user_id, options.shard))
+        elif options.command == 'rebalance':
+            moves = shard_moves.plan_rebalance(options.max_moves)
+            for move in moves:
+                print(f"user {move['user_id']}: {move['from']} -> {move['to']} ({move['trips']} trips)")
+                if options.apply:
+                    shard_moves.move_user(move['user_id'], move['to'])
+            verb = 'Made' if options.apply else 'Would make'
+            print(f"{verb} {len(moves)} move(s)")
+
+
+if __name__ == '__main__':
+    main()
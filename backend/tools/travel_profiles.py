@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Maintain per-user travel profiles (see services/travel_profile.py).
+Run from backend/ with the app's database settings:
+
+    python tools/travel_profiles.py backfill       # queue a build for every user without a profile
+    python tools/travel_profiles.py rebuild 42     # recount one user's profile here
+
+Run `backfill` once after upgrading to the user_travel_profiles table so
+existing users have their profiles before they next open the predictions
+page; the job workers build them in the background.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('backfill', help='queue a rebuild for every user without a profile')
+    rebuild = commands.add_parser('rebuild', help="recount one user's profile in this process")
+    rebuild.add_argument('user_id', type=int)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+
+    from app import app
+    from services import sharding, travel_profile
+
+    with app.app_context():
+        if options.command == 'backfill':
+            queued = travel_profile.backfill()
+            print(f"Queued {queued} travel profile rebuild(s); the job workers build them")
+            return
+        with sharding.for_user(options.user_id):
+            print(json.dumps(travel_profile.rebuild_profile(options.user_id).to_dict(), indent=2, default=str))
+
+
+if __name__ == '__main__':
+    main()
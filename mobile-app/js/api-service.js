@@ -2,7 +2,7 @@
 class ApiService {
     constructor() {
         this.baseUrl = 'http://localhost:5000/api';
-        this.apiKey = null;
+        this.apiKey = localStorage.getItem('apiKey');
     }
     
     async request(endpoint, options = {}) {
@@ -56,8 +56,9 @@ class ApiService {
             body: JSON.stringify({ username, password }),
         });
         
-        if (response.user) {
-            this.apiKey = response.user.id; // Simple auth for prototype
+        if (response.access_token) {
+            this.apiKey = response.access_token;
+            localStorage.setItem('apiKey', this.apiKey);
         }
         
         return response;
@@ -92,10 +93,11 @@ class ApiService {
         return this.request(`/trips/${tripId}`);
     }
     
-    async createTrip(tripData) {
+    async createTrip(tripData, idempotencyKey = null) {
         return this.request('/trips', {
             method: 'POST',
             body: JSON.stringify(tripData),
+            headers: idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : {},
         });
     }
     
@@ -119,6 +121,13 @@ class ApiService {
         });
     }
     
+    async addTripPoints(tripId, points) {
+        return this.request(`/trips/${tripId}/points/batch`, {
+            method: 'POST',
+            body: JSON.stringify({ points }),
+        });
+    }
+    
     async getTripPoints(tripId) {
         return this.request(`/trips/${tripId}/points`);
     }
@@ -180,7 +189,8 @@ class ApiService {
         
         for (const trip of offlineTrips) {
             try {
-                const response = await this.createTrip(trip);
+                // The offline id doubles as idempotency key, so a re-sync cannot duplicate the trip
+                const response = await this.createTrip(trip, trip.id);
                 syncedTrips.push(response.trip);
             } catch (error) {
                 console.error('Failed to sync trip:', error);